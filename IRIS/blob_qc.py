@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+This model is used to check the quality of detected blobs, by comparing them with random positions of the same image.
+
+As in blob detection, the score of a position is the mean gray scale of its core (4x4) region subtracted by that of its
+surrounding (10x10) region. The scores of all detected blobs and the same number of random positions are calculated
+at once by the box sums of the kernels of blob detection, from an integral image, so that the image is read only once
+and each score costs constant time. Real blobs should be scored much higher than random positions, which are mostly
+background.
+
+The distributions of scores are output, together with a summary of the signal-to-background ratio, which is the mean
+gray scale in the core region of detected blobs against that of random positions, and the fraction of detected blobs
+scored above 95% of random positions.
+"""
+
+
+from sys import (argv, stderr)
+from json import dump
+from cv2 import (imread, IMREAD_GRAYSCALE)
+from numpy import (asarray, concatenate, mean, median, percentile, int64, float64)
+from numpy.random import default_rng
+
+from .kernels import box_sums
+
+
+def blob_scores(f_img, f_rows, f_cols):
+    """
+    This function is used to calculate the core mean and the score of positions.
+
+    Boxes are taken as the slices 'img[(r - 1):(r + 3), (c - 1):(c + 3)]' and 'img[(r - 4):(r + 6), (c - 4):(c + 6)]'
+    of blob detection, and their sums are always divided by the full size of box.
+
+    :param f_img: The image matrix.
+    :param f_rows: Row coordinates of positions.
+    :param f_cols: Column coordinates of positions.
+    :return: A tuple of the core means and the scores (core mean subtracted by surrounding mean).
+    """
+    core_sums, surrounding_sums = box_sums(f_img[None], f_rows, f_cols, [(-1, 4), (-4, 10)])
+
+    core = core_sums[:, 0] / 16
+    surrounding = surrounding_sums[:, 0] / 100
+
+    return core, core - surrounding
+
+
+def blob_qc(f_img, f_reads, f_prefix, f_seed=None):
+    """
+    This function is used to compare the detected blobs with random positions, and output their scores and summary.
+
+    Two files are generated: '<prefix>.txt' stores the score of each detected blob ('dete') and random position
+    ('stoc'), and '<prefix>.json' stores the summary.
+
+    :param f_img: The image matrix, such as the background.
+    :param f_reads: A list of reads, each of which is composed of id, sequence, quality, row and column. Reads with
+                    any 'N' base are skipped.
+    :param f_prefix: The prefix of output files.
+    :param f_seed: The seed for drawing random positions.
+    :return: A dictionary of summary.
+    """
+    reads = [_ for _ in f_reads if 'N' not in _[1]]
+
+    rows = asarray([_[3] for _ in reads], dtype=float64).astype(int64)
+    cols = asarray([_[4] for _ in reads], dtype=float64).astype(int64)
+
+    #####################################################################
+    # All the random positions are drawn in one call, one for each blob #
+    #####################################################################
+    rng = default_rng(f_seed)
+
+    stoc_rows = rng.integers(0, f_img.shape[0], rows.size)
+    stoc_cols = rng.integers(0, f_img.shape[1], cols.size)
+    #####################################################################
+
+    core, score = blob_scores(f_img, concatenate((rows, stoc_rows)), concatenate((cols, stoc_cols)))
+
+    dete_core, stoc_core = core[:rows.size], core[rows.size:]
+    dete_score, stoc_score = score[:rows.size], score[rows.size:]
+
+    summary = {'blobs': int(rows.size)}
+
+    if rows.size > 0:
+        summary.update({'mean_score_detected': float(mean(dete_score)),
+                        'mean_score_random': float(mean(stoc_score)),
+                        'median_score_detected': float(median(dete_score)),
+                        'median_score_random': float(median(stoc_score)),
+                        'signal_to_background': float(mean(dete_core) / max(float(mean(stoc_core)), 1e-6)),
+                        'fraction_above_random_95': float(mean(dete_score > percentile(stoc_score, 95)))})
+
+    with open(f_prefix + '.txt', 'wt') as OU:
+        for _ in range(0, rows.size):
+            print('%d\tdete' % dete_score[_], file=OU)
+            print('%d\tstoc' % stoc_score[_], file=OU)
+
+    with open(f_prefix + '.json', 'wt') as OU:
+        dump(summary, OU, indent=4)
+
+    return summary
+
+
+if __name__ == '__main__':
+    if len(argv) == 3:
+        with open(argv[2], 'rt') as IN:
+            coordinate_reads = [_.split() for _ in IN if not _.startswith('#')]
+
+        blob_qc(imread(argv[1], IMREAD_GRAYSCALE), coordinate_reads, 'debug.dete_stoc')
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <image> <basecalling data>', file=stderr)
@@ -13,7 +13,6 @@ number of failure and treat it as error rate.
 
 
 from numpy import (around, transpose, nonzero)
-from scipy.stats import binom_test
 
 
 def image_model_pooling_Ke(f_image_model_A, f_image_model_T, f_image_model_C, f_image_model_G):
@@ -118,6 +117,13 @@ def pool2base(f_image_model_pool, binom=None):
     """
     f_base_box = {}
 
+    #######################################################################
+    # 'scipy.stats' is slow to import, thus only imported when it is used #
+    #######################################################################
+    if binom is True:
+        from scipy.stats import binom_test
+    #######################################################################
+
     for read_id in f_image_model_pool:
         sorted_base = [_ for _ in sorted(f_image_model_pool[read_id].items(), key=lambda x: x[1], reverse=True)]
 
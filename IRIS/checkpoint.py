@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+This model is used to save the results of stages of a run, so that a run which died could be resumed from them.
+
+The checkpoints of a FOV are kept in a directory, with a manifest of the hashes of input images and the parameters
+which affect the results, such as the method of registration and the parameters of blob detector. When a run is
+resumed, the manifest is checked against its inputs and parameters, and the checkpoints are used only if they match,
+otherwise they are discarded and the run starts over.
+
+A stage could be saved with the number of inputs it depends on, such as the detection of a cycle, which only depends
+on the images of this cycle and the ones before it. If the inputs of a resumed run extend the ones of the previous run,
+such as a new cycle appended, the stages of which all the inputs are unchanged are kept, while the others (the ones
+depending on all the inputs) are discarded. The manifest also keeps the information of run given, such as the
+cycles, which is not compared, so that a run could be extended from its checkpoints alone.
+
+Each checkpoint is written into a temporary file and then renamed, as well as the manifest, so that a run killed in
+writing never leaves a broken checkpoint behind.
+
+    checkpoint directory
+    |---manifest.json           (inputs, parameters, information of run and finished stages)
+    |---registration.pkl        (the transform matrices of cycles, the background, the features of reference and the
+    |                            statistics of registration)
+    |---detection.cycle_1.pkl   (the base box of each cycle and the statistics of detection)
+    |---(...)
+    |---filtering.pkl           (the barcode cube with the filtered blobs)
+    |---connection.pkl          (the barcode cube with the adjusted bases)
+"""
+
+
+from sys import stderr
+from os import (makedirs, replace, remove)
+from os.path import (join, exists, abspath)
+from json import (dump, load, dumps, loads)
+from pickle import (dump as dump_pickle, load as load_pickle, HIGHEST_PROTOCOL)
+from hashlib import sha1
+
+
+def hash_file(f_file):
+    """
+    This function is used to hash the content of a file.
+
+    :param f_file: The path of file.
+    :return: The SHA-1 hex digest.
+    """
+    digest = sha1()
+
+    with open(f_file, 'rb') as IN:
+        for chunk in iter(lambda: IN.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def read_manifest(f_directory):
+    """
+    This function is used to read the manifest of checkpoints in a directory.
+
+    :param f_directory: The directory of checkpoints.
+    :return: The dictionary of manifest, or None if there is no manifest.
+    """
+    manifest_file = join(f_directory, 'manifest.json')
+
+    if not exists(manifest_file):
+        return None
+
+    with open(manifest_file, 'rt') as IN:
+        return load(IN)
+
+
+class Checkpoint:
+    def __init__(self, f_directory, f_inputs, f_parameters, f_resume=False, f_info=None):
+        """
+        This method will hash the inputs, and keep the finished stages of the previous run if resumed and matched.
+
+        :param f_directory: The directory of checkpoints.
+        :param f_inputs: A list of input files, in a fixed order.
+        :param f_parameters: A dictionary of parameters which affect the results, which could be dumped as JSON.
+        :param f_resume: Whether to resume from the previous checkpoints.
+        :param f_info: A dictionary of information of run, which is kept in the manifest without being compared, and
+                       could be dumped as JSON.
+        """
+        self.directory = f_directory
+
+        makedirs(self.directory, exist_ok=True)
+
+        self.__manifest = {'inputs': [{'path': abspath(_), 'sha1': hash_file(_)} for _ in f_inputs],
+                           'parameters': loads(dumps(f_parameters)),
+                           'info': {} if f_info is None else loads(dumps(f_info)),
+                           'stages': [],
+                           'input_nums': {}}
+
+        ##################################################################################
+        # The inputs are compared by their content rather than their paths, so that the  #
+        # images could be moved between the runs. A stage saved with its number of       #
+        # inputs is kept as long as these inputs are unchanged                           #
+        ##################################################################################
+        manifest_file = join(self.directory, 'manifest.json')
+
+        if f_resume and exists(manifest_file):
+            with open(manifest_file, 'rt') as IN:
+                previous = load(IN)
+
+            previous_hashes = [_['sha1'] for _ in previous['inputs']]
+            hashes = [_['sha1'] for _ in self.__manifest['inputs']]
+            input_nums = previous.get('input_nums', {})
+
+            if hashes[:len(previous_hashes)] == previous_hashes and \
+                    previous['parameters'] == self.__manifest['parameters']:
+                self.__manifest['stages'] = [_ for _ in previous['stages'] if exists(self.__file(_)) and
+                                             (_ in input_nums or len(hashes) == len(previous_hashes))]
+                self.__manifest['input_nums'] = {_: input_nums[_] for _ in self.__manifest['stages']
+                                                 if _ in input_nums}
+
+            else:
+                print('The checkpoints do not match the inputs or parameters, and the run starts over', file=stderr)
+        ##################################################################################
+
+        for stage in self.__stale_stages():
+            remove(self.__file(stage))
+
+        self.__write_manifest()
+
+    def __file(self, f_stage):
+        """
+        This method is used to get the file of a checkpoint.
+
+        :param f_stage: The name of stage.
+        :return: The path of file.
+        """
+        return join(self.directory, f_stage + '.pkl')
+
+    def __stale_stages(self):
+        """
+        This method is used to find the checkpoints left by a previous run which could not be used.
+
+        :return: A list of names of stages.
+        """
+        manifest_file = join(self.directory, 'manifest.json')
+
+        if not exists(manifest_file):
+            return []
+
+        with open(manifest_file, 'rt') as IN:
+            previous = load(IN)
+
+        return [_ for _ in previous['stages'] if _ not in self.__manifest['stages'] and exists(self.__file(_))]
+
+    def __write_manifest(self):
+        """
+        This method is used to write the manifest atomically.
+
+        :return: NONE
+        """
+        manifest_file = join(self.directory, 'manifest.json')
+
+        with open(manifest_file + '.tmp', 'wt') as OU:
+            dump(self.__manifest, OU, indent=4)
+
+        replace(manifest_file + '.tmp', manifest_file)
+
+    def has(self, f_stage):
+        """
+        This method is used to check whether a stage is finished.
+
+        :param f_stage: The name of stage.
+        :return: True if its checkpoint could be loaded.
+        """
+        return f_stage in self.__manifest['stages']
+
+    def load(self, f_stage):
+        """
+        This method is used to load the result of a finished stage.
+
+        :param f_stage: The name of stage.
+        :return: The result of stage.
+        """
+        with open(self.__file(f_stage), 'rb') as IN:
+            return load_pickle(IN)
+
+    def save(self, f_stage, f_result, f_input_num=None):
+        """
+        This method is used to save the result of a stage, and record it in the manifest.
+
+        :param f_stage: The name of stage.
+        :param f_result: The result of stage, which could be pickled.
+        :param f_input_num: The number of the first inputs which this stage depends on, all the inputs by default.
+        :return: NONE
+        """
+        with open(self.__file(f_stage) + '.tmp', 'wb') as OU:
+            dump_pickle(f_result, OU, HIGHEST_PROTOCOL)
+
+        replace(self.__file(f_stage) + '.tmp', self.__file(f_stage))
+
+        if f_stage not in self.__manifest['stages']:
+            self.__manifest['stages'].append(f_stage)
+
+        if f_input_num is None:
+            self.__manifest['input_nums'].pop(f_stage, None)
+
+        else:
+            self.__manifest['input_nums'][f_stage] = int(f_input_num)
+
+        self.__write_manifest()
+
+
+if __name__ == '__main__':
+    pass
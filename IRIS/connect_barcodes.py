@@ -7,20 +7,30 @@ method 'collect_called_bases' is used to record the called bases in each cycle,
 filter the bad or indistinguishable blobs by mapping them into a mask layer. At last, the method 'calling_adjust' is
 used to connect the bases as barcodes, by anchoring the coordinates of blobs in reference layer, and search their 6x6
 region in each cycle.
+
+If a codebook is given to 'calling_adjust', the blobs are pruned after each cycle. A blob whose partial barcode is
+farther than the Hamming distance of codebook from the prefix of every codeword could never be decoded, thus it is
+dropped, and the following cycles are only connected for the rest of blobs.
 """
 
 
 from sys import stderr
 from cv2 import (SimpleBlobDetector_Params, SimpleBlobDetector, GaussianBlur)
-from numpy import (sqrt, zeros, uint8)
+from numpy import (zeros, where, uint8)
+
+from .kernels import search_min_error
+from .profiler import PROFILER
 
 
 class BarcodeCube:
-    def __init__(self):
+    def __init__(self, f_search_region=None):
         """
         This method will initialize three members. '__all_blobs_list' stores all blobs' id; 'bases_cube' is
         a list stored the dictionary of bases in each cycle; and 'adjusted_bases_cube' is a list stored
         the dictionary of bases in each cycle, with error rate adjusted.
+
+        :param f_search_region: The search region n for connecting bases, which searches a ((n + 1) * 2)x((n + 1) * 2)
+                                region, 2 (6x6) by default.
         """
         self.__all_blobs_list = []
 
@@ -31,7 +41,7 @@ class BarcodeCube:
         # Setup search region                                                                                      #
         # The larger you set, TPR might increase but less blobs are called because some dense blobs might collapse #
         ############################################################################################################
-        self.__search_region = 2  # 6x6
+        self.__search_region = 2 if f_search_region is None else int(f_search_region)  # 6x6
         ########
         # self.__search_region = 0  # Alternative option, 2x2
         # self.__search_region = 1  # Alternative option, 4x4
@@ -64,6 +74,8 @@ class BarcodeCube:
         :param f_background: The background image for ensuring the shape of mask layer.
         :return: NONE
         """
+        PROFILER.begin('redundancy filtering')
+
         blobs_mask = zeros(f_background.shape, dtype=uint8)
 
         new_coor = set()
@@ -106,6 +118,9 @@ class BarcodeCube:
             new_coor.add(str('r' + ('%05d' % r) + 'c' + ('%05d' % c)))
 
         self.__all_blobs_list = new_coor
+
+        PROFILER.count('blobs', len(self.__all_blobs_list))
+        PROFILER.end()
     ########
 
     ###############################
@@ -117,9 +132,53 @@ class BarcodeCube:
 
         A new list will be generated, which store the filtered id of bases
         """
-        new_coor = self.__all_blobs_list
+        PROFILER.begin('redundancy filtering')
+
+        ##################################################################################
+        # The blobs are visited as a list, from which their neighbours are removed while #
+        # it is visited, thus the blob right behind a removed one earlier in the list is #
+        # skipped. This order is kept by counting the blobs left with a Fenwick tree,    #
+        # and the first one left of a coordinate (the one 'list.remove' removes) is      #
+        # found from its positions, instead of searching the list for each neighbour     #
+        ##################################################################################
+        blobs = list(self.__all_blobs_list)
+        blob_num = len(blobs)
+
+        positions = {}
+
+        for idx, coor in enumerate(blobs):
+            positions.setdefault(coor, []).append(idx)
+
+        firsts = dict.fromkeys(positions, 0)
+
+        tree = [0] * (blob_num + 1)
+
+        for idx in range(1, blob_num + 1):
+            tree[idx] += 1
+
+            if idx + (idx & -idx) <= blob_num:
+                tree[idx + (idx & -idx)] += tree[idx]
+
+        top_bit = 1 << (blob_num.bit_length() - 1) if blob_num > 0 else 0
+
+        left_num = blob_num
+        rank = 0
+
+        while rank < left_num:
+            idx = 0
+            bit = top_bit
+            remain = rank
+
+            while bit > 0:
+                if idx + bit <= blob_num and tree[idx + bit] <= remain:
+                    idx += bit
+                    remain -= tree[idx]
+
+                bit >>= 1
+
+            coor = blobs[idx]
+            rank += 1
 
-        for coor in self.__all_blobs_list:
             if int(coor[1:6]) == 0 or int(coor[7:]) == 0:
                 continue
 
@@ -131,80 +190,118 @@ class BarcodeCube:
                     if row == r and col == c:
                         continue
 
-                    elif 'r%05dc%05d' % (row, col) in self.__all_blobs_list:
-                        new_coor.remove('r%05dc%05d' % (row, col))
+                    neighbour = 'r%05dc%05d' % (row, col)
+
+                    if neighbour in firsts and firsts[neighbour] < len(positions[neighbour]):
+                        idx = positions[neighbour][firsts[neighbour]] + 1
+                        firsts[neighbour] += 1
+                        left_num -= 1
+
+                        while idx <= blob_num:
+                            tree[idx] -= 1
+                            idx += idx & -idx
+
+        new_coor = [_ for _ in firsts if firsts[_] < len(positions[_])]
+        ##################################################################################
 
         self.__all_blobs_list = set(new_coor)
+
+        PROFILER.count('blobs', len(self.__all_blobs_list))
+        PROFILER.end()
     ###############################
 
     #################################
 
-    def calling_adjust(self):
+    def calling_adjust(self, f_codebook=None):
         """
         This method is used to connect bases into barcodes by anchoring the coordinates of blobs in reference layer,
         and searching their NxN region in each cycle.
 
+        :param f_codebook: The 'Codebook' object for pruning the blobs which could never be decoded, after each cycle.
+                           No blobs are pruned by default.
         :return: NONE
         """
         def __check_greyscale(all_blobs_list, bases_cube, adjusted_bases_cube, cycle_serial):
             """"""
             adjusted_bases_cube[cycle_serial] = {}
 
-            for ref_coordinate in all_blobs_list:
-                if int(ref_coordinate[1:6]) == 0 or int(ref_coordinate[7:]) == 0:
-                    continue
-
-                r = int(ref_coordinate[1:6].lstrip('0'))
-                c = int(ref_coordinate[7:].lstrip('0'))
-
-                max_qul_base = 'N'
-                min_err_rate = float(1)
-
-                ##################################################################################################
-                # It will search a NxN region to connect bases from each cycle in ref-coordinates                #
-                #                                                                                                #
-                # Process of registration almost align all location of cycles the same, but at pixel level, this #
-                # registration is not accurate enough. Here, we choose a simple approach to solve this problem.  #
-                # We get locations of blobs from a reference image layer, then to search a NxN (6x6 by default)  #
-                # region in those cycles that need to be connected. This approach should not only solve this     #
-                # problem but also bring few false positive in output                                            #
-                ##################################################################################################
-                for row in range(r - self.__search_region, r + (self.__search_region + 2)):
-                    for col in range(c - self.__search_region, c + (self.__search_region + 2)):
-                        coor = 'r%05dc%05d' % (row, col)
-
-                        if coor in bases_cube[cycle_serial]:
-                            error_rate = bases_cube[cycle_serial][coor][1]
-
-                            ##############################################################
-                            # Adjust of error rate of each coordinate by the Pythagorean #
-                            # theorem. This function can be off if not needed            #
-                            ##############################################################
-                            D = sqrt((row - r) ** 2 + (col - c) ** 2)
-                            adj_err_rate = sqrt(((error_rate * D) ** 2) + (error_rate ** 2))
-                            ########
-                            # adj_err_rate = error_rate  # Alternative option
-                            ##############################################################
-
-                            if adj_err_rate > 1:
-                                adj_err_rate = float(1)
-
-                            if adj_err_rate < min_err_rate:
-                                max_qul_base = bases_cube[cycle_serial][coor][0]
-                                min_err_rate = adj_err_rate
-                ##################################################################################################
-
-                adjusted_bases_cube[cycle_serial].update({ref_coordinate: [max_qul_base, min_err_rate]})
+            ref_coordinates = [_ for _ in all_blobs_list if int(_[1:6]) != 0 and int(_[7:]) != 0]
+            base_coordinates = list(bases_cube[cycle_serial])
+
+            ##################################################################################################
+            # It will search a NxN region to connect bases from each cycle in ref-coordinates                #
+            #                                                                                                #
+            # Process of registration almost align all location of cycles the same, but at pixel level, this #
+            # registration is not accurate enough. Here, we choose a simple approach to solve this problem.  #
+            # We get locations of blobs from a reference image layer, then to search a NxN (6x6 by default)  #
+            # region in those cycles that need to be connected. This approach should not only solve this     #
+            # problem but also bring few false positive in output                                            #
+            #                                                                                                #
+            # The error rate of each coordinate is adjusted by the Pythagorean theorem, with its distance to #
+            # the ref-coordinate, and the base of the least adjusted error rate is chosen. The search of all #
+            # ref-coordinates is run at once by 'search_min_error'                                           #
+            ##################################################################################################
+            chosen, min_err_rates = search_min_error([int(_[1:6]) for _ in base_coordinates],
+                                                     [int(_[7:]) for _ in base_coordinates],
+                                                     [bases_cube[cycle_serial][_][1] for _ in base_coordinates],
+                                                     [int(_[1:6]) for _ in ref_coordinates],
+                                                     [int(_[7:]) for _ in ref_coordinates],
+                                                     self.__search_region)
+            ##################################################################################################
+
+            for ref_id, ref_coordinate in enumerate(ref_coordinates):
+                if chosen[ref_id] < 0:
+                    adjusted_bases_cube[cycle_serial].update({ref_coordinate: ['N', float(1)]})
+
+                else:
+                    adjusted_bases_cube[cycle_serial].update({
+                        ref_coordinate: [bases_cube[cycle_serial][base_coordinates[chosen[ref_id]]][0],
+                                         min_err_rates[ref_id]]})
+
+        PROFILER.begin('calling_adjust')
+
+        blobs = set(self.__all_blobs_list)
+        partial_barcodes = {}
+        pruned_num = 0
 
         if len(self.bases_cube) > 0:
             for cycle_id in range(0, len(self.bases_cube)):
                 self.adjusted_bases_cube.append({})
 
-                __check_greyscale(set(self.__all_blobs_list), self.bases_cube, self.adjusted_bases_cube, cycle_id)
+                __check_greyscale(blobs, self.bases_cube, self.adjusted_bases_cube, cycle_id)
+
+                ##########################################################################
+                # The partial barcodes are extended by the base of this cycle, and the   #
+                # pruned blobs are removed from all the connected cycles                 #
+                ##########################################################################
+                if f_codebook is not None:
+                    blobs = list(self.adjusted_bases_cube[cycle_id])
+
+                    partial_barcodes = {_: partial_barcodes.get(_, '') + self.adjusted_bases_cube[cycle_id][_][0]
+                                        for _ in blobs}
+
+                    matched = f_codebook.match_prefixes([partial_barcodes[_] for _ in blobs])
+
+                    for blob_id in where(~matched)[0]:
+                        del partial_barcodes[blobs[blob_id]]
+
+                        for adjusted_bases in self.adjusted_bases_cube:
+                            del adjusted_bases[blobs[blob_id]]
+
+                    pruned_num += int((~matched).sum())
+
+                    blobs = set(partial_barcodes)
+                ##########################################################################
 
             if len(self.bases_cube) == 1:
                 print('There is only one cycle in this run', file=stderr)
 
+        if f_codebook is not None:
+            PROFILER.count('pruned', pruned_num)
+
+        PROFILER.count('blobs', len(self.adjusted_bases_cube[0]) if len(self.adjusted_bases_cube) > 0 else 0)
+        PROFILER.end()
+
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+This model is used to aggregate the reads into a gene x spatial-bin count matrix.
+
+The background image is split into square bins or hexagonal bins of a given size, and each read is counted in the bin
+where it locates, under its gene name (if decoded by a codebook) or its barcode sequence. The reads with any 'N' base
+or unassigned gene are not counted.
+
+Reads are aggregated in chunks, so that a result file could be streamed through with a bounded memory, which only
+grows with the number of non-zero entries of the count matrix. The matrix is written in the MatrixMarket coordinate
+format, together with the names of genes and bins. Since bins are labeled by their grid indexes, matrices of
+different FOVs (in a common coordinate system) or different runs could be merged additively.
+"""
+
+
+from sys import (argv, stderr)
+from numpy import (array, asarray, concatenate, unique, bincount, floor, around, abs, sqrt, where,
+                   int64, float64)
+
+
+class CountMatrix:
+    def __init__(self, f_bin_size, f_bin_shape=None):
+        """
+        This method will initialize an empty count matrix.
+
+        :param f_bin_size: The edge length of square bins, or the distance between the centers of adjacent hexagonal
+                           bins.
+        :param f_bin_shape: The shape of bins, 'square' (default) or 'hex'.
+        """
+        self.bin_size = float(f_bin_size)
+        self.bin_shape = 'square' if f_bin_shape is None else f_bin_shape
+
+        if self.bin_shape not in ('square', 'hex'):
+            print('Only square or hex bins could be used', file=stderr)
+            exit(1)
+
+        self.genes = []
+        self.__gene_idx = {}
+
+        ###########################################################################
+        # Each non-zero entry is packed into an integer by its gene and bin index #
+        ###########################################################################
+        self.__keys = array([], dtype=int64)
+        self.__counts = array([], dtype=int64)
+        ###########################################################################
+
+        self.__pending = []
+        self.__pending_size = 0
+
+    @staticmethod
+    def __pack(f_gene, f_bin_row, f_bin_col):
+        """
+        This method is used to pack the gene and bin index of entries into integers.
+
+        :param f_gene: Indexes of genes.
+        :param f_bin_row: Row indexes of bins.
+        :param f_bin_col: Column indexes of bins.
+        :return: The packed integers.
+        """
+        return (f_gene << 42) | ((f_bin_row + 1) << 21) | (f_bin_col + 1)
+
+    @staticmethod
+    def __unpack(f_keys):
+        """
+        This method is used to unpack integers into the gene and bin index of entries.
+
+        :param f_keys: The packed integers.
+        :return: A tuple of indexes of genes, row indexes and column indexes of bins.
+        """
+        return f_keys >> 42, ((f_keys >> 21) & 0x1FFFFF) - 1, (f_keys & 0x1FFFFF) - 1
+
+    def bin_coordinates(self, f_rows, f_cols):
+        """
+        This method is used to locate the bins of coordinates.
+
+        The hexagonal bins are pointy-topped, and their indexes are in the 'odd-r' offset form, that each odd row of
+        bins is shifted right by a half bin.
+
+        :param f_rows: Row coordinates.
+        :param f_cols: Column coordinates.
+        :return: A tuple of row indexes and column indexes of bins.
+        """
+        f_rows = asarray(f_rows, dtype=float64)
+        f_cols = asarray(f_cols, dtype=float64)
+
+        if self.bin_shape == 'square':
+            return floor(f_rows / self.bin_size).astype(int64), floor(f_cols / self.bin_size).astype(int64)
+
+        ##########################################################################################
+        # Transform the coordinates into the cube coordinates of hexagon, then round them to the #
+        # nearest hexagon center                                                                 #
+        ##########################################################################################
+        radius = self.bin_size / sqrt(3)
+
+        q = (sqrt(3) / 3 * f_cols - f_rows / 3) / radius
+        r = (2 / 3 * f_rows) / radius
+        s = -q - r
+
+        rq = around(q)
+        rr = around(r)
+        rs = around(s)
+
+        dq = abs(rq - q)
+        dr = abs(rr - r)
+        ds = abs(rs - s)
+
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+
+        rq = where(fix_q, -rr - rs, rq)
+        rr = where(fix_r, -rq - rs, rr)
+        ##########################################################################################
+
+        rr = rr.astype(int64)
+        rq = rq.astype(int64)
+
+        return rr, rq + ((rr - (rr & 1)) >> 1)
+
+    def bin_centers(self, f_bin_rows, f_bin_cols):
+        """
+        This method is used to calculate the centers of bins.
+
+        :param f_bin_rows: Row indexes of bins.
+        :param f_bin_cols: Column indexes of bins.
+        :return: A tuple of row and column coordinates of bin centers.
+        """
+        if self.bin_shape == 'square':
+            return (f_bin_rows + 0.5) * self.bin_size, (f_bin_cols + 0.5) * self.bin_size
+
+        radius = self.bin_size / sqrt(3)
+
+        return f_bin_rows * radius * 1.5, (f_bin_cols + 0.5 * (f_bin_rows & 1)) * self.bin_size
+
+    def add_counts(self, f_genes, f_bin_rows, f_bin_cols, f_counts):
+        """
+        This method is used to add counts into the matrix.
+
+        :param f_genes: Gene names of entries.
+        :param f_bin_rows: Row indexes of bins.
+        :param f_bin_cols: Column indexes of bins.
+        :param f_counts: Counts of entries.
+        :return: NONE
+        """
+        for gene in f_genes:
+            if gene not in self.__gene_idx:
+                self.__gene_idx.update({gene: len(self.genes)})
+                self.genes.append(gene)
+
+        gene_idx = array([self.__gene_idx[_] for _ in f_genes], dtype=int64)
+
+        keys, counts = self.__reduce([self.__pack(gene_idx, asarray(f_bin_rows, dtype=int64),
+                                                  asarray(f_bin_cols, dtype=int64))],
+                                     [asarray(f_counts, dtype=int64)])
+
+        ##################################################################################
+        # The entries of each chunk are kept aside, and merged into the matrix only when #
+        # they outnumber it, thus each entry of the matrix is sorted again only a few    #
+        # times (logarithmic in the number of chunks), rather than once for every chunk  #
+        ##################################################################################
+        self.__pending.append((keys, counts))
+        self.__pending_size += keys.size
+
+        if self.__pending_size > self.__keys.size:
+            self.__merge_pending()
+        ##################################################################################
+
+    @staticmethod
+    def __reduce(f_keys, f_counts):
+        """
+        This method is used to sum up the counts of the same keys.
+
+        :param f_keys: A list of arrays of keys.
+        :param f_counts: A list of arrays of counts, one for each array of keys.
+        :return: A tuple of the sorted unique keys and their counts.
+        """
+        keys, inverse = unique(concatenate(f_keys), return_inverse=True)
+
+        return keys, bincount(inverse, weights=concatenate(f_counts), minlength=keys.size).astype(int64)
+
+    def __merge_pending(self):
+        """
+        This method is used to merge the entries kept aside into the matrix.
+
+        :return: NONE
+        """
+        if len(self.__pending) == 0:
+            return
+
+        self.__keys, self.__counts = self.__reduce([self.__keys] + [_[0] for _ in self.__pending],
+                                                   [self.__counts] + [_[1] for _ in self.__pending])
+
+        self.__pending = []
+        self.__pending_size = 0
+
+    def add_reads(self, f_reads):
+        """
+        This method is used to count reads into the matrix.
+
+        :param f_reads: A list of reads, each of which is composed of id, sequence, quality, row, column and
+                        optionally gene name and edit distance.
+        :return: NONE
+        """
+        reads = [_ for _ in f_reads if (_[5] != 'NA' if len(_) > 5 else 'N' not in _[1])]
+
+        if len(reads) == 0:
+            return
+
+        bin_rows, bin_cols = self.bin_coordinates([_[3] for _ in reads], [_[4] for _ in reads])
+
+        self.add_counts([_[5] if len(_) > 5 else _[1] for _ in reads], bin_rows, bin_cols, [1] * len(reads))
+
+    def add_file(self, f_result_file, f_chunk_size=None):
+        """
+        This method is used to count the reads in a result file, by streaming it through in chunks.
+
+        :param f_result_file: The file of base calling result, such as 'basecalling_data.txt'.
+        :param f_chunk_size: The number of reads in each chunk.
+        :return: NONE
+        """
+        chunk_size = 1000000 if f_chunk_size is None else f_chunk_size
+
+        chunk = []
+
+        with open(f_result_file, 'rt') as IN:
+            for ln in IN:
+                if ln.startswith('#'):
+                    continue
+
+                chunk.append(ln.split())
+
+                if len(chunk) == chunk_size:
+                    self.add_reads(chunk)
+                    chunk = []
+
+        self.add_reads(chunk)
+
+    def merge(self, f_count_matrix):
+        """
+        This method is used to add another count matrix of the same bins into this one.
+
+        :param f_count_matrix: A 'CountMatrix' object.
+        :return: NONE
+        """
+        if f_count_matrix.bin_size != self.bin_size or f_count_matrix.bin_shape != self.bin_shape:
+            print('Count matrices of different bins could not be merged', file=stderr)
+            exit(1)
+
+        gene_idx, bin_rows, bin_cols, counts = f_count_matrix.entries()
+
+        self.add_counts([f_count_matrix.genes[_] for _ in gene_idx], bin_rows, bin_cols, counts)
+
+    def entries(self):
+        """
+        This method is used to list the non-zero entries of the matrix.
+
+        :return: A tuple of indexes of genes, row indexes and column indexes of bins, and counts.
+        """
+        self.__merge_pending()
+
+        gene_idx, bin_rows, bin_cols = self.__unpack(self.__keys)
+
+        return gene_idx, bin_rows, bin_cols, self.__counts
+
+    def write(self, f_prefix):
+        """
+        This method is used to write the matrix in the MatrixMarket coordinate format.
+
+        Three files are generated: '<prefix>.mtx' stores the counts of genes (rows) in bins (columns),
+        '<prefix>.genes.tsv' stores the gene names, and '<prefix>.bins.tsv' stores the bin labels and their centers.
+
+        :param f_prefix: The prefix of output files.
+        :return: NONE
+        """
+        gene_idx, bin_rows, bin_cols, counts = self.entries()
+
+        bin_keys, bin_idx = unique(((bin_rows + 1) << 21) | (bin_cols + 1), return_inverse=True)
+        label_rows = (bin_keys >> 21) - 1
+        label_cols = (bin_keys & 0x1FFFFF) - 1
+        center_rows, center_cols = self.bin_centers(label_rows, label_cols)
+
+        with open(f_prefix + '.genes.tsv', 'wt') as OU:
+            for gene in self.genes:
+                print(gene, file=OU)
+
+        with open(f_prefix + '.bins.tsv', 'wt') as OU:
+            print('#%s\t%r' % (self.bin_shape, self.bin_size), file=OU)
+
+            for i in range(0, bin_keys.size):
+                print('%s_%d_%d\t%.1f\t%.1f' % (self.bin_shape, label_rows[i], label_cols[i],
+                                                center_rows[i], center_cols[i]), file=OU)
+
+        with open(f_prefix + '.mtx', 'wt') as OU:
+            print('%%MatrixMarket matrix coordinate integer general', file=OU)
+            print('%d %d %d' % (len(self.genes), bin_keys.size, counts.size), file=OU)
+
+            for i in range(0, counts.size):
+                print('%d %d %d' % (gene_idx[i] + 1, bin_idx[i] + 1, counts[i]), file=OU)
+
+    @classmethod
+    def read(cls, f_prefix):
+        """
+        This method is used to read a matrix written by 'write'.
+
+        :param f_prefix: The prefix of input files.
+        :return: A 'CountMatrix' object.
+        """
+        with open(f_prefix + '.genes.tsv', 'rt') as IN:
+            genes = [_.rstrip('\n') for _ in IN]
+
+        with open(f_prefix + '.bins.tsv', 'rt') as IN:
+            bin_shape, bin_size = IN.readline().lstrip('#').split()
+            bins = [[int(_) for _ in ln.split()[0].split('_')[1:]] for ln in IN]
+
+        count_matrix = cls(bin_size, bin_shape)
+
+        with open(f_prefix + '.mtx', 'rt') as IN:
+            IN.readline()
+            IN.readline()
+
+            entries = array([[int(_) for _ in ln.split()] for ln in IN], dtype=int64).reshape(-1, 3)
+
+        bins = array(bins, dtype=int64).reshape(-1, 2)
+
+        count_matrix.add_counts([genes[_ - 1] for _ in entries[:, 0]],
+                                bins[entries[:, 1] - 1, 0], bins[entries[:, 1] - 1, 1], entries[:, 2])
+
+        return count_matrix
+
+
+if __name__ == '__main__':
+    if len(argv) > 4 and argv[1] == '--merge':
+        merged_matrix = CountMatrix.read(argv[3])
+
+        for prefix in argv[4:]:
+            merged_matrix.merge(CountMatrix.read(prefix))
+
+        merged_matrix.write(argv[2])
+
+    elif len(argv) > 4:
+        result_matrix = CountMatrix(argv[2], argv[3])
+
+        for result_file in argv[4:]:
+            result_matrix.add_file(result_file)
+
+        result_matrix.write(argv[1])
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <output prefix> <bin size> <square|hex> <result files>\n'
+              '        ' + argv[0] + ' --merge <output prefix> <matrix prefixes>', file=stderr)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+This model is used to keep a pool of warm workers alive, which run FOV jobs sent over a local Unix socket.
+
+Starting Python and importing the libraries takes much longer than processing a small tile. A daemon imports them
+once in each of its workers, and then each job only costs a message on the socket. Workers keep their pipelines (and
+the loaded codebooks) between jobs of the same configuration.
+
+A job is a line of JSON, with the image directories of cycles ('cycles'), the output directory ('output_dir') and
+optionally any parameter of 'PipelineConfig' without its 'f_' prefix, such as 'mode', 'codebook' or 'formats'. If
+'append' is true, the cycles are appended to the run saved in the output directory instead of starting a new run. All
+the paths should be absolute, since the daemon does not share the working directory of its clients. For each job, the
+daemon answers a line of JSON when it is queued, when a worker starts running it, and when it is done (with the number
+of reads and its wall time) or failed (with the error, which is the last message printed to stderr if the job exits).
+The messages printed to stderr by jobs are also kept in the log of daemon. A connection could send many jobs, and is
+closed after all of them finish. A line of {"command": "shutdown"} stops the daemon after the running jobs.
+
+    python3 -m IRIS.daemon --serve <socket> [--processes N]
+    python3 pyIRIS.py --ke {1..4} --socket <socket>
+
+Only the standard library is imported by this model, so that a client starts in milliseconds.
+"""
+
+
+from sys import (argv, stderr)
+from os import (remove, getpid, dup, dup2, close)
+from os.path import exists
+from json import (dumps, loads)
+from time import time
+from tempfile import TemporaryFile
+from socket import (socket, timeout, AF_UNIX, SOCK_STREAM, SHUT_WR)
+from threading import (Thread, Lock)
+from multiprocessing import (Process, Queue, cpu_count)
+
+
+CONFIG_KEYS = ('mode', 'registration', 'detector_params', 'search_region', 'output_dir', 'formats', 'codebook',
+               'max_distance', 'database', 'bin_size', 'bin_shape', 'checkpoint', 'resume', 'kernels',
+               'projection', 'region', 'prefetch', 'tissue_mask', 'prune')
+
+
+def __work(f_jobs, f_events):
+    """
+    The loop of a worker, which runs jobs until it gets None.
+
+    :param f_jobs: The queue of jobs.
+    :param f_events: The queue of status of jobs.
+    :return: NONE
+    """
+    from .pipeline import (Pipeline, PipelineConfig)
+
+    pipelines = {}
+
+    while True:
+        job = f_jobs.get()
+
+        if job is None:
+            break
+
+        f_events.put({'job': job['job'], 'status': 'running', 'worker': getpid()})
+
+        start = time()
+
+        ##############################################################################
+        # Errors of a job are reported instead of stopping the worker, including the #
+        # ones of 'exit' called by the models, which print their messages to stderr  #
+        # beforehand. Thus stderr of the job is captured by its file descriptor, as  #
+        # the models hold the object of stderr, and passed on to the log of daemon   #
+        ##############################################################################
+        log = TemporaryFile()
+        saved_stderr = dup(2)
+
+        stderr.flush()
+        dup2(log.fileno(), 2)
+
+        try:
+            config = {_: job[_] for _ in CONFIG_KEYS if _ in job}
+            config_key = dumps(config, sort_keys=True)
+
+            if config_key not in pipelines:
+                pipelines.update({config_key: Pipeline(PipelineConfig(**{'f_' + _: config[_] for _ in config}))})
+
+            if job.get('append'):
+                reads = pipelines[config_key].append(job['cycles'], job.get('output_dir'))
+
+            else:
+                reads = pipelines[config_key].run(job['cycles'], job.get('output_dir'))
+
+            f_events.put({'job': job['job'], 'status': 'done', 'reads': len(reads), 'wall_time': time() - start})
+
+        except (Exception, SystemExit) as err:
+            stderr.flush()
+
+            log.seek(0)
+            messages = [_ for _ in log.read().decode(errors='replace').split('\n') if _.strip() != '']
+
+            error = messages[-1] if isinstance(err, SystemExit) and len(messages) > 0 else repr(err)
+
+            f_events.put({'job': job['job'], 'status': 'failed', 'error': error, 'wall_time': time() - start})
+
+        finally:
+            stderr.flush()
+
+            dup2(saved_stderr, 2)
+            close(saved_stderr)
+
+            log.seek(0)
+            stderr.write(log.read().decode(errors='replace'))
+            stderr.flush()
+
+            log.close()
+        ##############################################################################
+
+
+def serve(f_socket_path, f_processes=None):
+    """
+    This function is used to run a daemon until it is shut down.
+
+    :param f_socket_path: The path of Unix socket to listen on.
+    :param f_processes: The number of workers, the number of CPUs by default.
+    :return: NONE
+    """
+    processes = cpu_count() if f_processes is None else int(f_processes)
+
+    jobs = Queue()
+    events = Queue()
+
+    workers = [Process(target=__work, args=(jobs, events), daemon=True) for _ in range(0, processes)]
+
+    for worker in workers:
+        worker.start()
+
+    if exists(f_socket_path):
+        remove(f_socket_path)
+
+    server = socket(AF_UNIX, SOCK_STREAM)
+    server.bind(f_socket_path)
+    server.listen()
+
+    ##########################################################################
+    # A blocked 'accept' could not be interrupted by closing its socket from #
+    # another thread, thus the server checks whether to stop every second    #
+    ##########################################################################
+    server.settimeout(1)
+    stopping = [False]
+    ##########################################################################
+
+    ###################################################################################
+    # Each job is bound to the connection which sent it, and each connection is open  #
+    # until its client stops sending and all its jobs finish                          #
+    ###################################################################################
+    lock = Lock()
+    job_clients = {}
+    job_count = [0]
+
+    def __send(f_client, f_message):
+        try:
+            with f_client['lock']:
+                f_client['conn'].sendall((dumps(f_message) + '\n').encode())
+
+        except OSError:
+            pass
+
+    def __close_if_finished(f_client):
+        with lock:
+            finished = f_client['eof'] and f_client['pending'] == 0
+
+        if finished:
+            f_client['conn'].close()
+
+    def __dispatch():
+        while True:
+            event = events.get()
+
+            if event is None:
+                break
+
+            with lock:
+                client = job_clients.get(event['job'])
+
+                if event['status'] in ('done', 'failed'):
+                    job_clients.pop(event['job'], None)
+                    client['pending'] -= 1
+
+            __send(client, event)
+
+            if event['status'] in ('done', 'failed'):
+                __close_if_finished(client)
+
+    def __receive(f_client):
+        try:
+            for ln in f_client['conn'].makefile('r'):
+                if ln.strip() == '':
+                    continue
+
+                try:
+                    job = loads(ln)
+
+                except ValueError:
+                    __send(f_client, {'status': 'failed', 'error': 'Invalid JSON'})
+                    continue
+
+                if job.get('command') == 'shutdown':
+                    __send(f_client, {'status': 'shutdown'})
+                    stopping[0] = True
+                    break
+
+                if 'cycles' not in job:
+                    __send(f_client, {'status': 'failed', 'error': 'No cycles'})
+                    continue
+
+                with lock:
+                    job_count[0] += 1
+                    job.update({'job': job_count[0]})
+
+                    job_clients.update({job['job']: f_client})
+                    f_client['pending'] += 1
+
+                __send(f_client, {'job': job['job'], 'status': 'queued'})
+                jobs.put(job)
+
+        finally:
+            f_client['eof'] = True
+            __close_if_finished(f_client)
+    ###################################################################################
+
+    dispatcher = Thread(target=__dispatch, daemon=True)
+    dispatcher.start()
+
+    while not stopping[0]:
+        try:
+            conn, _ = server.accept()
+
+        except timeout:
+            continue
+
+        conn.settimeout(None)
+
+        client = {'conn': conn, 'lock': Lock(), 'pending': 0, 'eof': False}
+
+        Thread(target=__receive, args=(client,), daemon=True).start()
+
+    server.close()
+
+    ################################################################
+    # The running and queued jobs are finished before workers stop #
+    ################################################################
+    for _ in workers:
+        jobs.put(None)
+
+    for worker in workers:
+        worker.join()
+
+    events.put(None)
+    dispatcher.join()
+
+    if exists(f_socket_path):
+        remove(f_socket_path)
+    ################################################################
+
+
+def submit(f_socket_path, f_jobs):
+    """
+    This function is used to send jobs to a daemon, and wait for their status.
+
+    :param f_socket_path: The path of Unix socket of daemon.
+    :param f_jobs: A list of jobs, each of which is a dictionary.
+    :return: A generator of the status of jobs, each of which is a dictionary.
+    """
+    client = socket(AF_UNIX, SOCK_STREAM)
+
+    try:
+        client.connect(f_socket_path)
+
+    except OSError:
+        print('THE DAEMON COULD NOT BE CONNECTED: ' + f_socket_path, file=stderr)
+        exit(1)
+
+    client.sendall(''.join(dumps(_) + '\n' for _ in f_jobs).encode())
+    client.shutdown(SHUT_WR)
+
+    for ln in client.makefile('r'):
+        yield loads(ln)
+
+    client.close()
+
+
+if __name__ == '__main__':
+    if '--serve' in argv:
+        socket_path = argv[argv.index('--serve') + 1]
+        process_num = None
+
+        if '--processes' in argv:
+            process_num = int(argv[argv.index('--processes') + 1])
+
+        serve(socket_path, process_num)
+
+    elif '--shutdown' in argv:
+        for status in submit(argv[argv.index('--shutdown') + 1], [{'command': 'shutdown'}]):
+            print(dumps(status), file=stderr)
+
+    elif len(argv) == 4 and argv[1] == '--submit':
+        with open(argv[3], 'rt') as IN:
+            job_list = [loads(_) for _ in IN if _.strip() != '']
+
+        for status in submit(argv[2], job_list):
+            print(dumps(status))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' --serve <socket> [--processes N]\n'
+              '        ' + argv[0] + ' --submit <socket> <jobs file of JSON lines>\n'
+              '        ' + argv[0] + ' --shutdown <socket>', file=stderr)
@@ -5,39 +5,118 @@ result of base calling.
 """
 
 
+from os.path import join
 from cv2 import imwrite
 from numpy import log10
 
+from .store_reads import write_reads_into_database
+from .export_reads import (SEQUENCE_FORMATS, write_reads_into_fastq, write_reads_into_sam)
+from .blob_qc import blob_qc
+from .profiler import PROFILER
 
-def write_reads_into_file(f_background, f_barcode_cube, f_barcode_length):
+
+def assemble_reads(f_barcode_cube, f_barcode_length):
+    """
+    This function is used to transform error rate into Phred+ 33 score, and assemble the connected bases of each
+    blob into a read.
+
+    :param f_barcode_cube: The connected barcode, with error rate of each base.
+    :param f_barcode_length: The length of barcode.
+    :return: A list of reads, each of which is composed of id, sequence, quality, row and column.
+    """
+    reads = []
+
+    for j in f_barcode_cube[0]:
+        seq = []
+        qul = []
+
+        for k in range(0, f_barcode_length):
+            if f_barcode_cube[k][j][1] is not None:
+                ###############################################################
+                # Transforming the error rate into the Phred+ 33 score system #
+                # It is also transform to the Phred+ 64 score system if need  #
+                ###############################################################
+                quality = int(-10 * log10(f_barcode_cube[k][j][1] + 0.0001)) + 33
+                ########
+                # quality = int(-10 * log10(f_barcode_cube[k][j][1] + 0.001)) + 64  # Alternative option
+
+                seq.append(f_barcode_cube[k][j][0])
+                qul.append(chr(quality))
+
+        reads.append((j, ''.join(seq), ''.join(qul), j[1:6], j[7:]))
+
+    return reads
+
+
+def write_reads_into_file(f_background, f_barcode_cube, f_barcode_length, f_codebook=None, f_database=None,
+                          f_count_matrix=None, f_output_dir=None, f_sequence_formats=None, f_run_summary=None):
     """
     This function is used to transform error rate into Phred+ 33 score, then output the background and the
     formatted result of base calling.
 
+    If a codebook is given, the reads are decoded into genes, and two columns, the gene name and the edit distance
+    to its codeword, are appended to each read. If a database is given, the reads are also stored into it for
+    querying them by region. If a count matrix is given, the reads are counted into spatial bins and the matrix is
+    output as 'basecalling_matrix.*'. If the formats of sequences are given, the reads are also written as
+    'basecalling_data.fastq.gz' or 'basecalling_data.sam.gz', compressed in BGZF. The detected blobs are always
+    compared with random positions of the background, and the QC result is output as 'basecalling_qc.*'. If a run
+    summary is given, the reads and the QC result are added into it, and it is output as 'basecalling_summary.*'.
+
     :param f_background: The image matrix of background.
     :param f_barcode_cube: The connected barcode, with error rate of each base.
     :param f_barcode_length: The length of barcode.
-    :return: NONE
+    :param f_codebook: The 'Codebook' object for decoding barcodes into genes.
+    :param f_database: The path of SQLite database with spatial index, which is written if given.
+    :param f_count_matrix: The 'CountMatrix' object, into which the reads are counted if given.
+    :param f_output_dir: The directory of output, the current one by default.
+    :param f_sequence_formats: A list of the formats of sequences to write, 'fastq' and 'sam'.
+    :param f_run_summary: The 'RunSummary' object, into which the statistics of reads are added if given.
+    :return: A list of reads, each of which is composed of id, sequence, quality, row, column and optionally gene name
+             and edit distance.
     """
-    imwrite('background.tif', f_background)
-
-    with open('basecalling_data.txt', 'wt') as ou:
-        for j in f_barcode_cube[0]:
-            coo = [j[1:6], j[7:]]
-            seq = []
-            qul = []
-
-            for k in range(0, f_barcode_length):
-                if f_barcode_cube[k][j][1] is not None:
-                    ###############################################################
-                    # Transforming the error rate into the Phred+ 33 score system #
-                    # It is also transform to the Phred+ 64 score system if need  #
-                    ###############################################################
-                    quality = int(-10 * log10(f_barcode_cube[k][j][1] + 0.0001)) + 33
-                    ########
-                    # quality = int(-10 * log10(f_barcode_cube[k][j][1] + 0.001)) + 64  # Alternative option
-
-                    seq.append(f_barcode_cube[k][j][0])
-                    qul.append(chr(quality))
-
-            print(j + '\t' + ''.join(seq) + '\t' + ''.join(qul) + '\t' + '\t'.join(coo), file=ou)
+    output_dir = '.' if f_output_dir is None else f_output_dir
+
+    PROFILER.begin('output')
+
+    imwrite(join(output_dir, 'background.tif'), f_background)
+
+    reads = assemble_reads(f_barcode_cube, f_barcode_length)
+
+    if f_codebook is not None:
+        genes, distances = f_codebook.decode([_[1] for _ in reads], [_[2] for _ in reads])
+
+        reads = [read + (genes[_], str(distances[_])) for _, read in enumerate(reads)]
+
+    with open(join(output_dir, 'basecalling_data.txt'), 'wt') as ou:
+        for read in reads:
+            print('\t'.join(read), file=ou)
+
+    if f_database is not None:
+        write_reads_into_database(reads, f_database)
+
+    for sequence_format in ([] if f_sequence_formats is None else f_sequence_formats):
+        if sequence_format == 'fastq':
+            write_reads_into_fastq(reads, join(output_dir, SEQUENCE_FORMATS['fastq']))
+
+        else:
+            write_reads_into_sam(reads, join(output_dir, SEQUENCE_FORMATS['sam']))
+
+    if f_count_matrix is not None:
+        f_count_matrix.add_reads(reads)
+        f_count_matrix.write(join(output_dir, 'basecalling_matrix'))
+
+    PROFILER.count('reads', len(reads))
+
+    PROFILER.begin('qc')
+
+    qc_summary = blob_qc(f_background, reads, join(output_dir, 'basecalling_qc'))
+
+    if f_run_summary is not None:
+        f_run_summary.add_reads(reads)
+        f_run_summary.add_blob_qc(qc_summary)
+        f_run_summary.write(join(output_dir, 'basecalling_summary'))
+
+    PROFILER.end()
+    PROFILER.end()
+
+    return reads
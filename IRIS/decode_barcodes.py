@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+This module is used to assign the called barcodes to genes by decoding them against a codebook.
+
+The codebook is the same two-column barcode info file which is imported by DAIBC, with the 1st field indicating the
+barcode sequence and the 2nd one indicating its gene name (the predefined color and shape columns are ignored here).
+
+Each base is packed into 3 bits (A, T, C, G and N), so that a barcode becomes a single integer. Before decoding, all
+the sequences within a Hamming distance of 1 (or 2) from each codeword are enumerated into a sorted neighbour index,
+thus a read can be decoded by a binary search of its packed integer, for millions of reads at once. A read with an
+erroneous base is only corrected when the mismatched bases are of low quality, and a read which falls between two
+codewords at the same distance is assigned to the codeword whose mismatched bases have the lowest total quality.
+
+The prefixes of codewords are indexed in the same way, for each length, so that a partial barcode of the first cycles
+could be checked whether it is still within the Hamming distance of any codeword, and the blobs which could never be
+decoded are dropped before the following cycles are connected.
+"""
+
+
+from sys import stderr
+from itertools import (combinations, product)
+from numpy import (array, zeros, ones, full, frombuffer, searchsorted, argsort, arange, where, unique, concatenate,
+                   int8, int64, uint8, bool_)
+
+
+BASE_CODE = {'A': 0, 'T': 1, 'C': 2, 'G': 3, 'N': 4}
+
+
+class Codebook:
+    def __init__(self, f_codebook_file, f_barcode_length, f_max_distance=None, f_max_mismatch_quality=None):
+        """
+        This method will load the codebook and precompute the neighbour index of all codewords.
+
+        :param f_codebook_file: The barcode info file, of which the 1st field is barcode and the 2nd one is gene.
+        :param f_barcode_length: The length of barcode, which should equal to the number of cycles.
+        :param f_max_distance: The largest Hamming distance to be corrected, 1 or 2.
+        :param f_max_mismatch_quality: The highest Phred score of a mismatched base that could be corrected.
+        """
+        self.barcode_length = f_barcode_length
+
+        self.max_distance = 1 if f_max_distance is None else int(f_max_distance)
+
+        ###############################################################################################
+        # A base called with a quality higher than this is unlikely to be an error, so that a read is #
+        # rather treated as unassigned than corrected                                                 #
+        ###############################################################################################
+        self.max_mismatch_quality = 20 if f_max_mismatch_quality is None else int(f_max_mismatch_quality)
+        ###############################################################################################
+
+        if self.max_distance not in (0, 1, 2):
+            print('Only Hamming distance of 0, 1 or 2 could be corrected', file=stderr)
+            exit(1)
+
+        if self.barcode_length > 21:
+            print('Barcodes longer than 21 bases could not be packed', file=stderr)
+            exit(1)
+
+        self.codewords = []
+        self.genes = []
+
+        with open(f_codebook_file, 'rt') as IN:
+            for ln in IN:
+                ln = ln.split()
+
+                if len(ln) < 2 or ln[0].startswith('#'):
+                    continue
+
+                if len(ln[0]) != self.barcode_length or any(_ not in 'ATCG' for _ in ln[0]):
+                    print('INVALID BARCODE IN CODEBOOK: ' + ln[0], file=stderr)
+                    exit(1)
+
+                self.codewords.append(ln[0])
+                self.genes.append(ln[1])
+
+        self.genes = array(self.genes + ['NA'], dtype=object)
+
+        self.__codeword_codes = self.__encode(self.codewords)
+        self.__index_keys, self.__index_codeword, self.__index_distance, self.__ambiguous = self.__build_index()
+
+        self.__prefix_indices = {}
+
+    def __encode(self, f_seqs, f_length=None):
+        """
+        This method is used to transform sequences into a matrix of 3-bit base codes.
+
+        :param f_seqs: A list of sequences with the same length.
+        :param f_length: The length of sequences, the length of barcode by default.
+        :return: A matrix of base codes, in shape of (number of sequences, length).
+        """
+        length = self.barcode_length if f_length is None else f_length
+
+        lookup = full(256, BASE_CODE['N'], dtype=int8)
+
+        for base in BASE_CODE:
+            lookup[ord(base)] = BASE_CODE[base]
+
+        if len(f_seqs) == 0:
+            return zeros((0, length), dtype=int8)
+
+        return lookup[frombuffer(''.join(f_seqs).encode('ascii'), dtype=uint8)].reshape(-1, length)
+
+    def __pack(self, f_codes):
+        """
+        This method is used to pack the base codes of each sequence into an integer.
+
+        :param f_codes: A matrix of base codes.
+        :return: An array of packed integers.
+        """
+        shifts = 3 * arange(f_codes.shape[1] - 1, -1, -1, dtype=int64)
+
+        return (f_codes.astype(int64) << shifts).sum(axis=1)
+
+    def __build_index(self):
+        """
+        This method is used to enumerate the neighbours of all codewords within the maximum Hamming distance.
+
+        Each neighbour is kept with its nearest codeword. A neighbour which is equally near to several codewords is
+        marked as ambiguous (-1), and its candidates are recorded for the quality-guided assignment.
+
+        :return: A tuple of sorted keys, their codewords, their distances and the candidates of ambiguous keys.
+        """
+        neighbours = {}
+
+        for cw_idx, codes in enumerate(self.__codeword_codes):
+            for dist in range(0, self.max_distance + 1):
+                for positions in combinations(range(0, self.barcode_length), dist):
+                    alternatives = [[_ for _ in BASE_CODE.values() if _ != codes[pos]] for pos in positions]
+
+                    for substitution in product(*alternatives):
+                        variant = codes.copy()
+                        variant[list(positions)] = substitution
+
+                        key = int(self.__pack(variant.reshape(1, -1))[0])
+
+                        if key not in neighbours or neighbours[key][0] > dist:
+                            neighbours.update({key: [dist, [cw_idx]]})
+
+                        elif neighbours[key][0] == dist and cw_idx not in neighbours[key][1]:
+                            neighbours[key][1].append(cw_idx)
+
+        keys = array(sorted(neighbours.keys()), dtype=int64)
+        codeword = zeros(keys.size, dtype=int64)
+        distance = zeros(keys.size, dtype=int64)
+        ambiguous = {}
+
+        for i, key in enumerate(keys.tolist()):
+            distance[i] = neighbours[key][0]
+
+            if len(neighbours[key][1]) == 1:
+                codeword[i] = neighbours[key][1][0]
+
+            else:
+                codeword[i] = -1
+                ambiguous.update({key: neighbours[key][1]})
+
+        return keys, codeword, distance, ambiguous
+
+    def __build_prefix_index(self, f_length):
+        """
+        This method is used to enumerate the sequences within the maximum Hamming distance from the prefixes of all
+        codewords, which are not told apart by codeword, since only their presence is checked.
+
+        The bases of each combination of positions are substituted for all the prefixes at once, including the bases
+        equal to the original ones, which give the sequences of shorter distances.
+
+        :param f_length: The length of prefixes.
+        :return: A sorted array of the packed sequences.
+        """
+        prefixes = unique(self.__codeword_codes[:, :f_length], axis=0)
+
+        shifts = 3 * arange(f_length - 1, -1, -1, dtype=int64)
+        prefix_keys = self.__pack(prefixes)
+
+        keys = [prefix_keys]
+
+        for dist in range(1, self.max_distance + 1):
+            for positions in combinations(range(0, f_length), dist):
+                cleared = prefix_keys - sum(prefixes[:, _].astype(int64) << shifts[_] for _ in positions)
+
+                for substitution in product(BASE_CODE.values(), repeat=dist):
+                    keys.append(cleared + sum(int(base) << int(shifts[pos])
+                                              for base, pos in zip(substitution, positions)))
+
+        return unique(concatenate(keys))
+
+    def match_prefixes(self, f_seqs):
+        """
+        This method is used to check whether the partial barcodes of the first cycles could still be decoded, which
+        are within the maximum Hamming distance from the prefix of any codeword. An 'N' is taken as a mismatch, as it
+        is in decoding.
+
+        :param f_seqs: A list of partial barcodes with the same length.
+        :return: A boolean array, True for the barcodes which could still be decoded.
+        """
+        n = len(f_seqs)
+
+        length = len(f_seqs[0]) if n > 0 else 0
+
+        if length <= self.max_distance:
+            return ones(n, dtype=bool_)
+
+        if length not in self.__prefix_indices:
+            self.__prefix_indices.update({length: self.__build_prefix_index(length)})
+
+        index_keys = self.__prefix_indices[length]
+
+        if index_keys.size == 0:
+            return zeros(n, dtype=bool_)
+
+        read_keys = self.__pack(self.__encode(f_seqs, length))
+
+        pos = searchsorted(index_keys, read_keys)
+        pos[pos == index_keys.size] = 0
+
+        return index_keys[pos] == read_keys
+
+    def decode(self, f_seqs, f_quls):
+        """
+        This method is used to assign the reads to genes.
+
+        :param f_seqs: A list of barcode sequences.
+        :param f_quls: A list of base qualities in the Phred+ 33 score system.
+        :return: A tuple of gene names and edit distances of reads, with 'NA' and -1 for the unassigned ones.
+        """
+        n = len(f_seqs)
+
+        genes = full(n, len(self.codewords), dtype=int64)
+        distances = full(n, -1, dtype=int64)
+
+        if n == 0 or self.__index_keys.size == 0:
+            return self.genes[genes], distances
+
+        read_codes = self.__encode(f_seqs)
+        read_quls = frombuffer(''.join(f_quls).encode('ascii'), dtype=uint8).reshape(n, -1).astype(int64) - 33
+
+        read_keys = self.__pack(read_codes)
+
+        #######################################################
+        # Look up all the packed reads in the neighbour index #
+        #######################################################
+        pos = searchsorted(self.__index_keys, read_keys)
+        pos[pos == self.__index_keys.size] = 0
+
+        hit = self.__index_keys[pos] == read_keys
+
+        hit_idx = where(hit)[0]
+        codeword = self.__index_codeword[pos[hit_idx]]
+        distance = self.__index_distance[pos[hit_idx]]
+        #######################################################
+
+        ###########################################################################################################
+        # The equally near codewords are resolved by the quality of mismatched bases, the codeword which requires #
+        # the lowest-quality bases to be corrected is taken, and the read is left unassigned if there is a tie    #
+        ###########################################################################################################
+        for i in where(codeword == -1)[0]:
+            candidates = self.__ambiguous[int(read_keys[hit_idx[i]])]
+
+            penalties = [int(read_quls[hit_idx[i]][read_codes[hit_idx[i]] != self.__codeword_codes[_]].sum())
+                         for _ in candidates]
+            order = argsort(penalties, kind='stable')
+
+            if len(order) > 1 and penalties[order[0]] == penalties[order[1]]:
+                continue
+
+            codeword[i] = candidates[order[0]]
+        ###########################################################################################################
+
+        resolved = codeword >= 0
+        hit_idx = hit_idx[resolved]
+        codeword = codeword[resolved]
+        distance = distance[resolved]
+
+        ######################################################################
+        # A correction is rejected if any mismatched base is of high quality #
+        ######################################################################
+        mismatched = read_codes[hit_idx] != self.__codeword_codes[codeword]
+        trusted = ~(mismatched & (read_quls[hit_idx] > self.max_mismatch_quality)).any(axis=1)
+
+        genes[hit_idx[trusted]] = codeword[trusted]
+        distances[hit_idx[trusted]] = distance[trusted]
+        ######################################################################
+
+        return self.genes[genes], distances
+
+
+if __name__ == '__main__':
+    pass
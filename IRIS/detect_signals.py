@@ -14,16 +14,35 @@ practice, not only dense fluorescence signal but also sparse blob can be detecte
 algorithm, while the ambiguous ones will be abandoned. After detection, for each detected blobs, blob's base
 score, which is calculated by their gray scale in core (4x4) region being subtracted by surrounding (10x10), is
 recorded to calculate base quality in the next step.
+
+If the regions of tissue are given, the tophat and blob detection are run only in these regions, padded by the reach of
+their windows so that the blobs inside are the same as in the whole image, and the rest of image, which is empty
+glass, is skipped.
 """
 
 
 from cv2 import (getStructuringElement, morphologyEx, GaussianBlur, convertScaleAbs, Laplacian,
                  SimpleBlobDetector, SimpleBlobDetector_Params,
                  MORPH_ELLIPSE, MORPH_TOPHAT, CV_32F)
-from numpy import (asarray, zeros, ones, sum, divide, multiply, around, abs, max, fft, int, float32, uint8, bool_)
-from scipy.stats import mode
+from numpy import (asarray, zeros, ones, sum, divide, multiply, around, abs, max, maximum, minimum, fft, int,
+                   argmax, bincount,
+                   float32, float64, uint8, int64, bool_)
 
 from .call_bases import (image_model_pooling_Ke, image_model_pooling_Chen, pool2base)
+from .kernels import blob_scores
+from .profiler import PROFILER
+
+
+def __mode(f_values):
+    """
+    The most common value, and the smallest one of ties, the same as 'scipy.stats.mode'
+
+    'scipy.stats' is not imported for this, since importing it takes longer than detecting blobs in a small tile.
+
+    :param f_values: Non-negative integral values.
+    :return: The most common value.
+    """
+    return int(argmax(bincount(asarray(f_values, dtype=int64))))
 
 
 def __hpf(f_img):
@@ -45,7 +64,113 @@ def __hpf(f_img):
     return f_img
 
 
-def detect_blobs_Ke(f_cycle):
+def __pad_region(f_region, f_padding, f_shape):
+    """
+    For padding a region by a number of pixels on each side, within the image.
+
+    :param f_region: A region, which is (min row, max row, min column, max column).
+    :param f_padding: The number of pixels padded on each side.
+    :param f_shape: The shape of image, (row, column).
+    :return: The padded region.
+    """
+    min_row, max_row, min_col, max_col = f_region
+
+    return (int(maximum(min_row - f_padding, 0)), int(minimum(max_row + f_padding, f_shape[0])),
+            int(maximum(min_col - f_padding, 0)), int(minimum(max_col + f_padding, f_shape[1])))
+
+
+def __filter_regions(f_filter, f_img, f_regions=None, f_padding=0):
+    """
+    For filtering the regions of an image only, and the rest of image is left as 0.
+
+    Each region is filtered in its crop, padded by the reach of filter, and only the region is pasted back, so that
+    it is the same as the one filtered in the whole image.
+
+    :param f_filter: The function of filter, which returns an image of the same size and type.
+    :param f_img: Input image
+    :param f_regions: A list of regions, each of which is (min row, max row, min column, max column), the whole image
+                      by default.
+    :param f_padding: The reach of filter, in pixels from the center of its window, 0 by default.
+    :return: Filtered image
+    """
+    if f_regions is None:
+        return f_filter(f_img)
+
+    filtered = zeros(f_img.shape, dtype=f_img.dtype)
+
+    for min_row, max_row, min_col, max_col in f_regions:
+        r0, r1, c0, c1 = __pad_region((min_row, max_row, min_col, max_col), f_padding, f_img.shape)
+
+        filtered[min_row:max_row, min_col:max_col] = \
+            f_filter(f_img[r0:r1, c0:c1])[(min_row - r0):(max_row - r0), (min_col - c0):(max_col - c0)]
+
+    return filtered
+
+
+def __detect_regions(f_detector, f_img, f_regions=None, f_padding=0):
+    """
+    For detecting the blobs in the regions of an image only.
+
+    Each region is detected in its crop, padded by the size of blobs, so that the blobs on its edges are detected
+    whole, and only the blobs whose centers are inside the region are kept, so that none is detected twice.
+
+    :param f_detector: The blob detector.
+    :param f_img: Input image
+    :param f_regions: A list of regions, each of which is (min row, max row, min column, max column), the whole image
+                      by default.
+    :param f_padding: The number of pixels by which the crops are padded, 0 by default.
+    :return: A list of key points, whose coordinates are in the whole image.
+    """
+    if f_regions is None:
+        return list(f_detector.detect(f_img))
+
+    key_points = []
+
+    for min_row, max_row, min_col, max_col in f_regions:
+        r0, r1, c0, c1 = __pad_region((min_row, max_row, min_col, max_col), f_padding, f_img.shape)
+
+        for key_point in f_detector.detect(f_img[r0:r1, c0:c1]):
+            key_point.pt = (key_point.pt[0] + c0, key_point.pt[1] + r0)
+
+            if min_row <= int(key_point.pt[1]) < max_row and min_col <= int(key_point.pt[0]) < max_col:
+                key_points.append(key_point)
+
+    return key_points
+
+
+def __score_regions(f_images, f_rows, f_cols, f_core, f_surround, f_regions=None):
+    """
+    For calculating the base scores of blobs in the regions of images only.
+
+    Each region is scored in its crop, padded by the surrounding region of blobs, so that the sums of blobs are the
+    same as the ones in the whole images, as long as the images are filtered as a whole around the regions.
+
+    :param f_images: A list of images in the same shape, one for each channel.
+    :param f_rows: The rows of blobs.
+    :param f_cols: The columns of blobs.
+    :param f_core: The offset and edge length of core region, such as (-1, 4) for a 4x4 region.
+    :param f_surround: The offset and edge length of surrounding region, such as (-4, 10) for a 10x10 region.
+    :param f_regions: A list of regions, each of which is (min row, max row, min column, max column), the whole images
+                      by default.
+    :return: A matrix of base scores (float64), blob x channel.
+    """
+    if f_regions is None:
+        return blob_scores(f_images, f_rows, f_cols, f_core, f_surround)
+
+    scores = zeros((f_rows.shape[0], len(f_images)), dtype=float64)
+
+    for min_row, max_row, min_col, max_col in f_regions:
+        inside = (f_rows >= min_row) & (f_rows < max_row) & (f_cols >= min_col) & (f_cols < max_col)
+
+        r0, r1, c0, c1 = __pad_region((min_row, max_row, min_col, max_col), f_surround[1], f_images[0].shape)
+
+        scores[inside] = blob_scores([_[r0:r1, c0:c1] for _ in f_images], f_rows[inside] - r0, f_cols[inside] - c0,
+                                     f_core, f_surround)
+
+    return scores
+
+
+def detect_blobs_Ke(f_cycle, f_detector_params=None, f_stats=None, f_regions=None):
     """
     For detect the fluorescence signal.
 
@@ -53,6 +178,12 @@ def detect_blobs_Ke(f_cycle):
     Returning the grey scale model.
 
     :param f_cycle: A image matrix in the 3D common data tensor.
+    :param f_detector_params: A dictionary of the parameters of blob detector to override the default ones, which
+                              are named as the attributes of 'SimpleBlobDetector_Params', such as 'minArea'.
+    :param f_stats: A dictionary, into which the numbers of key points, blobs and bases, and the cut-off of each
+                    channel are stored if given.
+    :param f_regions: A list of the regions of tissue, each of which is (min row, max row, min column, max column),
+                      to which the detection is restricted. The whole image is detected by default.
     :return: A base box of this cycle, which store their coordinates, base and its error rate.
     """
     channel_A = f_cycle[0]
@@ -65,16 +196,38 @@ def detect_blobs_Ke(f_cycle):
     greyscale_model_C = zeros(channel_C.shape, dtype=float32)
     greyscale_model_G = zeros(channel_G.shape, dtype=float32)
 
+    ##############################################################################
+    # In the regions of tissue, the tophat reaches 2 x 3 x 7 pixels, since the   #
+    # opening erodes and dilates 3 times under the radius of kernel, and it is   #
+    # kept around the regions by the padding of detection, which covers the      #
+    # largest blobs and the surrounding region of scoring                        #
+    ##############################################################################
+    tophat_reach = 2 * 3 * 7
+    detect_padding = 16
+
+    if f_regions is None:
+        filter_regions = None
+
+    else:
+        filter_regions = [__pad_region(_, detect_padding, channel_A.shape) for _ in f_regions]
+    ##############################################################################
+
+    PROFILER.begin('tophat')
+
     ###############################################################################
     # Here, a morphological transformation, Tophat, under a 15x15 ELLIPSE kernel, #
     # is used to expose blobs                                                     #
     ###############################################################################
     ksize = (15, 15)
     kernel = getStructuringElement(MORPH_ELLIPSE, ksize)
-    channel_A = morphologyEx(channel_A, MORPH_TOPHAT, kernel, iterations=3)
-    channel_T = morphologyEx(channel_T, MORPH_TOPHAT, kernel, iterations=3)
-    channel_C = morphologyEx(channel_C, MORPH_TOPHAT, kernel, iterations=3)
-    channel_G = morphologyEx(channel_G, MORPH_TOPHAT, kernel, iterations=3)
+    channel_A = __filter_regions(lambda _: morphologyEx(_, MORPH_TOPHAT, kernel, iterations=3), channel_A,
+                                 filter_regions, tophat_reach)
+    channel_T = __filter_regions(lambda _: morphologyEx(_, MORPH_TOPHAT, kernel, iterations=3), channel_T,
+                                 filter_regions, tophat_reach)
+    channel_C = __filter_regions(lambda _: morphologyEx(_, MORPH_TOPHAT, kernel, iterations=3), channel_C,
+                                 filter_regions, tophat_reach)
+    channel_G = __filter_regions(lambda _: morphologyEx(_, MORPH_TOPHAT, kernel, iterations=3), channel_G,
+                                 filter_regions, tophat_reach)
     ########
 
     ###############################
@@ -88,6 +241,10 @@ def detect_blobs_Ke(f_cycle):
 
     ###############################################################################
 
+    PROFILER.end()
+
+    PROFILER.begin('blob detection')
+
     channel_list = (channel_A, channel_T, channel_C, channel_G)
 
     mor_kps = []
@@ -148,10 +305,14 @@ def detect_blobs_Ke(f_cycle):
     blob_params.blobColor = 255
     ##########################################################
 
+    if f_detector_params is not None:
+        for param in f_detector_params:
+            setattr(blob_params, param, f_detector_params[param])
+
     mor_detector = SimpleBlobDetector.create(blob_params)
 
     for img in channel_list:
-        mor_kps.extend(mor_detector.detect(img))
+        mor_kps.extend(__detect_regions(mor_detector, img, f_regions, detect_padding))
 
     mor_kps = set(mor_kps)
 
@@ -175,9 +336,15 @@ def detect_blobs_Ke(f_cycle):
     #############################################################################################################
 
     detector = SimpleBlobDetector.create(blob_params)
-    kps = detector.detect(mask_layer)
+    kps = __detect_regions(detector, mask_layer, f_regions, detect_padding)
     #################################################################################
 
+    PROFILER.count('keypoints', len(mor_kps))
+    PROFILER.count('blobs', len(kps))
+    PROFILER.end()
+
+    PROFILER.begin('scoring')
+
     ##########################################################################
     # Calculate the threshold for distinction between blobs and potential    #
     # pseudo-blobs                                                           #
@@ -192,86 +359,68 @@ def detect_blobs_Ke(f_cycle):
     # for each channel. This threshold could be used to filter false-positive#
     # blobs in following step                                                #
     ##########################################################################
-    diff_list_A = []
-    diff_list_T = []
-    diff_list_C = []
-    diff_list_G = []
-
-    for key_point in kps:
-        r = int(key_point.pt[1])
-        c = int(key_point.pt[0])
-
-        diff_A = sum(channel_A[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                 sum(channel_A[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
-
-        diff_T = sum(channel_T[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                 sum(channel_T[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
+    rows = asarray([int(_.pt[1]) for _ in kps], dtype=int64)
+    cols = asarray([int(_.pt[0]) for _ in kps], dtype=int64)
 
-        diff_C = sum(channel_C[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                 sum(channel_C[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
+    diff_ATCG = __score_regions((channel_A, channel_T, channel_C, channel_G), rows, cols, (-1, 4), (-4, 10), f_regions)
 
-        diff_G = sum(channel_G[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                 sum(channel_G[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
-
-        if diff_A >= 1:
-            diff_list_A.append(int(around(diff_A)))
-
-        if diff_T >= 1:
-            diff_list_T.append(int(around(diff_T)))
-
-        if diff_C >= 1:
-            diff_list_C.append(int(around(diff_C)))
-
-        if diff_G >= 1:
-            diff_list_G.append(int(around(diff_G)))
+    diff_list_A = around(diff_ATCG[diff_ATCG[:, 0] >= 1, 0]).astype(int64)
+    diff_list_T = around(diff_ATCG[diff_ATCG[:, 1] >= 1, 1]).astype(int64)
+    diff_list_C = around(diff_ATCG[diff_ATCG[:, 2] >= 1, 2]).astype(int64)
+    diff_list_G = around(diff_ATCG[diff_ATCG[:, 3] >= 1, 3]).astype(int64)
 
     diff_bk = 5
 
-    cut_off_A = int(mode(multiply(around(divide(asarray(diff_list_A, dtype=uint8), diff_bk)), diff_bk))[0][0])
-    cut_off_T = int(mode(multiply(around(divide(asarray(diff_list_T, dtype=uint8), diff_bk)), diff_bk))[0][0])
-    cut_off_C = int(mode(multiply(around(divide(asarray(diff_list_C, dtype=uint8), diff_bk)), diff_bk))[0][0])
-    cut_off_G = int(mode(multiply(around(divide(asarray(diff_list_G, dtype=uint8), diff_bk)), diff_bk))[0][0])
+    cut_off_A = __mode(multiply(around(divide(asarray(diff_list_A, dtype=uint8), diff_bk)), diff_bk))
+    cut_off_T = __mode(multiply(around(divide(asarray(diff_list_T, dtype=uint8), diff_bk)), diff_bk))
+    cut_off_C = __mode(multiply(around(divide(asarray(diff_list_C, dtype=uint8), diff_bk)), diff_bk))
+    cut_off_G = __mode(multiply(around(divide(asarray(diff_list_G, dtype=uint8), diff_bk)), diff_bk))
     #########################################################################
 
+    PROFILER.count('cut_off_A', cut_off_A)
+    PROFILER.count('cut_off_T', cut_off_T)
+    PROFILER.count('cut_off_C', cut_off_C)
+    PROFILER.count('cut_off_G', cut_off_G)
+
     ###################################################################################################
     # The coordinates of real blobs will be used to calculate the base score among different channels #
     ###################################################################################################
-    for key_point in kps:
-        r = int(key_point.pt[1])
-        c = int(key_point.pt[0])
-
-        if sum(channel_A[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                sum(channel_A[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100 >= cut_off_A:
-            greyscale_model_A[r, c] = sum(channel_A[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                                      sum(channel_A[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
-
-        if sum(channel_T[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                sum(channel_T[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100 >= cut_off_T:
-            greyscale_model_T[r, c] = sum(channel_T[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                                      sum(channel_T[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
-
-        if sum(channel_C[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                sum(channel_C[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100 >= cut_off_C:
-            greyscale_model_C[r, c] = sum(channel_C[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                                      sum(channel_C[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
-
-        if sum(channel_G[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                sum(channel_G[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100 >= cut_off_G:
-            greyscale_model_G[r, c] = sum(channel_G[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 - \
-                                      sum(channel_G[(r - 4):(r + 6), (c - 4):(c + 6)]) / 100
+    real_A = diff_ATCG[:, 0] >= cut_off_A
+    real_T = diff_ATCG[:, 1] >= cut_off_T
+    real_C = diff_ATCG[:, 2] >= cut_off_C
+    real_G = diff_ATCG[:, 3] >= cut_off_G
+
+    greyscale_model_A[rows[real_A], cols[real_A]] = diff_ATCG[real_A, 0]
+    greyscale_model_T[rows[real_T], cols[real_T]] = diff_ATCG[real_T, 1]
+    greyscale_model_C[rows[real_C], cols[real_C]] = diff_ATCG[real_C, 2]
+    greyscale_model_G[rows[real_G], cols[real_G]] = diff_ATCG[real_G, 3]
     ##################################################################################################
 
+    PROFILER.end()
+
+    PROFILER.begin('pooling')
+
     image_model_pool = image_model_pooling_Ke(greyscale_model_A,
                                               greyscale_model_T,
                                               greyscale_model_C,
                                               greyscale_model_G)
 
+    PROFILER.begin('pool2base')
     base_box_in_one_cycle = pool2base(image_model_pool)
+    PROFILER.end()
+
+    PROFILER.count('bases', len(base_box_in_one_cycle))
+    PROFILER.end()
+
+    if f_stats is not None:
+        f_stats.update({'keypoints': len(mor_kps), 'blobs': len(kps), 'bases': len(base_box_in_one_cycle),
+                        'cut_offs': {'A': int(cut_off_A), 'T': int(cut_off_T), 'C': int(cut_off_C),
+                                     'G': int(cut_off_G)}})
 
     return base_box_in_one_cycle
 
 
-def detect_blobs_Chen(f_cycle):
+def detect_blobs_Chen(f_cycle, f_detector_params=None, f_stats=None):
     """
     For detect the fluorescence signal.
 
@@ -279,6 +428,10 @@ def detect_blobs_Chen(f_cycle):
     Returning the grey scale model.
 
     :param f_cycle: A image matrix in the 3D common data tensor.
+    :param f_detector_params: A dictionary of the parameters of blob detector to override the default ones, which
+                              are named as the attributes of 'SimpleBlobDetector_Params', such as 'minArea'.
+    :param f_stats: A dictionary, into which the numbers of key points, blobs and bases, and the cut-off of each
+                    channel are stored if given.
     :return: A base box of this cycle, which store their coordinates, base and its error rate.
     """
     channel_0 = f_cycle[0]
@@ -286,6 +439,8 @@ def detect_blobs_Chen(f_cycle):
 
     greyscale_model_0 = zeros(channel_0.shape, dtype=float32)
 
+    PROFILER.begin('tophat')
+
     #############################################################################
     # Here, a morphological transformation, Tophat, under a 3x3 ELLIPSE kernel, #
     # is used to expose blobs                                                   #
@@ -304,6 +459,10 @@ def detect_blobs_Chen(f_cycle):
 
     #############################################################################
 
+    PROFILER.end()
+
+    PROFILER.begin('blob detection')
+
     channel_list = (channel_0,)
 
     mor_kps = []
@@ -356,6 +515,10 @@ def detect_blobs_Chen(f_cycle):
     blob_params.blobColor = 255
     ##########################################################
 
+    if f_detector_params is not None:
+        for param in f_detector_params:
+            setattr(blob_params, param, f_detector_params[param])
+
     mor_detector = SimpleBlobDetector.create(blob_params)
 
     for img in channel_list:
@@ -382,6 +545,12 @@ def detect_blobs_Chen(f_cycle):
     kps = detector.detect(mask_layer)
     #################################################################################
 
+    PROFILER.count('keypoints', len(mor_kps))
+    PROFILER.count('blobs', len(kps))
+    PROFILER.end()
+
+    PROFILER.begin('scoring')
+
     #########################################################################
     # Calculate the threshold for distinction between blobs and potential   #
     # pseudo-blobs                                                          #
@@ -409,27 +578,42 @@ def detect_blobs_Chen(f_cycle):
     #
     # diff_bk = 5
     #
-    # cut_off_0 = int(mode(multiply(around(divide(asarray(diff_list_0, dtype=uint8), diff_bk)), diff_bk))[0][0])
+    # cut_off_0 = __mode(multiply(around(divide(asarray(diff_list_0, dtype=uint8), diff_bk)), diff_bk))
     ########
     cut_off_0 = 1  # Alternative option
     #########################################################################
 
+    PROFILER.count('cut_off_0', cut_off_0)
+
     ##############################################################################################################
     # The coordinates of real blobs will be used to locate the difference of gary-scale among different channels #
     ##############################################################################################################
-    for key_point in kps:
-        r = int(key_point.pt[1])
-        c = int(key_point.pt[0])
+    rows = asarray([int(_.pt[1]) for _ in kps], dtype=int64)
+    cols = asarray([int(_.pt[0]) for _ in kps], dtype=int64)
+
+    diff_0 = blob_scores((channel_0,), rows, cols, (0, 2), (-1, 4))[:, 0]
 
-        if sum(channel_0[r:(r + 2), c:(c + 2)]) / 4 - \
-                sum(channel_0[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16 >= cut_off_0:
-            greyscale_model_0[r, c] = sum(channel_0[r:(r + 2), c:(c + 2)]) / 4 - \
-                                      sum(channel_0[(r - 1):(r + 3), (c - 1):(c + 3)]) / 16
+    real_0 = diff_0 >= cut_off_0
+
+    greyscale_model_0[rows[real_0], cols[real_0]] = diff_0[real_0]
     ##############################################################################################################
 
+    PROFILER.end()
+
+    PROFILER.begin('pooling')
+
     image_model_pool = image_model_pooling_Chen(greyscale_model_0)
 
+    PROFILER.begin('pool2base')
     base_box_in_one_cycle = pool2base(image_model_pool)
+    PROFILER.end()
+
+    PROFILER.count('bases', len(base_box_in_one_cycle))
+    PROFILER.end()
+
+    if f_stats is not None:
+        f_stats.update({'keypoints': len(mor_kps), 'blobs': len(kps), 'bases': len(base_box_in_one_cycle),
+                        'cut_offs': {'0': int(cut_off_0)}})
 
     return base_box_in_one_cycle
 
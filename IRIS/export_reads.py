@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+This model is used to export the reads of base calling as FASTQ or unaligned SAM, compressed in BGZF, so that they
+could be passed to the standard tools of sequences without any conversion.
+
+BGZF is a series of gzip members, each of which holds up to 64 KB of data and records its own size. Thus it could be
+read by any gzip reader, and the blocks are compressed independently, by a pool of threads here, since zlib releases
+the GIL while compressing. The blocks are written in order, and at most a few blocks for each thread are kept in
+memory.
+
+The coordinates of reads are kept as SAM tags, 'XR:i' for the row and 'XC:i' for the column in the background image,
+as well as the gene name ('XG:Z') and edit distance ('XD:i') if the reads are decoded. In FASTQ, these tags follow
+the read id as its comment, as expected by 'bwa mem -C' and 'samtools import -T'.
+
+    @r00387c00616   XR:i:387    XC:i:616
+    AAGC
+    +
+    +,I0
+"""
+
+
+from sys import (argv, stderr)
+from os import cpu_count
+from struct import pack
+from zlib import (compressobj, crc32, DEFLATED)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+SEQUENCE_FORMATS = {'fastq': 'basecalling_data.fastq.gz', 'sam': 'basecalling_data.sam.gz'}
+
+BGZF_BLOCK_SIZE = 0xff00  # The uncompressed data of a block, as 'bgzip' does
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+SAM_HEADER = '@HD\tVN:1.6\tSO:unsorted\n' \
+             '@PG\tID:pyIRIS\tPN:pyIRIS\n' \
+             '@CO\tXR:i and XC:i are the row and column of blob, XG:Z and XD:i are the gene and edit distance\n'
+
+
+class BgzfWriter:
+    def __init__(self, f_path, f_threads=None, f_level=None):
+        """
+        This method will open a BGZF file for writing.
+
+        :param f_path: The path of file, an existing one will be overwritten.
+        :param f_threads: The number of threads for compressing blocks, the number of CPUs by default.
+        :param f_level: The level of compression, 6 by default.
+        """
+        self.threads = cpu_count() if f_threads is None else max(int(f_threads), 1)
+        self.level = 6 if f_level is None else int(f_level)
+
+        self.__ou = open(f_path, 'wb')
+        self.__buffer = bytearray()
+        self.__blocks = deque()
+        self.__pool = ThreadPoolExecutor(self.threads)
+
+    @staticmethod
+    def __compress(f_data, f_level):
+        """
+        For compressing a block of data into a gzip member with the BGZF extra field.
+
+        :param f_data: The uncompressed data, at most 'BGZF_BLOCK_SIZE' bytes.
+        :param f_level: The level of compression.
+        :return: The compressed block.
+        """
+        compressor = compressobj(f_level, DEFLATED, -15)
+        compressed = compressor.compress(f_data) + compressor.flush()
+
+        ################################################################################
+        # The extra subfield 'BC' keeps the size of the whole block minus 1, of which  #
+        # the header takes 18 bytes and the trailer (CRC32 and data size) takes 8      #
+        ################################################################################
+        header = pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+        ################################################################################
+
+        return header + compressed + pack('<II', crc32(f_data) & 0xffffffff, len(f_data))
+
+    def __flush_blocks(self, f_keep):
+        """
+        This method is used to write the compressed blocks in order, until only a number of blocks are left.
+
+        :param f_keep: The number of blocks left in compressing.
+        :return: NONE
+        """
+        while len(self.__blocks) > f_keep:
+            self.__ou.write(self.__blocks.popleft().result())
+
+    def write(self, f_data):
+        """
+        This method is used to write data, which are compressed block by block in background.
+
+        :param f_data: The data (bytes).
+        :return: NONE
+        """
+        self.__buffer.extend(f_data)
+
+        while len(self.__buffer) >= BGZF_BLOCK_SIZE:
+            self.__blocks.append(self.__pool.submit(BgzfWriter.__compress, bytes(self.__buffer[:BGZF_BLOCK_SIZE]),
+                                                    self.level))
+            del self.__buffer[:BGZF_BLOCK_SIZE]
+
+            self.__flush_blocks(self.threads * 4)
+
+    def close(self):
+        """
+        This method is used to write the rest of data and the end-of-file block, then close the file.
+
+        :return: NONE
+        """
+        if len(self.__buffer) > 0:
+            self.__blocks.append(self.__pool.submit(BgzfWriter.__compress, bytes(self.__buffer), self.level))
+            self.__buffer = bytearray()
+
+        self.__flush_blocks(0)
+        self.__pool.shutdown()
+
+        self.__ou.write(BGZF_EOF)
+        self.__ou.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_tags(f_read):
+    """
+    This function is used to format the coordinates (and the gene) of a read as SAM tags.
+
+    :param f_read: A read composed of id, sequence, quality, row, column and optionally gene name and edit distance.
+    :return: The tags separated by tabs.
+    """
+    ########################################################################
+    # The coordinates of reads are padded with zeros, which are stripped   #
+    # as strings, since converting millions of them into integers is slow  #
+    ########################################################################
+    tags = 'XR:i:' + (str(f_read[3]).lstrip('0') or '0') + '\tXC:i:' + (str(f_read[4]).lstrip('0') or '0')
+    ########################################################################
+
+    if len(f_read) > 6:
+        tags += '\tXG:Z:' + str(f_read[5]) + '\tXD:i:' + str(f_read[6])
+
+    return tags
+
+
+def write_reads_into_fastq(f_reads, f_path, f_threads=None):
+    """
+    This function is used to write reads into a FASTQ file compressed in BGZF.
+
+    :param f_reads: An iterable of reads, each of which is composed of id, sequence, quality, row, column and
+                    optionally gene name and edit distance.
+    :param f_path: The path of FASTQ file, such as 'basecalling_data.fastq.gz'.
+    :param f_threads: The number of threads for compression, the number of CPUs by default.
+    :return: NONE
+    """
+    with BgzfWriter(f_path, f_threads) as ou:
+        chunk = []
+
+        for read in f_reads:
+            chunk.append('@%s\t%s\n%s\n+\n%s\n' % (read[0], read_tags(read), read[1], read[2]))
+
+            if len(chunk) >= 10000:
+                ou.write(''.join(chunk).encode())
+                chunk = []
+
+        ou.write(''.join(chunk).encode())
+
+
+def write_reads_into_sam(f_reads, f_path, f_threads=None):
+    """
+    This function is used to write reads into an unaligned SAM file compressed in BGZF.
+
+    :param f_reads: An iterable of reads, each of which is composed of id, sequence, quality, row, column and
+                    optionally gene name and edit distance.
+    :param f_path: The path of SAM file, such as 'basecalling_data.sam.gz'.
+    :param f_threads: The number of threads for compression, the number of CPUs by default.
+    :return: NONE
+    """
+    with BgzfWriter(f_path, f_threads) as ou:
+        ou.write(SAM_HEADER.encode())
+
+        chunk = []
+
+        for read in f_reads:
+            ##############################################################
+            # Unmapped (flag 4), and an empty sequence is written as '*' #
+            ##############################################################
+            chunk.append('%s\t4\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\t%s\n' % (read[0], read[1] if read[1] != '' else '*',
+                                                                      read[2] if read[2] != '' else '*',
+                                                                      read_tags(read)))
+            ##############################################################
+
+            if len(chunk) >= 10000:
+                ou.write(''.join(chunk).encode())
+                chunk = []
+
+        ou.write(''.join(chunk).encode())
+
+
+if __name__ == '__main__':
+    if len(argv) == 4 and argv[1] in SEQUENCE_FORMATS:
+        with open(argv[2], 'rt') as IN:
+            result_reads = (_.rstrip('\n').split('\t') for _ in IN if _.strip() != '')
+
+            if argv[1] == 'fastq':
+                write_reads_into_fastq(result_reads, argv[3])
+
+            else:
+                write_reads_into_sam(result_reads, argv[3])
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <fastq|sam> <result file> <output file>', file=stderr)
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+This model is used to read the channels of cycles from their sources, which are either the directories of cycles or
+stacks of images in multi-page TIFF.
+
+A directory of cycle contains a TIFF image for each channel, such as 'Y5.tif' or 'DAPI.tif'. A stack holds the
+channels of one or more cycles as its pages, which are mapped to cycles and channels by its OME-XML or ImageJ
+description, or in the order of cycle and channel if it has neither. Any channel could also be a z-stack of focal
+planes, which is projected while being read.
+
+The pages of a TIFF image are indexed lazily, and only the strips or tiles covering the requested region are read. The
+uncompressed data are memory-mapped, and the deflated data are inflated block by block, so that a stack of a whole run
+never has to be decoded at once. The pages in other formats (such as LZW) are decoded entirely by OpenCV.
+
+    source = open_cycles(['run.ome.tif'], CHANNELS['--ke'], (0, 1024, 0, 1024))
+
+    for cycle_id in range(0, source.cycle_num):
+        channel_A = source.read(cycle_id, 'Y5.tif')
+
+The cycles could also be read ahead by 'CyclePrefetcher', which reads the channels of the next cycles in I/O threads
+while the current one is being processed. The number of cycles read ahead is bounded by its depth, and also by the
+memory available, as soon as the size of a cycle is known.
+
+    prefetcher = CyclePrefetcher(source, ['Y5.tif', 'DAPI.tif'], f_depth=2)
+
+    for cycle_id in range(0, source.cycle_num):
+        channels = prefetcher.read(cycle_id)
+
+    prefetcher.close()
+"""
+
+
+from sys import stderr
+from os.path import (join, isfile, splitext)
+from struct import (unpack_from, calcsize)
+from zlib import decompress
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import (fromstring, ParseError)
+from cv2 import (imread, imreadmulti, imcount, Laplacian, meanStdDev, IMREAD_GRAYSCALE, CV_16S)
+from numpy import (memmap, frombuffer, zeros, maximum, uint8, uint16)
+
+
+CHANNELS = {'--ke': ('Y5.tif', 'FAM.tif', 'TXR.tif', 'Y3.tif', 'DAPI.tif'),
+            '--chen': ('STORM.tif',)}
+
+PROJECTIONS = ('max', 'focus')
+
+TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 16: 'Q'}
+TIFF_TAGS = (256, 257, 258, 259, 262, 270, 273, 277, 278, 279, 317, 322, 323, 324, 325, 339)
+LAZY_COMPRESSION = (1, 8, 32946)  # None, and deflate
+
+
+def project_planes(f_planes, f_projection=None):
+    """
+    For projecting the focal planes of a z-stack into one image, plane by plane.
+
+    With the projection 'max', each pixel keeps its maximum over planes, which collects the blobs in all the focal
+    planes. With 'focus', only the plane of the largest variance of Laplacian, which is the sharpest one, is kept.
+
+    :param f_planes: An iterator of planes, each of which is read only when it is projected.
+    :param f_projection: The projection of z-stack, 'max' (default) or 'focus'.
+    :return: The projected image matrix.
+    """
+    projection = 'max' if f_projection is None else f_projection
+
+    projected_img = None
+    best_focus = -1
+
+    for plane in f_planes:
+        if projection == 'max':
+            projected_img = plane if projected_img is None else maximum(projected_img, plane, out=projected_img)
+
+        else:
+            focus = meanStdDev(Laplacian(plane, CV_16S))[1][0][0] ** 2
+
+            if focus > best_focus:
+                projected_img = plane
+                best_focus = focus
+
+    return projected_img
+
+
+def read_channel(f_image_file, f_projection=None):
+    """
+    For reading a channel as a gray scale image by OpenCV, which is projected if it is a z-stack.
+
+    :param f_image_file: The path of image, a single plane or a multi-page TIFF.
+    :param f_projection: The projection of z-stack, 'max' (default) or 'focus'.
+    :return: The image matrix.
+    """
+    plane_num = imcount(f_image_file)
+
+    if plane_num == 0:
+        print('THE IMAGE COULD NOT BE READ: ' + f_image_file, file=stderr)
+        exit(1)
+
+    if plane_num == 1:
+        return imread(f_image_file, IMREAD_GRAYSCALE)
+
+    return project_planes((imreadmulti(f_image_file, _, 1, flags=IMREAD_GRAYSCALE)[1][0] for _ in range(0, plane_num)),
+                          f_projection)
+
+
+class TiffPages:
+    def __init__(self, f_image_file):
+        """
+        This method will map a TIFF image into memory, and index the offsets of its pages without parsing them.
+
+        :param f_image_file: The path of TIFF image, classic TIFF or BigTIFF.
+        """
+        self.path = f_image_file
+
+        if not isfile(f_image_file):
+            print('THE IMAGE COULD NOT BE READ: ' + f_image_file, file=stderr)
+            exit(1)
+
+        self.__map = memmap(f_image_file, dtype=uint8, mode='r')
+
+        if self.__map.shape[0] < 8 or bytes(self.__map[:2]) not in (b'II', b'MM'):
+            print('NOT A TIFF IMAGE: ' + f_image_file, file=stderr)
+            exit(1)
+
+        self.__endian = '<' if bytes(self.__map[:2]) == b'II' else '>'
+
+        version = unpack_from(self.__endian + 'H', self.__map, 2)[0]
+
+        ###################################################################################
+        # Classic TIFF uses 32-bit offsets and 12-byte entries, while BigTIFF uses 64-bit #
+        # offsets and 20-byte entries                                                     #
+        ###################################################################################
+        if version == 42:
+            self.__offset_fmt, self.__count_fmt, self.__entry_size = 'I', 'H', 12
+            ifd_offset = unpack_from(self.__endian + 'I', self.__map, 4)[0]
+
+        elif version == 43:
+            self.__offset_fmt, self.__count_fmt, self.__entry_size = 'Q', 'Q', 20
+            ifd_offset = unpack_from(self.__endian + 'Q', self.__map, 8)[0]
+
+        else:
+            print('NOT A TIFF IMAGE: ' + f_image_file, file=stderr)
+            exit(1)
+        ###################################################################################
+
+        ##############################################################################
+        # Only the chain of pages is walked here, and the tags of a page are parsed  #
+        # when it is read for the first time                                         #
+        ##############################################################################
+        self.__ifd_offsets = []
+        self.__pages = {}
+
+        while ifd_offset != 0 and ifd_offset not in self.__pages:
+            self.__ifd_offsets.append(ifd_offset)
+            self.__pages.update({ifd_offset: None})
+
+            entry_num = unpack_from(self.__endian + self.__count_fmt, self.__map, ifd_offset)[0]
+
+            ifd_offset = unpack_from(self.__endian + self.__offset_fmt, self.__map,
+                                     ifd_offset + calcsize(self.__count_fmt) + entry_num * self.__entry_size)[0]
+        ##############################################################################
+
+        self.page_num = len(self.__ifd_offsets)
+
+    def tags(self, f_page_id):
+        """
+        This method is used to get the tags of a page, which are parsed only once.
+
+        :param f_page_id: The index of page, from 0.
+        :return: A dictionary of tags, of which the values are strings for ASCII tags, and tuples for others.
+        """
+        ifd_offset = self.__ifd_offsets[f_page_id]
+
+        if self.__pages[ifd_offset] is not None:
+            return self.__pages[ifd_offset]
+
+        offset_size = calcsize(self.__offset_fmt)
+
+        entry_num = unpack_from(self.__endian + self.__count_fmt, self.__map, ifd_offset)[0]
+        entry_start = ifd_offset + calcsize(self.__count_fmt)
+
+        tags = {}
+
+        for i in range(0, entry_num):
+            entry = entry_start + i * self.__entry_size
+            tag, value_type = unpack_from(self.__endian + 'HH', self.__map, entry)
+
+            if value_type not in TIFF_TYPES or tag not in TIFF_TAGS:
+                continue
+
+            value_count = unpack_from(self.__endian + self.__offset_fmt, self.__map, entry + 4)[0]
+            value_offset = entry + 4 + offset_size
+
+            ###########################################################
+            # Values which do not fit in the entry are stored outside #
+            ###########################################################
+            if value_count * calcsize(TIFF_TYPES[value_type]) > offset_size:
+                value_offset = unpack_from(self.__endian + self.__offset_fmt, self.__map, value_offset)[0]
+            ###########################################################
+
+            if value_type == 2:
+                value = bytes(self.__map[value_offset:(value_offset + value_count)])
+                tags.update({tag: value.rstrip(b'\0').decode('utf-8', 'replace')})
+
+            else:
+                tags.update({tag: unpack_from(self.__endian + str(value_count) + TIFF_TYPES[value_type], self.__map,
+                                              value_offset)})
+
+        self.__pages[ifd_offset] = tags
+
+        return tags
+
+    def read(self, f_page_id, f_region=None):
+        """
+        This method is used to read a region of a page as a gray scale image in 8 bits, as 'imread' of OpenCV does.
+
+        :param f_page_id: The index of page, from 0.
+        :param f_region: The region (min row, max row, min column, max column) to read, the whole page by default.
+        :return: The image matrix of region.
+        """
+        tags = self.tags(f_page_id)
+
+        height = tags[257][0]
+        width = tags[256][0]
+
+        if f_region is None:
+            min_row, max_row, min_col, max_col = 0, height, 0, width
+
+        else:
+            min_row, max_row = min(f_region[0], height), min(f_region[1], height)
+            min_col, max_col = min(f_region[2], width), min(f_region[3], width)
+
+        bits = tags.get(258, (1,))[0]
+        compression = tags.get(259, (1,))[0]
+        predictor = tags.get(317, (1,))[0]
+
+        ##################################################################################
+        # Only the unsigned gray scale in 8 or 16 bits is read lazily, and the others    #
+        # are decoded and converted by OpenCV                                            #
+        ##################################################################################
+        if tags.get(277, (1,))[0] != 1 or bits not in (8, 16) or compression not in LAZY_COMPRESSION or \
+                predictor not in (1, 2) or tags.get(339, (1,))[0] != 1 or tags.get(262, (1,))[0] != 1:
+            _, planes = imreadmulti(self.path, f_page_id, 1, flags=IMREAD_GRAYSCALE)
+
+            return planes[0][min_row:max_row, min_col:max_col]
+        ##################################################################################
+
+        if 322 in tags:
+            block_h, block_w = tags[323][0], tags[322][0]
+            offsets, byte_counts = tags[324], tags[325]
+
+        else:
+            block_h, block_w = min(tags.get(278, (height,))[0], height), width
+            offsets, byte_counts = tags[273], tags[279]
+
+        blocks_per_row = -(-width // block_w)
+
+        data_type = self.__endian + 'u' + str(bits // 8)
+
+        region_img = zeros((max(max_row - min_row, 0), max(max_col - min_col, 0)), dtype=uint8 if bits == 8 else uint16)
+
+        ###############################################################################
+        # Only the strips or tiles overlapping the region are read, and the last      #
+        # strip might be shorter than the others                                      #
+        ###############################################################################
+        for block_row in range(min_row // block_h, -(-max_row // block_h)):
+            for block_col in range(min_col // block_w, -(-max_col // block_w)):
+                block_id = block_row * blocks_per_row + block_col
+
+                data = self.__map[offsets[block_id]:(offsets[block_id] + byte_counts[block_id])]
+
+                if compression != 1:
+                    data = frombuffer(decompress(data), dtype=uint8)
+
+                rows = min(block_h, data.shape[0] // (block_w * bits // 8))
+
+                block = data[:(rows * block_w * bits // 8)].view(data_type).reshape(rows, block_w)
+
+                if predictor == 2:
+                    block = block.astype(region_img.dtype).cumsum(axis=1, dtype=region_img.dtype)
+
+                top, left = block_row * block_h, block_col * block_w
+
+                r0, r1 = max(min_row, top), min(max_row, top + rows)
+                c0, c1 = max(min_col, left), min(max_col, left + block_w)
+
+                region_img[(r0 - min_row):(r1 - min_row), (c0 - min_col):(c1 - min_col)] = \
+                    block[(r0 - top):(r1 - top), (c0 - left):(c1 - left)]
+        ###############################################################################
+
+        return region_img if bits == 8 else (region_img >> 8).astype(uint8)
+
+
+class CycleDirectories:
+    def __init__(self, f_cycles, f_channels, f_region=None):
+        """
+        This method will take the directories of cycles, each of which contains an image for each channel.
+
+        :param f_cycles: The image directories in sequence of cycles.
+        :param f_channels: The file names of channels, such as 'Y5.tif'.
+        :param f_region: The region (min row, max row, min column, max column) to read, the whole images by default.
+        """
+        self.cycles = list(f_cycles)
+        self.channels = tuple(f_channels)
+        self.region = f_region
+
+        self.cycle_num = len(self.cycles)
+        self.files = [join(cycle, _) for cycle in self.cycles for _ in self.channels]
+
+    def file_num(self, f_cycle_num):
+        """
+        This method is used to get the number of the first files which hold the first cycles.
+
+        :param f_cycle_num: The number of the first cycles.
+        :return: The number of files.
+        """
+        return min(f_cycle_num, self.cycle_num) * len(self.channels)
+
+    def read(self, f_cycle_id, f_channel, f_projection=None):
+        """
+        This method is used to read a channel of a cycle.
+
+        :param f_cycle_id: The index of cycle, from 0.
+        :param f_channel: The file name of channel.
+        :param f_projection: The projection of z-stack, 'max' (default) or 'focus'.
+        :return: The image matrix.
+        """
+        image_file = '/'.join((self.cycles[f_cycle_id], f_channel))
+
+        if self.region is None:
+            return read_channel(image_file, f_projection)
+
+        pages = TiffPages(image_file)
+
+        return project_planes((pages.read(_, self.region) for _ in range(0, pages.page_num)), f_projection)
+
+
+class CycleStacks:
+    def __init__(self, f_image_files, f_channels, f_region=None):
+        """
+        This method will index the pages of stacks by cycle, channel and focal plane, without reading any pixel.
+
+        :param f_image_files: The stacks in sequence of cycles, each of which holds one or more cycles.
+        :param f_channels: The file names of channels, such as 'Y5.tif', which are matched to the names of channels
+                           in the description of stacks, or taken in order if they are not named.
+        :param f_region: The region (min row, max row, min column, max column) to read, the whole images by default.
+        """
+        self.channels = tuple(f_channels)
+        self.region = f_region
+
+        self.files = list(f_image_files)
+
+        self.__cycles = []
+        self.__file_ids = []
+
+        for file_id, image_file in enumerate(self.files):
+            pages = TiffPages(image_file)
+            layout = self.__layout(pages)
+
+            self.__cycles.extend((pages, layout, _) for _ in range(0, layout['sizes']['T']))
+            self.__file_ids.extend([file_id] * layout['sizes']['T'])
+
+        self.cycle_num = len(self.__cycles)
+
+    def file_num(self, f_cycle_num):
+        """
+        This method is used to get the number of the first stacks which hold the first cycles.
+
+        :param f_cycle_num: The number of the first cycles.
+        :return: The number of stacks.
+        """
+        if f_cycle_num < 1:
+            return 0
+
+        return self.__file_ids[min(f_cycle_num, self.cycle_num) - 1] + 1
+
+    def __layout(self, f_pages):
+        """
+        This method is used to parse how the pages of a stack are ordered.
+
+        :param f_pages: The 'TiffPages' object of stack.
+        :return: A dictionary of the sizes of dimensions ('Z', 'C' and 'T' for planes, channels and cycles), their
+                 order from the fastest one, the index of the first page, and the index of each channel.
+        """
+        description = f_pages.tags(0).get(270, '') if f_pages.page_num > 0 else ''
+
+        names = [splitext(_)[0] for _ in self.channels]
+
+        ##############################################################################
+        # Without any description, the pages are taken as the channels of cycles one #
+        # by one, and they should not be left over                                   #
+        ##############################################################################
+        frame_num = f_pages.page_num // len(self.channels) if f_pages.page_num % len(self.channels) == 0 else 0
+
+        layout = {'sizes': {'Z': 1, 'C': len(self.channels), 'T': frame_num}, 'order': 'CZT', 'first': 0}
+        ##############################################################################
+
+        channel_names = []
+
+        ######################################################################################
+        # OME-XML gives the sizes and order of dimensions, and the names of channels, while  #
+        # ImageJ only gives the sizes, in the order of channel, plane and frame              #
+        ######################################################################################
+        if description.lstrip().startswith('<'):
+            try:
+                pixels = next(_ for _ in fromstring(description).iter() if _.tag.split('}')[-1] == 'Pixels')
+
+            except (ParseError, StopIteration):
+                print('INVALID OME-XML IN STACK: ' + f_pages.path, file=stderr)
+                exit(1)
+
+            layout['sizes'] = {_: int(pixels.get('Size' + _, 1)) for _ in 'ZCT'}
+            layout['order'] = pixels.get('DimensionOrder', 'XYZCT')[2:]
+
+            for node in pixels:
+                if node.tag.split('}')[-1] == 'Channel':
+                    channel_names.append(node.get('Name'))
+
+                elif node.tag.split('}')[-1] == 'TiffData' and layout['first'] == 0:
+                    layout['first'] = int(node.get('IFD', 0))
+
+        elif description.startswith('ImageJ='):
+            values = dict(_.split('=', 1) for _ in description.splitlines() if '=' in _)
+
+            layout['sizes'] = {'Z': int(values.get('slices', 1)), 'C': int(values.get('channels', 1)),
+                               'T': int(values.get('frames', 1))}
+        ######################################################################################
+
+        if len(channel_names) > 0 and all(_ in channel_names for _ in names):
+            layout['channels'] = {ch: channel_names.index(name) for ch, name in zip(self.channels, names)}
+
+        elif layout['sizes']['C'] == len(self.channels):
+            layout['channels'] = {ch: _ for _, ch in enumerate(self.channels)}
+
+        else:
+            print('THE CHANNELS OF STACK DO NOT MATCH ' + ', '.join(names) + ': ' + f_pages.path, file=stderr)
+            exit(1)
+
+        if layout['sizes']['T'] < 1 or \
+                layout['first'] + layout['sizes']['Z'] * layout['sizes']['C'] * layout['sizes']['T'] > f_pages.page_num:
+            print('THE PAGES OF STACK DO NOT MATCH ITS CYCLES AND CHANNELS: ' + f_pages.path, file=stderr)
+            exit(1)
+
+        return layout
+
+    def read(self, f_cycle_id, f_channel, f_projection=None):
+        """
+        This method is used to read a channel of a cycle.
+
+        :param f_cycle_id: The index of cycle, from 0.
+        :param f_channel: The file name of channel.
+        :param f_projection: The projection of z-stack, 'max' (default) or 'focus'.
+        :return: The image matrix.
+        """
+        pages, layout, frame = self.__cycles[f_cycle_id]
+
+        def __page_id(f_plane):
+            coordinates = {'Z': f_plane, 'C': layout['channels'][f_channel], 'T': frame}
+
+            page_id = 0
+            stride = 1
+
+            for dim in layout['order']:
+                page_id += coordinates[dim] * stride
+                stride *= layout['sizes'][dim]
+
+            return layout['first'] + page_id
+
+        return project_planes((pages.read(__page_id(_), self.region) for _ in range(0, layout['sizes']['Z'])),
+                              f_projection)
+
+
+def open_cycles(f_cycles, f_channels, f_region=None):
+    """
+    This function is used to open the source of cycles, which are stacks if all of them are files, or directories.
+
+    :param f_cycles: The image directories or stacks in sequence of cycles, or an opened source, which is returned as
+                     it is.
+    :param f_channels: The file names of channels, such as 'Y5.tif'.
+    :param f_region: The region (min row, max row, min column, max column) to read, the whole images by default.
+    :return: The 'CycleStacks' or 'CycleDirectories' object.
+    """
+    if isinstance(f_cycles, (CycleStacks, CycleDirectories)):
+        return f_cycles
+
+    if len(f_cycles) > 0 and all(isfile(_) for _ in f_cycles):
+        return CycleStacks(f_cycles, f_channels, f_region)
+
+    return CycleDirectories(f_cycles, f_channels, f_region)
+
+
+def available_memory():
+    """
+    This function is used to get the memory available for new data, from '/proc/meminfo' of Linux.
+
+    :return: The bytes of memory available, or None if it is unknown.
+    """
+    try:
+        with open('/proc/meminfo', 'rt') as IN:
+            for line in IN:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+class CyclePrefetcher:
+    def __init__(self, f_source, f_channels, f_projection=None, f_depth=None, f_memory=None, f_cycle_ids=None):
+        """
+        This method will start reading the first cycle in background.
+
+        :param f_source: The source opened by 'open_cycles'.
+        :param f_channels: The file names of channels to read for each cycle, such as 'Y5.tif'.
+        :param f_projection: The projection of channels which are z-stacks, 'max' (default) or 'focus'.
+        :param f_depth: The number of cycles read ahead, 1 by default. If it is 0, each cycle is read only when it is
+                        requested, as without prefetcher.
+        :param f_memory: The bytes of memory for the cycles read ahead, half of the available memory by default.
+        :param f_cycle_ids: The indices of cycles (from 0) in the order to read, all the cycles by default, so that
+                            only these cycles are read ahead.
+        """
+        self.source = f_source
+        self.channels = list(f_channels)
+        self.projection = f_projection
+        self.depth = 1 if f_depth is None else max(int(f_depth), 0)
+        self.memory = f_memory
+        self.cycle_ids = list(range(0, self.source.cycle_num)) if f_cycle_ids is None else list(f_cycle_ids)
+
+        if self.memory is None:
+            memory = available_memory()
+
+            self.memory = None if memory is None else memory // 2
+
+        self.__cycles = {}
+        self.__pool = None
+
+        if self.depth > 0:
+            self.__pool = ThreadPoolExecutor(len(self.channels))
+
+            if len(self.cycle_ids) > 0:
+                self.__submit(self.cycle_ids[0])
+
+    def __submit(self, f_cycle_id):
+        """
+        This method is used to read the channels of a cycle in background, each of which by a thread.
+
+        :param f_cycle_id: The index of cycle, from 0.
+        :return: NONE
+        """
+        if f_cycle_id < self.source.cycle_num and f_cycle_id not in self.__cycles:
+            self.__cycles[f_cycle_id] = [self.__pool.submit(self.source.read, f_cycle_id, _, self.projection)
+                                         for _ in self.channels]
+
+    def read(self, f_cycle_id):
+        """
+        This method is used to get the channels of a cycle, and start reading the next cycles in background.
+
+        :param f_cycle_id: The index of cycle, from 0.
+        :return: A dictionary of the image matrices of channels, by their file names.
+        """
+        if self.__pool is None:
+            return {_: self.source.read(f_cycle_id, _, self.projection) for _ in self.channels}
+
+        self.__submit(f_cycle_id)
+
+        channels = dict(zip(self.channels, [_.result() for _ in self.__cycles.pop(f_cycle_id)]))
+
+        ###############################################################################
+        # The cycles read ahead are limited by the memory, which takes the size of    #
+        # this cycle as the one of each cycle                                         #
+        ###############################################################################
+        cycle_bytes = sum(_.nbytes for _ in channels.values())
+
+        depth = self.depth
+
+        if self.memory is not None and cycle_bytes > 0:
+            depth = min(depth, self.memory // cycle_bytes)
+
+        next_id = self.cycle_ids.index(f_cycle_id) + 1 if f_cycle_id in self.cycle_ids else len(self.cycle_ids)
+
+        for cycle_id in self.cycle_ids[next_id:(next_id + depth)]:
+            self.__submit(cycle_id)
+        ###############################################################################
+
+        return channels
+
+    def close(self):
+        """
+        This method is used to stop reading, and drop the cycles read ahead but not requested.
+
+        :return: NONE
+        """
+        if self.__pool is not None:
+            for futures in self.__cycles.values():
+                for future in futures:
+                    future.cancel()
+
+            self.__cycles = {}
+
+            self.__pool.shutdown()
+            self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+if __name__ == '__main__':
+    pass
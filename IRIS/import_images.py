@@ -11,48 +11,147 @@ DAPI background.
 
 Our software generate a 3D matrix to store all the images. Each channel is made of a image matrix, and insert into this
 tensor in the order of cycle
+
+A channel could also be a z-stack, which is a multi-page TIFF of focal planes. It is projected into one image while
+being read, plane by plane, by the maximum of each pixel or by the plane in best focus, so that only two planes are
+kept in memory and no projected images need to be stored.
+
+Instead of the directories of cycles, the channels of all the cycles could also be given as stacks of multi-page TIFF
+(such as OME-TIFF), which are read by 'IRIS.image_sources' page by page, and only in the region of interest.
+
+The channels of the next cycle are read ahead in I/O threads while the current cycle is being registered, so that the
+time of reading, which is as long as computing on network storage, is mostly hidden.
+
+Only some of the cycles could be imported, such as the cycles appended to a run. The reference (the background, the
+mask of tissue and the features of the first cycle for registration) and the transform matrices of the previous
+cycles are then given, so that the first cycle is not read again, and only the new cycles are registered.
+
+For a section which covers only a part of FOV, the tissue could be found from the signal channels of the first cycle by
+'IRIS.tissue_mask'. Its mask is used by registration to ignore the key points on empty glass, and its regions are
+returned for detection.
 """
 
 
 from sys import stderr
-from cv2 import (imread, imwrite, add, addWeighted, warpAffine,
-                 IMREAD_GRAYSCALE)
+from os.path import join
+from cv2 import (imwrite, add, addWeighted, warpAffine)
 from numpy import (array, uint8)
 
+from .image_sources import (CHANNELS, open_cycles, CyclePrefetcher)
 from .register_images import register_cycles
+from .tissue_mask import (tissue_mask, mask_regions)
+from .profiler import PROFILER
+
 
+def __stack_cycle(f_cycle_stack, f_stack_id, f_images, f_cycle_num, f_allocate):
+    """
+    For storing the registered images of a cycle into the 3D matrix of cycles.
+
+    If a function of allocation is given, the 4D matrix is allocated by it for the first cycle, and each cycle is
+    written into its slice as soon as it is registered, so that only the images of one cycle are kept out of it.
 
-def decode_data_Ke(f_cycles):
+    :param f_cycle_stack: The 3D matrix of cycles stored so far.
+    :param f_stack_id: The index of this cycle in the 3D matrix.
+    :param f_images: The images of channels of this cycle.
+    :param f_cycle_num: The number of cycles to store.
+    :param f_allocate: The function of allocation, or None for a list of lists.
+    :return: The 3D matrix of cycles.
+    """
+    if f_allocate is None:
+        f_cycle_stack.append(f_images)
+
+        return f_cycle_stack
+
+    if f_stack_id == 0:
+        f_cycle_stack = f_allocate((f_cycle_num, len(f_images)) + f_images[0].shape, f_images[0].dtype)
+
+    for channel_id, img in enumerate(f_images):
+        f_cycle_stack[f_stack_id, channel_id] = img
+
+    return f_cycle_stack
+
+
+def decode_data_Ke(f_cycles, f_registration=None, f_output_dir=None, f_transforms=None, f_projection=None,
+                   f_registration_stats=None, f_prefetch=None, f_tissue_regions=None, f_reference=None,
+                   f_cycle_ids=None, f_allocate=None):
     """
     For parsing data generated by the technique described in Ke et al, Nature Methods (2013).
 
     Input the directories of cycle.
     Returning a pixel matrix which contains all the gray scales of image pixel as well as their coordinates.
 
-    :param f_cycles: The image directories in sequence of cycles, of which the different channels are stored.
-    :return: A tuple including a 3D matrix and a background image matrix.
+    :param f_cycles: The image directories or stacks in sequence of cycles, or a source opened by 'open_cycles'.
+    :param f_registration: The algorithm of key points detection for registration, 'ORB' (default) or 'BRISK'.
+    :param f_output_dir: The directory of the registered images for checking, the current one by default.
+    :param f_transforms: A list of the transform matrices of cycles. The matrices in it are used instead of
+                         registration, and the matrices of the cycles after them are registered and appended into it.
+    :param f_projection: The projection of channels which are z-stacks, 'max' (default) or 'focus'.
+    :param f_registration_stats: A dictionary, into which the statistics of registration of each cycle are stored by
+                                 the index of cycle if given, as 'register_cycles' collects them.
+    :param f_prefetch: The number of cycles read ahead in background, 1 by default, and 0 for reading each cycle only
+                       when it is processed.
+    :param f_tissue_regions: A list, into which the regions of tissue found in the signal channels of the first cycle
+                             are appended if given, as (min row, max row, min column, max column). The mask of tissue
+                             is also used by registration.
+    :param f_reference: A dictionary of the reference (the first cycle), which could be pickled, including its
+                        background, mask of tissue and features for registration. It is filled when the first cycle is
+                        read if given, and the first cycle is not read again if it is filled.
+    :param f_cycle_ids: The indices of cycles (from 0) to import, all the cycles by default.
+    :param f_allocate: A function called with the shape (cycle x channel x row x column) and data type of the 3D
+                       matrix, once they are known, which returns a writable 4D matrix to store the cycles, such as
+                       'SharedStack.allocate'. The cycles are stored in a list of lists by default.
+    :return: A tuple including a 3D matrix of the cycles imported and a background image matrix.
     """
-    if len(f_cycles) < 1:
+    source = open_cycles(f_cycles, CHANNELS['--ke'])
+
+    if source.cycle_num < 1:
         print('ERROR CYCLES', file=stderr)
 
         exit(1)
 
+    registration = 'ORB' if f_registration is None else f_registration
+    output_dir = '.' if f_output_dir is None else f_output_dir
+
+    cycle_ids = list(range(0, source.cycle_num)) if f_cycle_ids is None else sorted(f_cycle_ids)
+    transforms = [] if f_transforms is None else f_transforms
+    reference = {} if f_reference is None else f_reference
+
+    ##############################################################################
+    # The first cycle is always read for a new reference, as well as the cycles  #
+    # without transform matrices, since the matrices are appended in order       #
+    ##############################################################################
+    read_ids = sorted(set(cycle_ids) | set(range(len(transforms), max(cycle_ids, default=-1) + 1)) |
+                      (set() if 'background' in reference else {0}))
+    ##############################################################################
+
+    prefetcher = CyclePrefetcher(source, ['Y5.tif', 'FAM.tif', 'TXR.tif', 'Y3.tif', 'DAPI.tif'], f_projection,
+                                 f_prefetch, None, read_ids)
+
     f_cycle_stack = []
+    stacked_num = 0
+
+    f_std_img = reference.get('background', array([], dtype=uint8))
+    reg_ref = None
+    reg_mask = reference.get('mask')
 
-    f_std_img = array([], dtype=uint8)
-    reg_ref = array([], dtype=uint8)
+    if f_tissue_regions is not None and 'regions' in reference:
+        f_tissue_regions.extend(reference['regions'])
 
-    for cycle_id in range(0, len(f_cycles)):
+    for cycle_id in read_ids:
         adj_img_mats = []
 
+        PROFILER.begin('import', cycle_id + 1)
+
         ####################################
         # Read five channels into a matrix #
         ####################################
-        channel_A = imread('/'.join((f_cycles[cycle_id], 'Y5.tif')),   IMREAD_GRAYSCALE)
-        channel_T = imread('/'.join((f_cycles[cycle_id], 'FAM.tif')),  IMREAD_GRAYSCALE)
-        channel_C = imread('/'.join((f_cycles[cycle_id], 'TXR.tif')),  IMREAD_GRAYSCALE)
-        channel_G = imread('/'.join((f_cycles[cycle_id], 'Y3.tif')),   IMREAD_GRAYSCALE)
-        channel_0 = imread('/'.join((f_cycles[cycle_id], 'DAPI.tif')), IMREAD_GRAYSCALE)
+        channels = prefetcher.read(cycle_id)
+
+        channel_A = channels['Y5.tif']
+        channel_T = channels['FAM.tif']
+        channel_C = channels['TXR.tif']
+        channel_G = channels['Y3.tif']
+        channel_0 = channels['DAPI.tif']
         ####################################
 
         #########################################################################################
@@ -73,7 +172,7 @@ def decode_data_Ke(f_cycles):
         # merged_img = addWeighted(add(add(add(channel_A, channel_T), channel_C), channel_G), alpha, channel_0, beta, 0)
         ###############################
 
-        if cycle_id == 0:
+        if cycle_id == 0 and 'background' not in reference:
             reg_ref = merged_img
 
             ###################################
@@ -89,22 +188,45 @@ def decode_data_Ke(f_cycles):
             # f_std_img = addWeighted(foreground, 0.4, background, 0.8, 0)  # Alternative option
             ###################################
 
-        trans_mat = register_cycles(reg_ref, merged_img, 'ORB')
+            reference.update({'background': f_std_img, 'shape': reg_ref.shape})
+
+            if f_tissue_regions is not None:
+                reg_mask = tissue_mask(foreground)
+
+                f_tissue_regions.extend(mask_regions(reg_mask))
+
+                reference.update({'mask': reg_mask, 'regions': list(f_tissue_regions)})
+
+        PROFILER.end()
+
+        PROFILER.begin('registration', cycle_id + 1)
+
+        if cycle_id < len(transforms):
+            trans_mat = transforms[cycle_id]
+
+        else:
+            registration_stats = None if f_registration_stats is None else f_registration_stats.setdefault(cycle_id, {})
+
+            trans_mat = register_cycles(reg_ref, merged_img, registration, registration_stats, reg_mask, reference)
+
+            transforms.append(trans_mat)
+
+        height, width = reference['shape']
 
         #############################
         # For registration checking #
         #############################
-        debug_img = warpAffine(merged_img, trans_mat, (reg_ref.shape[1], reg_ref.shape[0]))
+        debug_img = warpAffine(merged_img, trans_mat, (width, height))
 
         debug_img = uint8(debug_img)
         # imwrite('debug.cycle_' + str(int(cycle_id + 1)) + '.tif', merged_img)
-        imwrite('debug.cycle_' + str(int(cycle_id + 1)) + '.reg.tif', debug_img)
+        imwrite(join(output_dir, 'debug.cycle_' + str(int(cycle_id + 1)) + '.reg.tif'), debug_img)
         #############################
 
-        channel_A = warpAffine(channel_A, trans_mat, (reg_ref.shape[1], reg_ref.shape[0]))
-        channel_T = warpAffine(channel_T, trans_mat, (reg_ref.shape[1], reg_ref.shape[0]))
-        channel_C = warpAffine(channel_C, trans_mat, (reg_ref.shape[1], reg_ref.shape[0]))
-        channel_G = warpAffine(channel_G, trans_mat, (reg_ref.shape[1], reg_ref.shape[0]))
+        channel_A = warpAffine(channel_A, trans_mat, (width, height))
+        channel_T = warpAffine(channel_T, trans_mat, (width, height))
+        channel_C = warpAffine(channel_C, trans_mat, (width, height))
+        channel_G = warpAffine(channel_G, trans_mat, (width, height))
 
         adj_img_mats.append(channel_A)
         adj_img_mats.append(channel_T)
@@ -112,41 +234,74 @@ def decode_data_Ke(f_cycles):
         adj_img_mats.append(channel_G)
         #########################################################################################
 
+        PROFILER.end()
+
         ###################################################################################################
         # This stacked 3D-tensor is a common data structure for following analysis and data compatibility #
         ###################################################################################################
-        f_cycle_stack.append(adj_img_mats)
+        if cycle_id in cycle_ids:
+            f_cycle_stack = __stack_cycle(f_cycle_stack, stacked_num, adj_img_mats, len(cycle_ids), f_allocate)
+
+            stacked_num += 1
         ###################################################################################################
 
+    prefetcher.close()
+
     return f_cycle_stack, f_std_img
 
 
-def decode_data_Chen(f_cycles):
+def decode_data_Chen(f_cycles, f_output_dir=None, f_projection=None, f_prefetch=None, f_reference=None,
+                     f_cycle_ids=None, f_allocate=None):
     """
     For parsing data generated by the technique described in Chen et al, Science (2015).
 
     Input the directories of cycle.
     Returning a pixel matrix which contains all the gray scales of image pixel as well as their coordinates.
 
-    :param f_cycles: The image directories in sequence of cycles, of which the different channels are stored.
-    :return: A tuple including a 3D matrix and a background image matrix.
+    :param f_cycles: The image directories or stacks in sequence of cycles, or a source opened by 'open_cycles'.
+    :param f_output_dir: The directory of the merged images for checking, the current one by default.
+    :param f_projection: The projection of channels which are z-stacks, 'max' (default) or 'focus'.
+    :param f_prefetch: The number of cycles read ahead in background, 1 by default, and 0 for reading each cycle only
+                       when it is processed.
+    :param f_reference: A dictionary of the reference (the first cycle), which could be pickled, including its
+                        background. It is filled when the first cycle is read if given, and the first cycle is not
+                        read again if it is filled.
+    :param f_cycle_ids: The indices of cycles (from 0) to import, all the cycles by default.
+    :param f_allocate: A function called with the shape (cycle x channel x row x column) and data type of the 3D
+                       matrix, once they are known, which returns a writable 4D matrix to store the cycles, such as
+                       'SharedStack.allocate'. The cycles are stored in a list of lists by default.
+    :return: A tuple including a 3D matrix of the cycles imported and a background image matrix.
     """
-    if len(f_cycles) < 1:
+    source = open_cycles(f_cycles, CHANNELS['--chen'])
+
+    if source.cycle_num < 1:
         print('ERROR CYCLES', file=stderr)
 
         exit(1)
 
+    output_dir = '.' if f_output_dir is None else f_output_dir
+
+    cycle_ids = list(range(0, source.cycle_num)) if f_cycle_ids is None else sorted(f_cycle_ids)
+    reference = {} if f_reference is None else f_reference
+
+    read_ids = sorted(set(cycle_ids) | (set() if 'background' in reference else {0}))
+
+    prefetcher = CyclePrefetcher(source, ['STORM.tif'], f_projection, f_prefetch, None, read_ids)
+
     f_cycle_stack = []
+    stacked_num = 0
 
-    f_std_img = array([], dtype=uint8)
+    f_std_img = reference.get('background', array([], dtype=uint8))
 
-    for cycle_id in range(0, len(f_cycles)):
+    for cycle_id in read_ids:
         adj_img_mats = []
 
+        PROFILER.begin('import', cycle_id + 1)
+
         ####################################
         # Read five channels into a matrix #
         ####################################
-        channel_0 = imread('/'.join((f_cycles[cycle_id], 'STORM.tif')), IMREAD_GRAYSCALE)
+        channel_0 = prefetcher.read(cycle_id)['STORM.tif']
         ####################################
 
         #########################################################################################
@@ -157,30 +312,39 @@ def decode_data_Chen(f_cycles):
         #########################################################################################
         merged_img = channel_0
 
-        if cycle_id == 0:
+        if cycle_id == 0 and 'background' not in reference:
             ###################################
             # Output background independently #
             ###################################
             f_std_img = channel_0
             ###################################
 
+            reference.update({'background': f_std_img})
+
         # trans_mat = register_cycles(reg_ref, merged_img, 'ORB')  # Don't need registration
 
         ########################
         # For merging checking #
         ########################
-        imwrite('debug.cycle_' + str(int(cycle_id + 1)) + '.tif', merged_img)
+        imwrite(join(output_dir, 'debug.cycle_' + str(int(cycle_id + 1)) + '.tif'), merged_img)
         ########################
 
         adj_img_mats.append(channel_0)
         #########################################################################################
 
+        PROFILER.end()
+
         ###################################################################################################
         # This stacked 3D-tensor is a common data structure for following analysis and data compatibility #
         ###################################################################################################
-        f_cycle_stack.append(adj_img_mats)
+        if cycle_id in cycle_ids:
+            f_cycle_stack = __stack_cycle(f_cycle_stack, stacked_num, adj_img_mats, len(cycle_ids), f_allocate)
+
+            stacked_num += 1
         ###################################################################################################
 
+    prefetcher.close()
+
     return f_cycle_stack, f_std_img
 
 
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+This model is used to run the per-blob loops of detection and connection, by Numba if it is installed, or by NumPy.
+
+Two kernels are provided. 'blob_scores' calculates the base score of each blob in each channel, which is the mean gray
+scale of its core region subtracted by the one of its surrounding. 'search_min_error' searches the region around each
+reference blob for the base of the least adjusted error rate in a cycle.
+
+Each kernel is written twice. The loop version is compiled by Numba on its first call, and cached in '__pycache__' for
+the following processes. The NumPy version calculates the box sums of all blobs at once from integral images, and
+searches all the coordinates of regions at once in the sorted coordinates of bases. Both versions give the same
+results as the original loops bit for bit, including the clipped regions of blobs near the border, whose negative
+starts wrap around as Python slices do.
+
+The backend is chosen by 'set_backend', which uses Numba if it could be imported by default. Numba is imported only
+when a kernel is called for the first time.
+"""
+
+
+from sys import stderr
+from importlib.util import find_spec
+from numpy import (asarray, stack, zeros, ones, full, arange, where, minimum, maximum, searchsorted, argsort, argmin,
+                   sqrt, power, uint8, int64, float64)
+
+
+BACKENDS = ('numpy', 'numba')
+
+__SETTINGS = {'backend': None, 'compiled': {}}
+
+
+def set_backend(f_backend=None):
+    """
+    This function is used to choose the backend of kernels.
+
+    :param f_backend: 'numba', 'numpy', or None for Numba if it is installed.
+    :return: NONE
+    """
+    if f_backend is None:
+        f_backend = 'numba' if find_spec('numba') is not None else 'numpy'
+
+    if f_backend not in BACKENDS:
+        print('Only numba or numpy could be used as the backend of kernels', file=stderr)
+        exit(1)
+
+    if f_backend == 'numba' and find_spec('numba') is None:
+        print('NUMBA IS NOT INSTALLED', file=stderr)
+        exit(1)
+
+    __SETTINGS['backend'] = f_backend
+
+
+def backend():
+    """
+    This function is used to get the backend of kernels, which is chosen by default if it is not set.
+
+    :return: 'numba' or 'numpy'.
+    """
+    if __SETTINGS['backend'] is None:
+        set_backend()
+
+    return __SETTINGS['backend']
+
+
+def __compiled(f_kernel):
+    """
+    For compiling a loop kernel by Numba, only once in each process.
+
+    :param f_kernel: The loop kernel.
+    :return: The compiled kernel.
+    """
+    if f_kernel.__name__ not in __SETTINGS['compiled']:
+        from numba import njit
+
+        __SETTINGS['compiled'].update({f_kernel.__name__: njit(cache=True, nogil=True)(f_kernel)})
+
+    return __SETTINGS['compiled'][f_kernel.__name__]
+
+
+def warm_up():
+    """
+    This function is used to compile the kernels of the chosen backend before they are timed or used by a worker,
+    which loads them from the cache of Numba if they were compiled by another process.
+
+    :return: NONE
+    """
+    blob_scores((zeros((8, 8), dtype=uint8),), [4], [4], (-1, 4), (-4, 10))
+    search_min_error([4], [4], [0.5], [4], [4], 2)
+
+
+############################################################################################
+# Loop kernels, which are only run after being compiled by Numba, since the same loops in  #
+# Python are much slower than the NumPy versions                                           #
+############################################################################################
+def box_sums_loop(f_images, f_rows, f_cols, f_offset, f_size):
+    """
+    The loop kernel of 'box_sums', for one region.
+    """
+    channel_num, height, width = f_images.shape
+
+    sums = zeros((f_rows.shape[0], channel_num), dtype=int64)
+
+    for i in range(0, f_rows.shape[0]):
+        r0 = f_rows[i] + f_offset
+        c0 = f_cols[i] + f_offset
+        r1 = min(r0 + f_size, height)
+        c1 = min(c0 + f_size, width)
+
+        if r0 < 0:
+            r0 = max(r0 + height, 0)
+
+        if c0 < 0:
+            c0 = max(c0 + width, 0)
+
+        for channel_id in range(0, channel_num):
+            box_sum = 0
+
+            for row in range(r0, r1):
+                for col in range(c0, c1):
+                    box_sum += f_images[channel_id, row, col]
+
+            sums[i, channel_id] = box_sum
+
+    return sums
+
+
+def search_min_error_loop(f_keys, f_error_rates, f_rows, f_cols, f_search_region, f_stride, f_exponent):
+    """
+    The loop kernel of 'search_min_error'.
+    """
+    chosen = full(f_rows.shape[0], -1, dtype=int64)
+    min_error_rates = ones(f_rows.shape[0], dtype=float64)
+
+    for i in range(0, f_rows.shape[0]):
+        r = f_rows[i]
+        c = f_cols[i]
+
+        for row in range(r - f_search_region, r + (f_search_region + 2)):
+            for col in range(c - f_search_region, c + (f_search_region + 2)):
+                if row < 0 or col < 0 or col >= f_stride:
+                    continue
+
+                idx = searchsorted(f_keys, row * f_stride + col)
+
+                if idx < f_keys.shape[0] and f_keys[idx] == row * f_stride + col:
+                    error_rate = f_error_rates[idx]
+
+                    D = sqrt((row - r) ** 2 + (col - c) ** 2)
+                    adj_err_rate = sqrt(((error_rate * D) ** f_exponent) + (error_rate ** f_exponent))
+
+                    if adj_err_rate > 1:
+                        adj_err_rate = 1.0
+
+                    if adj_err_rate < min_error_rates[i]:
+                        chosen[i] = idx
+                        min_error_rates[i] = adj_err_rate
+
+    return chosen, min_error_rates
+############################################################################################
+
+
+def box_sums(f_images, f_rows, f_cols, f_regions):
+    """
+    This function is used to sum up the square regions of each blob in each image, as the slices of
+    'img[(r + offset):(r + offset + size), (c + offset):(c + offset + size)]'.
+
+    :param f_images: A 3D matrix of images.
+    :param f_rows: The rows of blobs.
+    :param f_cols: The columns of blobs.
+    :param f_regions: A list of regions, each of which is composed of its offset from the blob and its edge length.
+    :return: A list of matrices of sums (int64), blob x image, one for each region.
+    """
+    if backend() == 'numba':
+        return [__compiled(box_sums_loop)(f_images, f_rows, f_cols, offset, size) for offset, size in f_regions]
+
+    channel_num, height, width = f_images.shape
+
+    integral = zeros((channel_num, height + 1, width + 1), dtype=int64)
+    integral[:, 1:, 1:] = f_images.cumsum(axis=1, dtype=int64).cumsum(axis=2)
+
+    sums_list = []
+
+    for offset, size in f_regions:
+        ###############################################################################
+        # The regions are clipped as Python slices, and the sum of a region is taken  #
+        # from four corners of the integral image                                     #
+        ###############################################################################
+        r0 = f_rows + offset
+        c0 = f_cols + offset
+        r1 = minimum(r0 + size, height)
+        c1 = minimum(c0 + size, width)
+
+        r0 = minimum(where(r0 < 0, maximum(r0 + height, 0), r0), height)
+        c0 = minimum(where(c0 < 0, maximum(c0 + width, 0), c0), width)
+        r1 = maximum(r1, r0)
+        c1 = maximum(c1, c0)
+
+        sums_list.append((integral[:, r1, c1] - integral[:, r0, c1] - integral[:, r1, c0] + integral[:, r0, c0]).T)
+        ###############################################################################
+
+    return sums_list
+
+
+def blob_scores(f_images, f_rows, f_cols, f_core, f_surround):
+    """
+    This function is used to calculate the base scores of blobs, which is the mean gray scale of core region subtracted
+    by the one of surrounding region.
+
+    :param f_images: A list of images in the same shape, one for each channel.
+    :param f_rows: The rows of blobs.
+    :param f_cols: The columns of blobs.
+    :param f_core: The offset and edge length of core region, such as (-1, 4) for a 4x4 region.
+    :param f_surround: The offset and edge length of surrounding region, such as (-4, 10) for a 10x10 region.
+    :return: A matrix of base scores (float64), blob x channel.
+    """
+    core_sums, surround_sums = box_sums(stack(f_images), asarray(f_rows, dtype=int64), asarray(f_cols, dtype=int64),
+                                        (f_core, f_surround))
+
+    return core_sums / (f_core[1] * f_core[1]) - surround_sums / (f_surround[1] * f_surround[1])
+
+
+def search_min_error(f_base_rows, f_base_cols, f_error_rates, f_ref_rows, f_ref_cols, f_search_region, f_chunk=None):
+    """
+    This function is used to search the region of each reference blob for the base of the least error rate, which is
+    adjusted by its distance to the reference blob. The region is searched row by row, and the first one of ties is
+    chosen.
+
+    :param f_base_rows: The rows of bases in a cycle.
+    :param f_base_cols: The columns of bases in a cycle.
+    :param f_error_rates: The error rates of bases.
+    :param f_ref_rows: The rows of reference blobs.
+    :param f_ref_cols: The columns of reference blobs.
+    :param f_search_region: The search region n, which searches a ((n + 1) * 2)x((n + 1) * 2) region.
+    :param f_chunk: The number of reference blobs searched at once by NumPy, 65536 by default.
+    :return: A tuple of the index of chosen base of each reference blob (-1 for none), and its adjusted error rate (1
+             for none).
+    """
+    chunk = 65536 if f_chunk is None else int(f_chunk)
+
+    base_rows = asarray(f_base_rows, dtype=int64)
+    base_cols = asarray(f_base_cols, dtype=int64)
+    error_rates = asarray(f_error_rates, dtype=float64)
+    ref_rows = asarray(f_ref_rows, dtype=int64)
+    ref_cols = asarray(f_ref_cols, dtype=int64)
+
+    if base_rows.shape[0] == 0:
+        return full(ref_rows.shape[0], -1, dtype=int64), ones(ref_rows.shape[0], dtype=float64)
+
+    ####################################################################################
+    # The squares are calculated by 'pow' as the original loops, which is not always   #
+    # the same as multiplying by itself in the last bit. The exponent is passed into   #
+    # the loop kernel as a variable, otherwise Numba compiles it into a multiplication #
+    ####################################################################################
+    exponent = 2.0
+    ####################################################################################
+
+    ##################################################################################
+    # Coordinates of bases are sorted as keys of row * stride + column, and the      #
+    # columns out of stride are never searched, since there is no base in them       #
+    ##################################################################################
+    stride = int(base_cols.max()) + 1
+
+    keys = base_rows * stride + base_cols
+    order = argsort(keys, kind='stable')
+    keys = keys[order]
+    error_rates = error_rates[order]
+    ##################################################################################
+
+    if backend() == 'numba':
+        chosen, min_error_rates = __compiled(search_min_error_loop)(keys, error_rates, ref_rows, ref_cols,
+                                                                     int(f_search_region), stride, exponent)
+
+    else:
+        offsets = arange(-f_search_region, f_search_region + 2, dtype=int64)
+        offset_rows = offsets.repeat(offsets.shape[0])
+        offset_cols = asarray(list(offsets) * offsets.shape[0], dtype=int64)
+
+        D = sqrt(offset_rows ** 2 + offset_cols ** 2)
+
+        chosen = full(ref_rows.shape[0], -1, dtype=int64)
+        min_error_rates = ones(ref_rows.shape[0], dtype=float64)
+
+        for start in range(0, ref_rows.shape[0], chunk):
+            rows = ref_rows[start:start + chunk, None] + offset_rows[None, :]
+            cols = ref_cols[start:start + chunk, None] + offset_cols[None, :]
+
+            idx = minimum(searchsorted(keys, rows * stride + cols), keys.shape[0] - 1)
+            found = (rows >= 0) & (cols >= 0) & (cols < stride) & (keys[idx] == rows * stride + cols)
+
+            error_rate = error_rates[idx]
+
+            adj_err_rate = minimum(sqrt(power(error_rate * D, exponent) + power(error_rate, exponent)), 1.0)
+            adj_err_rate[~found] = 1.0
+
+            best = argmin(adj_err_rate, axis=1)
+            best_err_rate = adj_err_rate[arange(best.shape[0]), best]
+
+            chosen[start:start + chunk] = where(best_err_rate < 1, idx[arange(best.shape[0]), best], -1)
+            min_error_rates[start:start + chunk] = best_err_rate
+
+    return where(chosen >= 0, order[maximum(chosen, 0)], -1), min_error_rates
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""
+This model is used to run the whole process of base calling on FOVs, as an importable alternative of 'pyIRIS.py'.
+
+All the parameters of a run are gathered into a 'PipelineConfig', which covers the technique of data (Ke's or Chen's),
+the method of registration, the parameters of blob detector, the search region for connecting bases, the output
+directory and the output formats. A 'Pipeline' is built once from its config, then runs FOV after FOV in the same
+process, so that a scheduler could avoid starting the interpreter and loading the libraries for each FOV. The codebook
+is also loaded once, and shared by all the FOVs.
+
+The cycles of a FOV are either directories with an image for each channel, or stacks of multi-page TIFF, which are
+read lazily, only in the region given by the config if any.
+
+If several processes are given, the cycles are detected in parallel by a pool of workers, which map the images of
+cycles from shared memory instead of receiving their copies.
+
+If the tissue mask is enabled, the tissue is found in the signal channels of the first cycle, and the registration and
+detection skip the empty glass out of it.
+
+If pruning is enabled with a codebook, the blobs whose partial barcodes could never be decoded are dropped after each
+cycle is connected, so that they are neither connected in the following cycles nor output.
+
+Hooks could be added to each stage ('import', 'detection', 'connection' and 'output'). A hook is called with the FOV
+and the result of its stage as soon as the stage finishes, and could return a new result to replace it.
+
+If checkpoints are enabled, the results of stages (the transform matrices of registration, the base box of each cycle,
+the filtered blobs and the adjusted bases) are saved into 'checkpoint' of the output directory, and a resumed run
+starts from the latest stage saved, as long as its inputs and parameters are not changed. The stages loaded from
+checkpoints are skipped, as well as their hooks.
+
+Since the registration and detection of a cycle only depend on the cycles up to it, new cycles could be appended to a
+run with checkpoints, as the sequencing goes on cycle by cycle. Only the new cycles are read, registered (against the
+features of the first cycle saved) and detected, while the bases of all the cycles are connected again from their
+base boxes saved, and the outputs are rewritten.
+
+    pipeline.run(['%s/%d' % (fov, _) for _ in range(1, 5)], 'result/' + fov)
+    pipeline.append(['%s/5' % fov], 'result/' + fov)
+
+The statistics of registration and detection are collected while the stages run, and written with the ones of reads as
+'basecalling_summary.*' of the output directory. They are saved with the checkpoints of their stages, and replayed when
+the stages are loaded, so that the summary of a resumed or appended run covers all the cycles.
+
+    from IRIS.pipeline import (Pipeline, PipelineConfig)
+
+    pipeline = Pipeline(PipelineConfig('ke', f_output_dir='result', f_codebook='barcode_info.txt'))
+
+    for fov in fovs:
+        pipeline.run(['%s/%d' % (fov, _) for _ in range(1, 5)], 'result/' + fov)
+"""
+
+
+from sys import stderr
+from os import makedirs
+from os.path import (join, abspath)
+from multiprocessing import Pool
+
+from .import_images import (decode_data_Ke, decode_data_Chen)
+from .image_sources import (CHANNELS, PROJECTIONS, open_cycles)
+from .detect_signals import (detect_blobs_Ke, detect_blobs_Chen)
+from .connect_barcodes import BarcodeCube
+from .decode_barcodes import Codebook
+from .count_matrix import CountMatrix
+from .deal_with_result import write_reads_into_file
+from .run_summary import RunSummary
+from .checkpoint import (Checkpoint, read_manifest)
+from .shared_images import (SharedStack, attach_stack)
+from .kernels import (BACKENDS, set_backend)
+from .profiler import PROFILER
+
+
+MODES = ('ke', 'chen')
+FORMATS = ('db', 'matrix', 'fastq', 'sam')
+STAGES = ('import', 'detection', 'connection', 'output')
+
+
+class PipelineConfig:
+    def __init__(self, f_mode=None, f_registration=None, f_detector_params=None, f_search_region=None,
+                 f_output_dir=None, f_formats=None, f_codebook=None, f_max_distance=None, f_database=None,
+                 f_bin_size=None, f_bin_shape=None, f_checkpoint=None, f_resume=None, f_processes=None,
+                 f_kernels=None, f_projection=None, f_region=None, f_prefetch=None, f_tissue_mask=None,
+                 f_prune=None):
+        """
+        This method will check the parameters of a run and convert them into their types.
+
+        :param f_mode: The technique of data (str), 'ke' (default) or 'chen'.
+        :param f_registration: The algorithm of key points detection for registration (str), 'ORB' (default) or
+                               'BRISK'.
+        :param f_detector_params: The parameters of blob detector (dict) to override the default ones, which are named
+                                  as the attributes of 'SimpleBlobDetector_Params', such as {'minArea': 4}.
+        :param f_search_region: The search region n for connecting bases (int), which searches a
+                                ((n + 1) * 2)x((n + 1) * 2) region, 2 (6x6) by default.
+        :param f_output_dir: The directory of output (str), the current one by default.
+        :param f_formats: The formats (list of str) to output besides 'basecalling_data.txt', 'db' for a SQLite
+                          database with spatial index, 'matrix' for a gene x spatial-bin count matrix, and 'fastq'
+                          or 'sam' for the reads in FASTQ or unaligned SAM compressed in BGZF.
+        :param f_codebook: The barcode info file (str) for decoding barcodes into genes, which are not decoded if not
+                           given.
+        :param f_max_distance: The largest Hamming distance to be corrected in decoding (int), 1 by default.
+        :param f_database: The path of database (str), 'basecalling_data.db' in the output directory by default.
+        :param f_bin_size: The size of spatial bins (float), which is required by the format 'matrix'.
+        :param f_bin_shape: The shape of spatial bins (str), 'square' (default) or 'hex'.
+        :param f_checkpoint: Whether to save the results of stages as checkpoints (bool), False by default.
+        :param f_resume: Whether to resume from the checkpoints of a previous run (bool), which also saves
+                         checkpoints, False by default.
+        :param f_processes: The number of processes for detecting cycles in parallel (int), 1 by default.
+        :param f_kernels: The backend of per-blob kernels (str), 'numba' if it is installed or 'numpy' by default.
+        :param f_projection: The projection of channels which are z-stacks (str), 'max' (default) or 'focus'.
+        :param f_region: The region of images to process, as (min row, max row, min column, max column) or a string
+                         of them separated by commas, the whole images by default. Only this region is read from the
+                         images, and the coordinates of reads are relative to it.
+        :param f_prefetch: The number of cycles read ahead in background while a cycle is being imported (int), 1 by
+                           default, and 0 for none. It is also limited by the memory available.
+        :param f_tissue_mask: Whether to restrict registration and detection to the tissue found in the signal
+                              channels (bool), which is only for the data of Ke, False by default.
+        :param f_prune: Whether to drop the blobs which could never be decoded by the codebook after each cycle (bool),
+                        which requires a codebook, False by default.
+        """
+        self.mode = 'ke' if f_mode is None else str(f_mode).lstrip('-').lower()
+        self.registration = 'ORB' if f_registration is None else str(f_registration).upper()
+        self.detector_params = {} if f_detector_params is None else dict(f_detector_params)
+        self.search_region = 2 if f_search_region is None else int(f_search_region)
+        self.output_dir = '.' if f_output_dir is None else str(f_output_dir)
+        self.formats = [] if f_formats is None else [str(_).lower() for _ in f_formats]
+        self.codebook = None if f_codebook is None else str(f_codebook)
+        self.max_distance = 1 if f_max_distance is None else int(f_max_distance)
+        self.database = None if f_database is None else str(f_database)
+        self.bin_size = None if f_bin_size is None else float(f_bin_size)
+        self.bin_shape = 'square' if f_bin_shape is None else str(f_bin_shape)
+        self.resume = False if f_resume is None else bool(f_resume)
+        self.checkpoint = self.resume or (False if f_checkpoint is None else bool(f_checkpoint))
+        self.processes = 1 if f_processes is None else int(f_processes)
+        self.kernels = None if f_kernels is None else str(f_kernels).lower()
+        self.projection = 'max' if f_projection is None else str(f_projection).lower()
+        self.region = None
+        self.prefetch = 1 if f_prefetch is None else int(f_prefetch)
+        self.tissue_mask = False if f_tissue_mask is None else bool(f_tissue_mask)
+        self.prune = False if f_prune is None else bool(f_prune)
+
+        if f_region is not None:
+            region = str(f_region).split(',') if isinstance(f_region, str) else list(f_region)
+
+            if len(region) != 4 or not all(str(_).strip().isdigit() for _ in region) or \
+                    int(region[0]) >= int(region[1]) or int(region[2]) >= int(region[3]):
+                print('The region should be given as <min row>,<max row>,<min col>,<max col>', file=stderr)
+                exit(1)
+
+            self.region = tuple(int(_) for _ in region)
+
+        if self.mode not in MODES:
+            print('Only the data of Ke (ke) or Chen (chen) could be processed', file=stderr)
+            exit(1)
+
+        if self.registration not in ('ORB', 'BRISK'):
+            print('Only ORB or BRISK could be used for registration', file=stderr)
+            exit(1)
+
+        if self.search_region < 0:
+            print('The search region should not be negative', file=stderr)
+            exit(1)
+
+        for output_format in self.formats:
+            if output_format not in FORMATS:
+                print('Unknown output format: ' + output_format, file=stderr)
+                exit(1)
+
+        if 'matrix' in self.formats and self.bin_size is None:
+            print('The format matrix requires a bin size', file=stderr)
+            exit(1)
+
+        if self.processes < 1:
+            print('The number of processes should be positive', file=stderr)
+            exit(1)
+
+        if self.prefetch < 0:
+            print('The number of cycles read ahead should not be negative', file=stderr)
+            exit(1)
+
+        if self.tissue_mask and self.mode != 'ke':
+            print('The tissue mask is found in four signal channels, which are only in the data of Ke', file=stderr)
+            exit(1)
+
+        if self.prune and self.codebook is None:
+            print('The blobs could only be pruned with a codebook', file=stderr)
+            exit(1)
+
+        if self.kernels is not None and self.kernels not in BACKENDS:
+            print('Only numba or numpy could be used as the backend of kernels', file=stderr)
+            exit(1)
+
+        if self.projection not in PROJECTIONS:
+            print('Only max or focus could be used as the projection of z-stacks', file=stderr)
+            exit(1)
+
+
+def detect_shared_cycle(f_task):
+    """
+    This function is used by the workers of a pool to detect a cycle, whose images are mapped from shared memory.
+
+    :param f_task: A tuple of the descriptor of 'SharedStack', the index of cycle in the stack, the index of cycle
+                   (from 0), the technique of data, the parameters of blob detector, the backend of kernels, whether
+                   to profile and the regions of tissue.
+    :return: A tuple of the index of cycle, its base box, the records of profiler and the statistics of detection.
+    """
+    descriptor, stack_id, cycle_id, mode, detector_params, kernels, profile, regions = f_task
+
+    set_backend(kernels)
+
+    if profile:
+        PROFILER.enable()
+
+    memory, stack = attach_stack(descriptor)
+
+    stats = {}
+
+    try:
+        with PROFILER.stage('detection', cycle_id + 1):
+            if mode == 'ke':
+                base_box = detect_blobs_Ke(stack[stack_id], detector_params, stats, regions)
+
+            else:
+                base_box = detect_blobs_Chen(stack[stack_id], detector_params, stats)
+
+    finally:
+        del stack
+        memory.close()
+
+    return cycle_id, base_box, PROFILER.records, stats
+
+
+class Pipeline:
+    def __init__(self, f_config=None):
+        """
+        This method will initialize a pipeline without any hooks.
+
+        :param f_config: The 'PipelineConfig' object, the default one if not given.
+        """
+        self.config = PipelineConfig() if f_config is None else f_config
+
+        self.__hooks = {_: [] for _ in STAGES}
+        self.__codebooks = {}
+
+    def add_hook(self, f_stage, f_hook):
+        """
+        This method is used to add a hook to a stage, which is called in the order of adding.
+
+        The results of stages are a tuple of the 3D matrix of cycles imported (all the cycles unless some of them are
+        loaded from checkpoints) and the background image ('import'), a list of base boxes, one for each cycle
+        ('detection'), the 'BarcodeCube' object ('connection') and the list of reads ('output').
+
+        :param f_stage: The name of stage, one of 'import', 'detection', 'connection' and 'output'.
+        :param f_hook: A function called with the FOV (a dictionary of its 'cycles' and 'output_dir') and the result
+                       of stage. If it returns anything but None, the result of stage is replaced by it.
+        :return: NONE
+        """
+        if f_stage not in self.__hooks:
+            print('Unknown stage: ' + f_stage, file=stderr)
+            exit(1)
+
+        self.__hooks[f_stage].append(f_hook)
+
+    def __call_hooks(self, f_stage, f_fov, f_result):
+        """
+        This method is used to call the hooks of a stage.
+
+        :param f_stage: The name of stage.
+        :param f_fov: The dictionary of FOV.
+        :param f_result: The result of stage.
+        :return: The result of stage, which might be replaced by hooks.
+        """
+        for hook in self.__hooks[f_stage]:
+            result = hook(f_fov, f_result)
+
+            if result is not None:
+                f_result = result
+
+        return f_result
+
+    def codebook(self, f_barcode_length):
+        """
+        This method is used to get the codebook for barcodes of a length, which is loaded only once.
+
+        :param f_barcode_length: The length of barcode.
+        :return: The 'Codebook' object, or None if no codebook is given.
+        """
+        if self.config.codebook is None:
+            return None
+
+        if f_barcode_length not in self.__codebooks:
+            self.__codebooks.update({f_barcode_length: Codebook(self.config.codebook, f_barcode_length,
+                                                                self.config.max_distance)})
+
+        return self.__codebooks[f_barcode_length]
+
+    def run(self, f_cycles, f_output_dir=None, f_resume=None):
+        """
+        This method is used to run all the stages on a FOV.
+
+        :param f_cycles: The image directories in sequence of cycles, or the stacks of multi-page TIFF (such as
+                         OME-TIFF) holding them.
+        :param f_output_dir: The directory of output of this FOV, the one of config by default.
+        :param f_resume: Whether to resume from the checkpoints of a previous run, the one of config by default.
+        :return: A list of reads, each of which is composed of id, sequence, quality, row, column and optionally gene
+                 name and edit distance.
+        """
+        output_dir = self.config.output_dir if f_output_dir is None else f_output_dir
+        resume = self.config.resume if f_resume is None else bool(f_resume)
+
+        set_backend(self.config.kernels)
+
+        makedirs(output_dir, exist_ok=True)
+
+        fov = {'cycles': list(f_cycles), 'output_dir': output_dir}
+
+        source = open_cycles(fov['cycles'], CHANNELS['--' + self.config.mode], self.config.region)
+
+        cycle_num = source.cycle_num
+
+        run_summary = RunSummary(cycle_num)
+
+        checkpoint = None
+
+        if self.config.checkpoint or resume:
+            checkpoint = Checkpoint(join(output_dir, 'checkpoint'), source.files,
+                                    {'mode': self.config.mode, 'registration': self.config.registration,
+                                     'detector_params': self.config.detector_params,
+                                     'search_region': self.config.search_region,
+                                     'projection': self.config.projection, 'region': self.config.region,
+                                     'tissue_mask': self.config.tissue_mask,
+                                     'prune': [self.config.codebook, self.config.max_distance] if self.config.prune
+                                     else None},
+                                    resume, {'cycles': [abspath(_) for _ in fov['cycles']]})
+
+        ###############################################################################
+        # The results are loaded from the latest stage saved in checkpoints, and the  #
+        # earlier stages are skipped                                                  #
+        ###############################################################################
+        std_img = None
+        transforms = []
+        reference = {}
+        saved_registration_stats = {}
+        base_boxes = [None] * cycle_num
+        barcode_cube_obj = None
+        adjusted = False
+
+        if checkpoint is not None:
+            if checkpoint.has('registration'):
+                registration = checkpoint.load('registration')
+
+                std_img = registration['background']
+                transforms = registration['transforms']
+                reference = registration.get('reference', {})
+                saved_registration_stats = registration.get('stats', {})
+
+                run_summary.add_registration(saved_registration_stats)
+
+            if checkpoint.has('connection'):
+                barcode_cube_obj = checkpoint.load('connection')
+                adjusted = True
+
+            elif checkpoint.has('filtering'):
+                barcode_cube_obj = checkpoint.load('filtering')
+
+            ##########################################################################
+            # The detection of each cycle is saved with its statistics, while the    #
+            # older checkpoints are the bare base boxes. The statistics are replayed #
+            # even if the base boxes are not needed                                  #
+            ##########################################################################
+            for cycle_id in range(0, cycle_num):
+                if checkpoint.has('detection.cycle_%d' % (cycle_id + 1)):
+                    detection = checkpoint.load('detection.cycle_%d' % (cycle_id + 1))
+
+                    if 'base_box' not in detection:
+                        detection = {'base_box': detection, 'stats': {}}
+
+                    run_summary.add_detection(cycle_id, detection['stats'])
+
+                    if barcode_cube_obj is None:
+                        base_boxes[cycle_id] = detection['base_box']
+            ##########################################################################
+        ###############################################################################
+
+        if barcode_cube_obj is None and None in base_boxes:
+            ##########################################################################
+            # Only the cycles not detected are imported, and the saved transform     #
+            # matrices and features of reference are used instead of registering     #
+            # or reading them again                                                  #
+            ##########################################################################
+            missing_cycles = [_ for _ in range(0, cycle_num) if base_boxes[_] is None]
+            transform_num = len(transforms)
+            registration_stats = {}
+            regions = [] if self.config.tissue_mask else None
+
+            parallel = self.config.processes > 1 and len(missing_cycles) > 1
+            shared_stack = SharedStack() if parallel else None
+            allocate = None if shared_stack is None else shared_stack.allocate
+
+            if self.config.mode == 'ke':
+                cycle_stack, std_img = decode_data_Ke(source, self.config.registration, output_dir, transforms,
+                                                      self.config.projection, registration_stats, self.config.prefetch,
+                                                      regions, reference, missing_cycles, allocate)
+
+            else:
+                cycle_stack, std_img = decode_data_Chen(source, output_dir, self.config.projection,
+                                                        self.config.prefetch, reference, missing_cycles, allocate)
+
+            run_summary.add_registration(registration_stats)
+
+            if checkpoint is not None and (not checkpoint.has('registration') or len(transforms) > transform_num):
+                saved_registration_stats.update(registration_stats)
+
+                checkpoint.save('registration', {'transforms': transforms, 'background': std_img,
+                                                 'reference': reference, 'stats': saved_registration_stats},
+                                source.file_num(max(len(transforms), 1)))
+            ##########################################################################
+
+            imported_stack = cycle_stack
+
+            cycle_stack, std_img = self.__call_hooks('import', fov, (cycle_stack, std_img))
+
+            if parallel:
+                ##################################################################################
+                # The images are registered straight into shared memory, and each worker gets    #
+                # only the descriptor of them. If a hook replaced them, they are copied into a   #
+                # new block. The block is released after the pool is terminated, even if a       #
+                # worker fails                                                                   #
+                ##################################################################################
+                if cycle_stack is not imported_stack:
+                    imported_stack = None
+
+                    shared_stack.release()
+                    shared_stack = SharedStack(cycle_stack)
+
+                imported_stack = None
+
+                with shared_stack, Pool(min(self.config.processes, len(missing_cycles))) as pool:
+                    cycle_stack = None
+
+                    tasks = [(shared_stack.descriptor, stack_id, cycle_id, self.config.mode,
+                              self.config.detector_params, self.config.kernels, PROFILER.enabled, regions)
+                             for stack_id, cycle_id in enumerate(missing_cycles)]
+
+                    for cycle_id, base_box, records, stats in pool.imap_unordered(detect_shared_cycle, tasks):
+                        base_boxes[cycle_id] = base_box
+
+                        PROFILER.merge(records)
+                        run_summary.add_detection(cycle_id, stats)
+
+                        if checkpoint is not None:
+                            checkpoint.save('detection.cycle_%d' % (cycle_id + 1),
+                                            {'base_box': base_boxes[cycle_id], 'stats': stats},
+                                            source.file_num(cycle_id + 1))
+                ##################################################################################
+
+            else:
+                for stack_id, cycle_id in enumerate(missing_cycles):
+                    stats = {}
+
+                    with PROFILER.stage('detection', cycle_id + 1):
+                        if self.config.mode == 'ke':
+                            base_boxes[cycle_id] = detect_blobs_Ke(cycle_stack[stack_id], self.config.detector_params,
+                                                                   stats, regions)
+
+                        else:
+                            base_boxes[cycle_id] = detect_blobs_Chen(cycle_stack[stack_id],
+                                                                     self.config.detector_params, stats)
+
+                    run_summary.add_detection(cycle_id, stats)
+
+                    if checkpoint is not None:
+                        checkpoint.save('detection.cycle_%d' % (cycle_id + 1),
+                                        {'base_box': base_boxes[cycle_id], 'stats': stats},
+                                        source.file_num(cycle_id + 1))
+
+            base_boxes = self.__call_hooks('detection', fov, base_boxes)
+
+        if barcode_cube_obj is None:
+            barcode_cube_obj = BarcodeCube(self.config.search_region)
+
+            for base_box in base_boxes:
+                barcode_cube_obj.collect_called_bases(base_box)
+
+            barcode_cube_obj.filter_blobs_list2()
+
+            if checkpoint is not None:
+                checkpoint.save('filtering', barcode_cube_obj)
+
+        if not adjusted:
+            barcode_cube_obj.calling_adjust(self.codebook(cycle_num) if self.config.prune else None)
+
+            if checkpoint is not None:
+                checkpoint.save('connection', barcode_cube_obj)
+
+            barcode_cube_obj = self.__call_hooks('connection', fov, barcode_cube_obj)
+
+        ##########################################################################
+        # A new database and count matrix are written for each FOV, in its own   #
+        # output directory unless the path of database is given                  #
+        ##########################################################################
+        database = None
+
+        if 'db' in self.config.formats:
+            database = join(output_dir, 'basecalling_data.db') if self.config.database is None else \
+                self.config.database
+
+        count_matrix_obj = None
+
+        if 'matrix' in self.config.formats:
+            count_matrix_obj = CountMatrix(self.config.bin_size, self.config.bin_shape)
+        ##########################################################################
+
+        reads = write_reads_into_file(std_img, barcode_cube_obj.adjusted_bases_cube, cycle_num,
+                                      self.codebook(cycle_num), database, count_matrix_obj, output_dir,
+                                      [_ for _ in self.config.formats if _ in ('fastq', 'sam')], run_summary)
+
+        return self.__call_hooks('output', fov, reads)
+
+    def append(self, f_cycles, f_output_dir=None):
+        """
+        This method is used to append new cycles to the run of a FOV saved with checkpoints, which only imports and
+        detects the new cycles, then connects the bases of all the cycles and rewrites the outputs.
+
+        :param f_cycles: The image directories of the new cycles in sequence, or the stacks of multi-page TIFF holding
+                         them.
+        :param f_output_dir: The directory of output of this FOV, in which the run is saved, the one of config by
+                             default.
+        :return: A list of reads of all the cycles, as 'run' returns.
+        """
+        output_dir = self.config.output_dir if f_output_dir is None else f_output_dir
+
+        manifest = read_manifest(join(output_dir, 'checkpoint'))
+
+        if manifest is None or 'cycles' not in manifest.get('info', {}):
+            print('No run saved with checkpoints is found in ' + output_dir, file=stderr)
+            exit(1)
+
+        return self.run(manifest['info']['cycles'] + [abspath(_) for _ in f_cycles], output_dir, True)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+This model is used to plan the resources of base calling jobs, by reading only the headers of images.
+
+For every cycle and channel, the dimensions, bit depth, compression and number of pages are parsed from the TIFF
+header (both classic TIFF and BigTIFF), without decoding any pixel. From these, the peak memory and runtime of each
+stage of the pipeline are estimated for one FOV, and for the whole slide if several FOVs are given.
+
+The estimation follows how each stage scales: importing and detecting are linear in pixels and cycles, and
+connecting blobs into barcodes is linear in the number of blobs and cycles, since the blobs of each cycle are matched
+by looking up their neighbourhoods, and the number of blobs is estimated by an expected blob density.
+The coefficients were measured by running the pipeline on the test data, and should be treated as rough guides on
+other machines.
+
+At last, for a given memory budget, a tile size (for splitting FOVs before base calling and stitching them by
+'tool.stitch_images.py --grid'), a number of parallel workers, and whether the stitched image should be streamed into
+a pyramid on disk are recommended.
+"""
+
+
+from sys import (argv, stderr)
+from os import (listdir, cpu_count)
+from os.path import (join, isdir, isfile, getsize)
+from struct import (unpack, calcsize)
+
+from .image_sources import CHANNELS
+
+
+COMPRESSION = {1: 'none', 2: 'ccitt', 5: 'lzw', 7: 'jpeg', 8: 'deflate', 32773: 'packbits', 32946: 'deflate',
+               34712: 'jpeg2000', 50000: 'zstd'}
+
+##############################################################################################
+# Coefficients measured on the test data, in bytes per pixel, seconds per megapixel of each  #
+# cycle, and seconds per blob (of each cycle)                                                #
+##############################################################################################
+BASE_MEMORY = 100 * 2 ** 20  # The interpreter with all the imported packages
+IMPORT_BYTES_PER_PIXEL = 76  # The transient buffers of registration
+DETECT_BYTES_PER_PIXEL = 20  # The greyscale models (float32) and masks of a cycle
+CUBE_BYTES_PER_BASE = 300  # A called base in the dictionaries of 'BarcodeCube'
+READ_BYTES = 200  # An assembled read
+
+DISK_SECONDS_PER_MB = 0.005
+INFLATE_SECONDS_PER_MB = 0.01  # Decoding a compressed image
+IMPORT_SECONDS_PER_MP = 0.5  # Reading and registering 5 channels of a cycle
+DETECT_SECONDS_PER_MP = 1.5  # Detecting 4 channels of a cycle
+CONNECT_SECONDS_PER_BLOB = 1.5e-5  # Filtering and connecting a blob in a cycle
+OUTPUT_SECONDS_PER_BLOB = 3e-5
+
+TILE_OVERLAP = 0.1
+##############################################################################################
+
+
+def read_tiff_header(f_image_file):
+    """
+    This function is used to parse the header of a TIFF image, without decoding its pixels.
+
+    :param f_image_file: The path of TIFF image.
+    :return: A dictionary of width, height, bits per sample, samples per pixel, compression, number of pages and
+             file size.
+    """
+    with open(f_image_file, 'rb') as IN:
+        byte_order = IN.read(2)
+
+        if byte_order not in (b'II', b'MM'):
+            print('NOT A TIFF IMAGE: ' + f_image_file, file=stderr)
+            exit(1)
+
+        endian = '<' if byte_order == b'II' else '>'
+
+        version = unpack(endian + 'H', IN.read(2))[0]
+
+        ###################################################################################
+        # Classic TIFF uses 32-bit offsets and 12-byte entries, while BigTIFF uses 64-bit #
+        # offsets and 20-byte entries                                                     #
+        ###################################################################################
+        if version == 42:
+            offset_fmt, count_fmt, entry_size = 'I', 'H', 12
+            ifd_offset = unpack(endian + 'I', IN.read(4))[0]
+
+        elif version == 43:
+            offset_fmt, count_fmt, entry_size = 'Q', 'Q', 20
+            IN.read(4)
+            ifd_offset = unpack(endian + 'Q', IN.read(8))[0]
+
+        else:
+            print('NOT A TIFF IMAGE: ' + f_image_file, file=stderr)
+            exit(1)
+        ###################################################################################
+
+        type_fmt = {3: 'H', 4: 'I', 16: 'Q'}
+
+        header = {'width': 0, 'height': 0, 'bits': 1, 'samples': 1, 'compression': 'none', 'pages': 0,
+                  'file_size': getsize(f_image_file)}
+
+        while ifd_offset != 0:
+            IN.seek(ifd_offset)
+
+            entry_num = unpack(endian + count_fmt, IN.read(calcsize(count_fmt)))[0]
+            entries = IN.read(entry_num * entry_size)
+
+            ifd_offset = unpack(endian + offset_fmt, IN.read(calcsize(offset_fmt)))[0]
+
+            ###########################################################################
+            # Only the tags of the first page are parsed, the others are only counted #
+            ###########################################################################
+            if header['pages'] == 0:
+                for i in range(0, entry_num):
+                    entry = entries[(i * entry_size):((i + 1) * entry_size)]
+                    tag, value_type = unpack(endian + 'HH', entry[:4])
+
+                    if value_type not in type_fmt or tag not in (256, 257, 258, 259, 277):
+                        continue
+
+                    value_count = unpack(endian + offset_fmt, entry[4:(4 + calcsize(offset_fmt))])[0]
+                    value_field = entry[(4 + calcsize(offset_fmt)):]
+
+                    ###########################################################
+                    # Values which do not fit in the entry are stored outside #
+                    ###########################################################
+                    if value_count * calcsize(type_fmt[value_type]) > len(value_field):
+                        IN.seek(unpack(endian + offset_fmt, value_field)[0])
+                        value_field = IN.read(calcsize(type_fmt[value_type]))
+                    ###########################################################
+
+                    value = unpack(endian + type_fmt[value_type], value_field[:calcsize(type_fmt[value_type])])[0]
+
+                    if tag == 256:
+                        header['width'] = value
+
+                    elif tag == 257:
+                        header['height'] = value
+
+                    elif tag == 258:
+                        header['bits'] = value
+
+                    elif tag == 259:
+                        header['compression'] = COMPRESSION.get(value, str(value))
+
+                    else:
+                        header['samples'] = value
+            ###########################################################################
+
+            header['pages'] += 1
+
+    return header
+
+
+def collect_fovs(f_mode, f_dirs):
+    """
+    This function is used to group the given directories into FOVs.
+
+    A directory containing the channel images is a cycle, and the cycles given in a row make up a FOV. A directory
+    without them is a FOV, of which the sub-directories containing the channel images are its cycles, in the order
+    of their names.
+
+    :param f_mode: '--ke' or '--chen'.
+    :param f_dirs: The directories of cycles or FOVs.
+    :return: A list of FOVs, each of which is a list of cycle directories.
+    """
+    is_cycle = lambda _: isdir(_) and all(isfile(join(_, ch)) for ch in CHANNELS[f_mode])
+
+    fovs = []
+    cycles = []
+
+    for img_dir in f_dirs:
+        if is_cycle(img_dir):
+            cycles.append(img_dir)
+            continue
+
+        if len(cycles) > 0:
+            fovs.append(cycles)
+            cycles = []
+
+        sub_dirs = sorted((_ for _ in listdir(img_dir) if is_cycle(join(img_dir, _))) if isdir(img_dir) else [],
+                          key=lambda _: (len(_), _))
+
+        if len(sub_dirs) == 0:
+            print('NO IMAGES OF CYCLE FOUND IN: ' + img_dir, file=stderr)
+            exit(1)
+
+        fovs.append([join(img_dir, _) for _ in sub_dirs])
+
+    if len(cycles) > 0:
+        fovs.append(cycles)
+
+    return fovs
+
+
+def estimate_stages(f_mode, f_summary, f_density, f_height=None, f_width=None):
+    """
+    This function is used to estimate the peak memory and runtime of each stage, for a FOV or a tile of it.
+
+    :param f_mode: '--ke' or '--chen'.
+    :param f_summary: The summary of images by 'summarize_fovs'.
+    :param f_density: The expected number of blobs in each megapixel.
+    :param f_height: The height of tile, the whole FOV by default.
+    :param f_width: The width of tile, the whole FOV by default.
+    :return: A list of stages, each of which is composed of name, peak memory (bytes) and runtime (seconds).
+    """
+    height = f_summary['height'] if f_height is None else f_height
+    width = f_summary['width'] if f_width is None else f_width
+    cycle_num = f_summary['cycles']
+
+    pixels = height * width
+    share = pixels / (f_summary['height'] * f_summary['width'])
+    mp = pixels / 1e6
+    blobs = f_density * mp
+    layers = 4 if f_mode == '--ke' else 1
+
+    ############################################################################
+    # All the channels are kept in 8 bits after being imported, no matter how  #
+    # many bits they are stored in                                             #
+    ############################################################################
+    stack = pixels * layers * cycle_num
+    ############################################################################
+
+    return [('read', BASE_MEMORY + pixels * f_summary['pixel_bytes'],
+             (f_summary['file_mb'] * DISK_SECONDS_PER_MB + f_summary['inflate_mb'] * INFLATE_SECONDS_PER_MB) * share),
+            ('import', BASE_MEMORY + stack + (pixels * IMPORT_BYTES_PER_PIXEL if f_mode == '--ke' else pixels),
+             mp * cycle_num * (IMPORT_SECONDS_PER_MP if f_mode == '--ke' else 0)),
+            ('detect', BASE_MEMORY + stack + pixels * DETECT_BYTES_PER_PIXEL * layers / 4,
+             mp * cycle_num * DETECT_SECONDS_PER_MP * layers / 4),
+            ('connect', BASE_MEMORY + stack + blobs * cycle_num * CUBE_BYTES_PER_BASE,
+             blobs * cycle_num * CONNECT_SECONDS_PER_BLOB),
+            ('output', BASE_MEMORY + stack + blobs * cycle_num * CUBE_BYTES_PER_BASE + blobs * READ_BYTES,
+             blobs * OUTPUT_SECONDS_PER_BLOB)]
+
+
+def summarize_fovs(f_mode, f_fovs, f_headers):
+    """
+    This function is used to summarize the images of a FOV, for estimation.
+
+    :param f_mode: '--ke' or '--chen'.
+    :param f_fovs: A list of FOVs, each of which is a list of cycle directories.
+    :param f_headers: The headers of all images, keyed by their paths.
+    :return: A dictionary of the height and width of the largest image, the bytes of a decoded pixel, the number of
+             cycles and FOVs, the size of image files of a FOV and their size after being decoded if compressed, in MB.
+    """
+    if len(set((_['width'], _['height']) for _ in f_headers.values())) > 1:
+        print('WARNING: The images are not in the same size, the largest one is used for estimation', file=stderr)
+
+    return {'height': max(_['height'] for _ in f_headers.values()),
+            'width': max(_['width'] for _ in f_headers.values()),
+            'pixel_bytes': max(-(-_['bits'] * _['samples'] // 8) for _ in f_headers.values()),
+            'cycles': max(len(_) for _ in f_fovs),
+            'fovs': len(f_fovs),
+            'file_mb': sum(_['file_size'] for _ in f_headers.values()) / 2 ** 20 / len(f_fovs),
+            'inflate_mb': sum(_['width'] * _['height'] * _['bits'] * _['samples'] * _['pages'] / 8
+                              for _ in f_headers.values() if _['compression'] != 'none') / 2 ** 20 / len(f_fovs)}
+
+
+def recommend(f_mode, f_summary, f_memory, f_cpus, f_density):
+    """
+    This function is used to recommend a tile size, a number of workers and a streaming mode for a memory budget.
+
+    Each candidate tile size (and the whole FOV) is estimated by the wall time of the slide, which is the runtime of
+    a tile multiplied by the rounds of workers, and the one of the shortest wall time within the budget is taken.
+    Adjacent tiles overlap by 10%, as expected by 'tool.stitch_images.py --grid'.
+
+    :param f_mode: '--ke' or '--chen'.
+    :param f_summary: The summary of images by 'summarize_fovs'.
+    :param f_memory: The memory budget, in bytes.
+    :param f_cpus: The number of CPUs.
+    :param f_density: The expected number of blobs in each megapixel.
+    :return: A dictionary of recommendation, or None if no plan fits the budget.
+    """
+    height = f_summary['height']
+    width = f_summary['width']
+
+    best = None
+
+    for tile_size in [None] + [2 ** _ for _ in range(9, 17) if 2 ** _ < max(height, width)]:
+        tile_h = height if tile_size is None else min(tile_size, height)
+        tile_w = width if tile_size is None else min(tile_size, width)
+
+        ######################################################################
+        # Tiles are placed in steps of 90% of their size, to leave overlaps  #
+        ######################################################################
+        step_h = max(int(tile_h * (1 - TILE_OVERLAP)), 1) if tile_h < height else height
+        step_w = max(int(tile_w * (1 - TILE_OVERLAP)), 1) if tile_w < width else width
+
+        tile_num = (-(-max(height - tile_h, 0) // step_h) + 1) * (-(-max(width - tile_w, 0) // step_w) + 1)
+        ######################################################################
+
+        stages = estimate_stages(f_mode, f_summary, f_density, tile_h, tile_w)
+
+        peak = max(_[1] for _ in stages)
+        runtime = sum(_[2] for _ in stages)
+
+        if peak > f_memory:
+            continue
+
+        jobs = tile_num * f_summary['fovs']
+        workers = max(min(f_cpus, int(f_memory // peak), jobs), 1)
+        wall = -(-jobs // workers) * runtime
+
+        if best is None or wall < best['wall_time']:
+            best = {'tile_size': tile_size, 'jobs': jobs, 'workers': workers, 'peak_memory': peak,
+                    'job_time': runtime, 'wall_time': wall}
+
+    ##################################################################################
+    # The stitched image is streamed into a pyramid on disk if it takes more than a  #
+    # half of the budget                                                             #
+    ##################################################################################
+    if best is not None:
+        best.update({'pyramid': height * width * f_summary['fovs'] > f_memory / 2})
+    ##################################################################################
+
+    return best
+
+
+def format_size(f_bytes):
+    """
+    This function is used to format a size in bytes.
+
+    :param f_bytes: The size in bytes.
+    :return: A readable string of size.
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if f_bytes < 1024:
+            return '%.1f %s' % (f_bytes, unit)
+
+        f_bytes /= 1024
+
+    return '%.1f TB' % f_bytes
+
+
+def plan_jobs(f_mode, f_dirs, f_memory=None, f_cpus=None, f_density=None):
+    """
+    This function is used to report the images, the estimated resources and the recommendation.
+
+    :param f_mode: '--ke' or '--chen'.
+    :param f_dirs: The directories of cycles or FOVs.
+    :param f_memory: The memory budget in GB, 16 by default.
+    :param f_cpus: The number of CPUs, all the CPUs of this machine by default.
+    :param f_density: The expected number of blobs in each megapixel, 1000 by default.
+    :return: The recommendation, or None if no plan fits the budget.
+    """
+    memory = (16 if f_memory is None else float(f_memory)) * 2 ** 30
+    cpus = cpu_count() if f_cpus is None else int(f_cpus)
+    density = 1000 if f_density is None else float(f_density)
+
+    fovs = collect_fovs(f_mode, f_dirs)
+
+    headers = {}
+
+    print('#cycle\tchannel\twidth\theight\tbits\tsamples\tcompression\tpages\tfile size')
+
+    for fov in fovs:
+        for cycle in fov:
+            for channel in CHANNELS[f_mode]:
+                header = read_tiff_header(join(cycle, channel))
+                headers.update({join(cycle, channel): header})
+
+                print('%s\t%s\t%d\t%d\t%d\t%d\t%s\t%d\t%s' % (cycle, channel, header['width'], header['height'],
+                                                              header['bits'], header['samples'],
+                                                              header['compression'], header['pages'],
+                                                              format_size(header['file_size'])))
+
+    summary = summarize_fovs(f_mode, fovs, headers)
+
+    print('\n#stage\tpeak memory\truntime (one FOV of %dx%d, %d cycles)' %
+          (summary['width'], summary['height'], summary['cycles']))
+
+    for stage, peak, runtime in estimate_stages(f_mode, summary, density):
+        print('%s\t%s\t%.1f s' % (stage, format_size(peak), runtime))
+
+    plan = recommend(f_mode, summary, memory, cpus, density)
+
+    print('\n#recommendation (%d FOVs, %s memory, %d CPUs)' % (summary['fovs'], format_size(memory), cpus))
+
+    if plan is None:
+        print('No plan fits the memory budget, even with the smallest tiles', file=stderr)
+        return None
+
+    print('tile size\t' + ('whole FOV' if plan['tile_size'] is None else '%d' % plan['tile_size']))
+    print('jobs\t%d' % plan['jobs'])
+    print('workers\t%d' % plan['workers'])
+    print('peak memory of a job\t' + format_size(plan['peak_memory']))
+    print('runtime of a job\t%.1f s' % plan['job_time'])
+    print('wall time\t%.1f s' % plan['wall_time'])
+    print('stitching\t' + ('streamed into a pyramid (--pyramid)' if plan['pyramid'] else 'in memory'))
+
+    return plan
+
+
+if __name__ == '__main__':
+    memory_budget = None
+    cpu_num = None
+    blob_density = None
+
+    if '--memory' in argv:
+        memory_budget = argv[argv.index('--memory') + 1]
+        del argv[argv.index('--memory'):(argv.index('--memory') + 2)]
+
+    if '--cpus' in argv:
+        cpu_num = argv[argv.index('--cpus') + 1]
+        del argv[argv.index('--cpus'):(argv.index('--cpus') + 2)]
+
+    if '--density' in argv:
+        blob_density = argv[argv.index('--density') + 1]
+        del argv[argv.index('--density'):(argv.index('--density') + 2)]
+
+    if len(argv) > 2 and argv[1] in CHANNELS:
+        plan_jobs(argv[1], argv[2:], memory_budget, cpu_num, blob_density)
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <--ke|--chen> [--memory <GB>] [--cpus <N>] [--density <blobs per megapixel>] '
+              '<cycle directories or FOV directories>', file=stderr)
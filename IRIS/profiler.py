@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+This model is used to record where the time and memory go inside a run, stage by stage.
+
+A stage is opened and closed around a block of code, and records its wall time, CPU time and peak resident memory,
+together with key counts reported inside it, such as the number of key points or blobs. Stages could be nested, such
+as the blob detection inside the detection of a cycle, and a nested stage belongs to the cycle of its parent if not
+given. The records are written as a JSON report, and each top-level stage could also be dumped by cProfile for
+finding the hot functions inside it.
+
+The profiler is shared by all the models as 'PROFILER', and costs nothing but a flag check until it is enabled.
+
+The peak memory is reset at the start of each stage on Linux, thus it is the peak of this stage itself. On other
+systems, it is the peak of the process until the end of this stage.
+"""
+
+
+from os import makedirs
+from os.path import join
+from time import (time, process_time)
+from json import dump
+from cProfile import Profile
+from resource import (getrusage, RUSAGE_SELF)
+
+
+def reset_peak_memory():
+    """
+    This function is used to reset the peak memory of this process, which is only supported by Linux.
+
+    :return: NONE
+    """
+    try:
+        with open('/proc/self/clear_refs', 'wt') as OU:
+            OU.write('5')
+
+    except OSError:
+        pass
+
+
+def peak_memory():
+    """
+    This function is used to get the peak memory of this process since it was reset.
+
+    :return: The peak resident memory in bytes.
+    """
+    try:
+        with open('/proc/self/status', 'rt') as IN:
+            for ln in IN:
+                if ln.startswith('VmHWM'):
+                    return int(ln.split()[1]) * 1024
+
+    except OSError:
+        pass
+
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profiler:
+    def __init__(self):
+        """
+        This method will initialize a disabled profiler. 'records' stores the finished stages in the order of their
+        start.
+        """
+        self.enabled = False
+        self.records = []
+
+        self.__stack = []
+        self.__cprofile_dir = None
+
+    def enable(self, f_cprofile_dir=None):
+        """
+        This method is used to start recording.
+
+        :param f_cprofile_dir: The directory for the cProfile dumps of top-level stages, which are not dumped if not
+                               given.
+        :return: NONE
+        """
+        self.enabled = True
+        self.records = []
+        self.__stack = []
+        self.__cprofile_dir = f_cprofile_dir
+
+        if f_cprofile_dir is not None:
+            makedirs(f_cprofile_dir, exist_ok=True)
+
+    def begin(self, f_stage, f_cycle=None):
+        """
+        This method is used to open a stage.
+
+        :param f_stage: The name of stage.
+        :param f_cycle: The cycle (from 1) of stage, the one of its parent by default.
+        :return: NONE
+        """
+        if not self.enabled:
+            return
+
+        parent = self.__stack[-1] if len(self.__stack) > 0 else None
+
+        record = {'stage': f_stage,
+                  'cycle': f_cycle if f_cycle is not None or parent is None else parent['cycle'],
+                  'parent': None if parent is None else parent['stage'],
+                  'counts': {}}
+
+        ##################################################################################
+        # The peak memory of parent so far is kept before being reset for this stage     #
+        ##################################################################################
+        if parent is not None:
+            parent['peak_rss'] = max(parent['peak_rss'], peak_memory())
+
+        reset_peak_memory()
+        ##################################################################################
+
+        self.records.append(record)
+        self.__stack.append(record)
+
+        ####################################################################################
+        # Only one cProfile could be active at once, so that only top-level stages are     #
+        # profiled, and the nested ones are included in them                               #
+        ####################################################################################
+        record['profile'] = None
+
+        if self.__cprofile_dir is not None and parent is None:
+            record['profile'] = Profile()
+            record['profile'].enable()
+        ####################################################################################
+
+        record['peak_rss'] = 0
+        record['wall_time'] = time()
+        record['cpu_time'] = process_time()
+
+    def end(self):
+        """
+        This method is used to close the latest opened stage.
+
+        :return: NONE
+        """
+        if not self.enabled:
+            return
+
+        record = self.__stack.pop()
+
+        record['wall_time'] = time() - record['wall_time']
+        record['cpu_time'] = process_time() - record['cpu_time']
+        record['peak_rss'] = max(record['peak_rss'], peak_memory())
+
+        if len(self.__stack) > 0:
+            self.__stack[-1]['peak_rss'] = max(self.__stack[-1]['peak_rss'], record['peak_rss'])
+
+        if record['profile'] is not None:
+            record['profile'].disable()
+            record['profile'].dump_stats(join(self.__cprofile_dir, '%03d.%s%s.prof' % (
+                len(self.records), record['stage'].replace(' ', '_'),
+                '' if record['cycle'] is None else '.cycle_%d' % record['cycle'])))
+
+        del record['profile']
+
+    def stage(self, f_stage, f_cycle=None):
+        """
+        This method is used to open a stage by a 'with' statement, which is closed at the end of block.
+
+        :param f_stage: The name of stage.
+        :param f_cycle: The cycle (from 1) of stage, the one of its parent by default.
+        :return: A context manager.
+        """
+        profiler = self
+
+        class __Stage:
+            def __enter__(self):
+                profiler.begin(f_stage, f_cycle)
+
+            def __exit__(self, *_):
+                profiler.end()
+
+        return __Stage()
+
+    def count(self, f_name, f_value):
+        """
+        This method is used to record a key count in the latest opened stage.
+
+        :param f_name: The name of count, such as 'keypoints'.
+        :param f_value: The value of count.
+        :return: NONE
+        """
+        if not self.enabled or len(self.__stack) == 0:
+            return
+
+        self.__stack[-1]['counts'].update({f_name: f_value})
+
+    def merge(self, f_records):
+        """
+        This method is used to add the records of stages run by another process, such as a worker of a pool.
+
+        The wall times of stages run in parallel overlap each other, thus the total wall time of report is larger than
+        the elapsed time of run.
+
+        :param f_records: The 'records' of the profiler in another process.
+        :return: NONE
+        """
+        if not self.enabled:
+            return
+
+        self.records.extend(f_records)
+
+    def write(self, f_report_file):
+        """
+        This method is used to write the records as a JSON report.
+
+        :param f_report_file: The path of report.
+        :return: NONE
+        """
+        top_level = [_ for _ in self.records if _['parent'] is None]
+
+        with open(f_report_file, 'wt') as OU:
+            dump({'stages': self.records,
+                  'total': {'wall_time': sum(_['wall_time'] for _ in top_level),
+                            'cpu_time': sum(_['cpu_time'] for _ in top_level),
+                            'peak_rss': max([_['peak_rss'] for _ in top_level] + [0])}}, OU, indent=4)
+
+
+PROFILER = Profiler()
+
+
+if __name__ == '__main__':
+    pass
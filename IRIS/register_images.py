@@ -17,10 +17,12 @@ and rotation between images but no zooming and retortion.
 
 
 from sys import stderr
-from cv2 import (convertScaleAbs,
+from cv2 import (convertScaleAbs, transform,
                  BRISK, ORB, BFMatcher, estimateAffinePartial2D,
                  NORM_HAMMING, RANSAC)
-from numpy import (array, zeros, mean, float32, bool_, fft, abs, max)
+from numpy import (array, zeros, mean, sqrt, float32, bool_, fft, abs, max)
+
+from .profiler import PROFILER
 
 
 ##########################
@@ -32,16 +34,29 @@ from numpy import (array, zeros, mean, float32, bool_, fft, abs, max)
 ##########################
 
 
-def register_cycles(reference_cycle, transform_cycle, detection_method=None):
+def register_cycles(reference_cycle, transform_cycle, detection_method=None, f_stats=None, f_mask=None,
+                    f_reference=None):
     """
     For computing the transform matrix between reference image and the image to be registered.
 
     Input reference image, image to be registered and one of the algorithms of detector.
     Returning transform matrix.
 
+    If a dictionary of statistics is given, the numbers of key points, matches and inliers, and the residual (the root
+    mean square distance in pixels between the inliers of reference and the registered ones) are stored into it.
+
+    If a dictionary of reference is given, the key points and descriptions of reference image are stored into it when
+    they are detected, and used instead of detecting them again if they are in it, so that the reference image is
+    processed only once for all the cycles, or even not read when cycles are appended to a run.
+
     :param reference_cycle: Image reference that will be used to register other images.
     :param transform_cycle: Images will be registered.
     :param detection_method: The algorithm for key points detection.
+    :param f_stats: A dictionary, into which the statistics of registration are stored if given.
+    :param f_mask: The mask of tissue, out of which no key points are detected, the whole images by default.
+    :param f_reference: A dictionary of the features of reference image, which could be pickled, into which they are
+                        stored if given, or from which they are taken if they are stored. The reference image could be
+                        None if they are stored.
     :return f_key_points, f_descriptions: A transformation matrix from image to be registered to reference.
     """
     def __lpf(f_img):
@@ -62,7 +77,7 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
 
         return f_img
 
-    def __get_key_points_and_descriptors(f_gray_image, method=None):
+    def __get_key_points_and_descriptors(f_gray_image, method=None, mask=None):
         """
         For detecting the key points and their descriptions by BRISK or ORB.
 
@@ -75,6 +90,7 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
 
         :param f_gray_image: The 8-bit image.
         :param method: The algorithm for key points detection.
+        :param mask: The mask of regions to detect key points.
         :return: A tuple including key points and their descriptions.
         """
         #################################################################
@@ -124,7 +140,7 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
             print('Only ORB or BRISK could be suggested', file=stderr)
         ##############################################################################################
 
-        f_key_points = det.detect(f_gray_image)
+        f_key_points = det.detect(f_gray_image, mask)
         _, f_descriptions = ext.compute(f_gray_image, f_key_points)
 
         return f_key_points, f_descriptions
@@ -156,23 +172,37 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
 
     transform_matrix = array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=float32)
 
+    reference = {} if f_reference is None else f_reference
+
+    if 'descriptions' not in reference:
+        kp1, des1 = __get_key_points_and_descriptors(reference_cycle, detection_method, f_mask)
+
+        reference.update({'mean': mean(reference_cycle), 'points': float32([_.pt for _ in kp1]).reshape(-1, 2),
+                          'descriptions': des1})
+
+    pts1, des1 = reference['points'], reference['descriptions']
+
     #######################################
     # Lightness Rectification (IMPORTANT) #
     #######################################
-    transform_cycle = convertScaleAbs(transform_cycle * (mean(reference_cycle) / mean(transform_cycle)))
+    transform_cycle = convertScaleAbs(transform_cycle * (reference['mean'] / mean(transform_cycle)))
     #######################################
 
-    kp1, des1 = __get_key_points_and_descriptors(reference_cycle, detection_method)
-    kp2, des2 = __get_key_points_and_descriptors(transform_cycle, detection_method)
+    kp2, des2 = __get_key_points_and_descriptors(transform_cycle, detection_method, f_mask)
 
     good_matches = __get_good_matched_pairs(des1, des2)
+    matches = good_matches
+
+    PROFILER.count('reference_keypoints', len(pts1))
+    PROFILER.count('keypoints', len(kp2))
+    PROFILER.count('matches', len(good_matches))
 
     #################################################################################
     # Filter the outline of paired key points iteratively until there's no outlines #
     #################################################################################
     n = 1
     while n > 0:
-        pts_a = float32([kp1[_.queryIdx].pt for _ in good_matches]).reshape(-1, 1, 2)
+        pts_a = float32([pts1[_.queryIdx] for _ in good_matches]).reshape(-1, 1, 2)
         pts_b = float32([kp2[_.trainIdx].pt for _ in good_matches]).reshape(-1, 1, 2)
 
         _, mask = estimateAffinePartial2D(pts_b, pts_a)
@@ -182,8 +212,10 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
         n = sum([mask[_][0] for _ in range(0, mask.size)]) - mask.size
     ###########################################################################
 
+    PROFILER.count('inliers', len(good_matches))
+
     if len(good_matches) >= 4:
-        pts_a_filtered = float32([kp1[_.queryIdx].pt for _ in good_matches]).reshape(-1, 1, 2)
+        pts_a_filtered = float32([pts1[_.queryIdx] for _ in good_matches]).reshape(-1, 1, 2)
         pts_b_filtered = float32([kp2[_.trainIdx].pt for _ in good_matches]).reshape(-1, 1, 2)
 
         transform_matrix, _ = estimateAffinePartial2D(pts_b_filtered, pts_a_filtered, RANSAC)
@@ -191,9 +223,17 @@ def register_cycles(reference_cycle, transform_cycle, detection_method=None):
         if transform_matrix is None:
             print('MATRIX GENERATION FAILED.', file=stderr)
 
+        elif f_stats is not None:
+            f_stats['residual'] = float(sqrt(mean(((transform(pts_b_filtered, transform_matrix) -
+                                                    pts_a_filtered) ** 2).sum(axis=2))))
+
     else:
         print('NO ENOUGH MATCHED FEATURES, REGISTRATION FAILED.', file=stderr)
 
+    if f_stats is not None:
+        f_stats.update({'reference_keypoints': len(pts1), 'keypoints': len(kp2), 'matches': len(matches),
+                        'inliers': len(good_matches)})
+
     return transform_matrix
 
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+This model is used to render the called reads over the background image, for checking the result by eye.
+
+All the reads are stamped into the image at once by array indexing, as small discs colored by the base of a given
+cycle, by their gene (or barcode, if not decoded), or in green. Reads could be filtered by 'N' bases and by their mean
+quality. Only a region of the image could be rendered, and an overview could be downsampled by 2 ** level, which reads
+only the tiles it needs if the background is a pyramid directory written by 'TiledMosaic'.
+
+Reads are loaded column by column rather than line by line, since millions of small per-read objects are much slower
+to create than a few lists of fields.
+"""
+
+
+from sys import (argv, stderr)
+from os.path import isdir
+from colorsys import hsv_to_rgb
+from cv2 import (imread, imwrite, resize, cvtColor, IMREAD_GRAYSCALE, COLOR_GRAY2BGR, INTER_AREA)
+from numpy import (array, asarray, floor, arange, meshgrid, frombuffer, full, uint8, int64, float64)
+
+from .tiled_mosaic import TiledMosaic
+
+
+BASE_COLOR = {'A': (0, 0, 255), 'T': (0, 255, 0), 'C': (255, 0, 0), 'G': (0, 255, 255), 'N': (128, 128, 128)}
+
+
+def load_reads(f_result_file, f_no_n=False, f_min_quality=None):
+    """
+    This function is used to load the reads of a result file by columns, with filters.
+
+    :param f_result_file: The file of base calling result, such as 'basecalling_data.txt'.
+    :param f_no_n: Whether to skip the reads with any 'N' base.
+    :param f_min_quality: The lowest mean Phred score of the reads to be kept.
+    :return: A list of columns, which are the lists of id, sequence, quality, row, column and optionally gene name
+             and edit distance of reads.
+    """
+    with open(f_result_file, 'rt') as IN:
+        lines = [_ for _ in IN if not _.startswith('#')]
+
+    if len(lines) == 0:
+        return [[] for _ in range(0, 5)]
+
+    ##########################################################################
+    # All the fields are split at once, since each line has the same columns #
+    ##########################################################################
+    fields = ''.join(lines).split()
+    column_num = len(fields) // len(lines)
+
+    columns = [fields[_::column_num] for _ in range(0, column_num)]
+    ##########################################################################
+
+    kept = range(0, len(lines))
+
+    if f_no_n:
+        kept = [_ for _ in kept if 'N' not in columns[1][_]]
+
+    if f_min_quality is not None:
+        kept = [_ for _ in kept if len(columns[2][_]) > 0 and
+                sum(columns[2][_].encode('ascii')) >= (f_min_quality + 33) * len(columns[2][_])]
+
+    if len(kept) < len(lines):
+        columns = [[column[_] for _ in kept] for column in columns]
+
+    return columns
+
+
+def label_colors(f_labels):
+    """
+    This function is used to assign distinct colors to labels, such as genes, by spreading their hues evenly.
+
+    :param f_labels: A list of labels.
+    :return: A matrix of BGR colors, one row for each label.
+    """
+    label_idx = {label: idx for idx, label in enumerate(sorted(set(f_labels)))}
+
+    palette = array([[int(255 * _) for _ in reversed(hsv_to_rgb((i * 0.618033988749895) % 1, 0.9, 1))]
+                     for i in range(0, len(label_idx))], dtype=uint8).reshape(-1, 3)
+
+    return palette[array([label_idx[_] for _ in f_labels], dtype=int64)]
+
+
+def read_colors(f_seqs, f_genes=None, f_color_by=None, f_cycle=None):
+    """
+    This function is used to color the reads.
+
+    :param f_seqs: A list of sequences of reads.
+    :param f_genes: A list of gene names of reads, if decoded.
+    :param f_color_by: 'base' to color reads by the base of a cycle, 'gene' to color reads by their gene (or
+                       barcode, if not decoded), or green by default.
+    :param f_cycle: The cycle (from 1) whose base is used for coloring, 1 by default.
+    :return: A matrix of BGR colors, one row for each read.
+    """
+    if f_color_by == 'base':
+        cycle = 0 if f_cycle is None else int(f_cycle) - 1
+
+        #######################################################################################
+        # The color of each read is looked up by its base, and a missing base is taken as 'N' #
+        #######################################################################################
+        lookup = full((256, 3), BASE_COLOR['N'], dtype=uint8)
+
+        for base in BASE_COLOR:
+            lookup[ord(base)] = BASE_COLOR[base]
+
+        bases = frombuffer(''.join(_[cycle] if len(_) > cycle else 'N' for _ in f_seqs).encode('ascii'), dtype=uint8)
+        #######################################################################################
+
+        return lookup[bases].reshape(-1, 3)
+
+    if f_color_by == 'gene':
+        return label_colors(f_seqs if f_genes is None else f_genes)
+
+    return full((len(f_seqs), 3), (0, 255, 0), dtype=uint8)
+
+
+def render_reads(f_background, f_rows, f_cols, f_colors, f_region=None, f_level=None, f_radius=None):
+    """
+    This function is used to stamp the reads over the background image.
+
+    :param f_background: The path of background image, or the directory of a pyramid written by 'TiledMosaic'.
+    :param f_rows: Row coordinates of reads in full resolution.
+    :param f_cols: Column coordinates of reads in full resolution.
+    :param f_colors: A matrix of BGR colors of reads.
+    :param f_region: The region (min row, max row, min col, max col) to be rendered, with the max bounds exclusive.
+                     The whole image by default.
+    :param f_level: The image is downsampled by 2 ** level, 0 by default.
+    :param f_radius: The radius of discs, 1 by default.
+    :return: The rendered color image.
+    """
+    level = 0 if f_level is None else int(f_level)
+    radius = 1 if f_radius is None else int(f_radius)
+
+    ##########################################################################################
+    # Only the tiles covering the region are read from a pyramid, while an image is cropped  #
+    # and downsampled after being read                                                       #
+    ##########################################################################################
+    if isdir(f_background):
+        mosaic = TiledMosaic(f_background)
+
+        region = (0, mosaic.shapes[0][0], 0, mosaic.shapes[0][1]) if f_region is None else f_region
+
+        img = mosaic.read_region(region[0], region[1], region[2], region[3], level)
+
+    else:
+        img = imread(f_background, IMREAD_GRAYSCALE)
+
+        if img is None:
+            print('THE BACKGROUND IMAGE COULD NOT BE READ: ' + f_background, file=stderr)
+            exit(1)
+
+        region = (0, img.shape[0], 0, img.shape[1]) if f_region is None else f_region
+
+        img = img[max(region[0], 0):region[1], max(region[2], 0):region[3]]
+
+        if level > 0:
+            img = resize(img, (max(-(-img.shape[1] >> level), 1), max(-(-img.shape[0] >> level), 1)),
+                         interpolation=INTER_AREA)
+    ##########################################################################################
+
+    img = cvtColor(img, COLOR_GRAY2BGR)
+
+    if len(f_rows) == 0:
+        return img
+
+    rows = floor((asarray(f_rows, dtype=float64) - max(region[0], 0)) / 2 ** level).astype(int64)
+    cols = floor((asarray(f_cols, dtype=float64) - max(region[2], 0)) / 2 ** level).astype(int64)
+
+    ###################################################################################
+    # Each read is stamped as a disc by adding the offsets of disc to its coordinate, #
+    # and the pixels outside the image are dropped                                    #
+    ###################################################################################
+    dr, dc = meshgrid(arange(-radius, radius + 1), arange(-radius, radius + 1), indexing='ij')
+    in_disc = dr ** 2 + dc ** 2 <= radius ** 2
+
+    stamp_rows = (rows[:, None] + dr[in_disc][None, :]).ravel()
+    stamp_cols = (cols[:, None] + dc[in_disc][None, :]).ravel()
+    stamp_colors = asarray(f_colors, dtype=uint8).repeat(int(in_disc.sum()), axis=0)
+
+    inside = (stamp_rows >= 0) & (stamp_rows < img.shape[0]) & (stamp_cols >= 0) & (stamp_cols < img.shape[1])
+
+    img[stamp_rows[inside], stamp_cols[inside]] = stamp_colors[inside]
+    ###################################################################################
+
+    return img
+
+
+if __name__ == '__main__':
+    color_by = None
+    cycle_id = None
+    region_box = None
+    zoom_level = None
+    disc_radius = None
+    min_quality = None
+    no_n = False
+
+    if '--color-by' in argv:
+        color_by = argv[argv.index('--color-by') + 1]
+        del argv[argv.index('--color-by'):(argv.index('--color-by') + 2)]
+
+    if '--cycle' in argv:
+        cycle_id = int(argv[argv.index('--cycle') + 1])
+        del argv[argv.index('--cycle'):(argv.index('--cycle') + 2)]
+
+    if '--region' in argv:
+        region_box = tuple(int(_) for _ in argv[(argv.index('--region') + 1):(argv.index('--region') + 5)])
+        del argv[argv.index('--region'):(argv.index('--region') + 5)]
+
+    if '--level' in argv:
+        zoom_level = int(argv[argv.index('--level') + 1])
+        del argv[argv.index('--level'):(argv.index('--level') + 2)]
+
+    if '--radius' in argv:
+        disc_radius = int(argv[argv.index('--radius') + 1])
+        del argv[argv.index('--radius'):(argv.index('--radius') + 2)]
+
+    if '--min-quality' in argv:
+        min_quality = float(argv[argv.index('--min-quality') + 1])
+        del argv[argv.index('--min-quality'):(argv.index('--min-quality') + 2)]
+
+    if '--noN' in argv:
+        no_n = True
+        del argv[argv.index('--noN')]
+
+    if len(argv) == 4:
+        read_columns = load_reads(argv[1], no_n, min_quality)
+
+        imwrite(argv[3], render_reads(argv[2], read_columns[3], read_columns[4],
+                                      read_colors(read_columns[1], read_columns[5] if len(read_columns) > 5 else None,
+                                                  color_by, cycle_id),
+                                      region_box, zoom_level, disc_radius))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <basecalling data> <background image or pyramid> <output image> '
+              '[--color-by base|gene] [--cycle N] [--noN] [--min-quality Q] '
+              '[--region <min row> <max row> <min col> <max col>] [--level L] [--radius R]', file=stderr)
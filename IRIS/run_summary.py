@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+This model is used to summarize the quality of a run, from the statistics collected while the stages are running,
+without reading any output file again.
+
+The statistics of each cycle are collected from three stages:
+1) Registration, the number of matched key points, the inliers among them and the residual (the root mean square
+   distance in pixels between the inliers of reference and the registered ones).
+2) Detection, the number of blobs and bases, and the cut-off of base score of each channel.
+3) Output, the composition of bases, the rate of 'N' and the histogram of quality, which are counted online as the
+   reads are assembled, chunk by chunk if needed.
+
+The summary is written as a JSON file, and a compact HTML page of the same tables for reading by eye. The statistics of
+registration and detection are saved with their checkpoints, and added again when the stages are loaded from them.
+"""
+
+
+from sys import (argv, stderr)
+from json import (dump, load)
+from html import escape
+from numpy import (frombuffer, bincount, zeros, uint8, int64)
+
+
+BASES = 'ATCGN'
+MAX_QUALITY = 41  # Phred scores are binned up to 41, the largest one of 'assemble_reads' is 40
+
+
+class RunSummary:
+    def __init__(self, f_cycle_num):
+        """
+        This method will initialize an empty summary.
+
+        :param f_cycle_num: The number of cycles.
+        """
+        self.cycle_num = f_cycle_num
+
+        self.cycles = [{'cycle': _ + 1, 'registration': {}, 'detection': {}} for _ in range(0, f_cycle_num)]
+
+        self.__read_num = 0
+        self.__read_num_without_N = 0
+        self.__decoded_num = None
+        self.__base_counts = zeros((f_cycle_num, 256), dtype=int64)
+        self.__quality_counts = zeros((f_cycle_num, 256), dtype=int64)
+        self.__blob_qc = {}
+
+    def add_registration(self, f_stats):
+        """
+        This method is used to add the statistics of registration.
+
+        :param f_stats: A dictionary of the statistics of each cycle, by the index of cycle (from 0), as collected by
+                        'decode_data_Ke'.
+        :return: NONE
+        """
+        for cycle_id in f_stats:
+            self.cycles[cycle_id]['registration'].update(f_stats[cycle_id])
+
+    def add_detection(self, f_cycle_id, f_stats):
+        """
+        This method is used to add the statistics of detection of a cycle.
+
+        :param f_cycle_id: The index of cycle, from 0.
+        :param f_stats: A dictionary of the statistics, as collected by 'detect_blobs_Ke' or 'detect_blobs_Chen'.
+        :return: NONE
+        """
+        self.cycles[f_cycle_id]['detection'].update(f_stats)
+
+    def add_reads(self, f_reads):
+        """
+        This method is used to count the bases and qualities of reads into the summary, which could be called for each
+        chunk of reads.
+
+        :param f_reads: A list of reads, each of which is composed of id, sequence, quality, row, column and optionally
+                        gene name and edit distance.
+        :return: NONE
+        """
+        self.__read_num += len(f_reads)
+        self.__read_num_without_N += sum(1 for _ in f_reads if 'N' not in _[1])
+
+        if len(f_reads) > 0 and len(f_reads[0]) > 6:
+            self.__decoded_num = (0 if self.__decoded_num is None else self.__decoded_num) + \
+                                 sum(1 for _ in f_reads if _[5] != 'NA')
+
+        #################################################################################
+        # Reads of the same length are stacked into a matrix of bytes, read x cycle, so #
+        # that the bases and qualities of each cycle are counted at once                #
+        #################################################################################
+        lengths = {}
+
+        for read in f_reads:
+            lengths.setdefault(min(len(read[1]), self.cycle_num), []).append(read)
+
+        for length, reads in lengths.items():
+            if length == 0:
+                continue
+
+            seqs = frombuffer(''.join(_[1][:length] for _ in reads).encode(), dtype=uint8).reshape(-1, length)
+            quls = frombuffer(''.join(_[2][:length] for _ in reads).encode(), dtype=uint8).reshape(-1, length)
+
+            for cycle_id in range(0, length):
+                self.__base_counts[cycle_id] += bincount(seqs[:, cycle_id], minlength=256)
+                self.__quality_counts[cycle_id] += bincount(quls[:, cycle_id], minlength=256)
+        #################################################################################
+
+    def add_blob_qc(self, f_blob_qc):
+        """
+        This method is used to add the summary of 'blob_qc'.
+
+        :param f_blob_qc: The dictionary returned by 'blob_qc'.
+        :return: NONE
+        """
+        self.__blob_qc = dict(f_blob_qc)
+
+    def summary(self):
+        """
+        This method is used to gather the summary of run.
+
+        :return: A dictionary of the summary of reads and the statistics of each cycle.
+        """
+        cycles = []
+
+        for cycle_id, cycle in enumerate(self.cycles):
+            base_counts = {_: int(self.__base_counts[cycle_id][ord(_)]) for _ in BASES}
+            base_num = max(sum(base_counts.values()), 1)
+
+            #############################################################################
+            # Qualities are the characters of Phred+33, and the ones above the largest  #
+            # bin are counted into it                                                   #
+            #############################################################################
+            histogram = [int(_) for _ in self.__quality_counts[cycle_id][33:(33 + MAX_QUALITY + 1)]]
+            histogram[-1] += int(self.__quality_counts[cycle_id][(33 + MAX_QUALITY + 1):].sum())
+            #############################################################################
+
+            cycles.append({'cycle': cycle['cycle'],
+                           'registration': cycle['registration'],
+                           'detection': cycle['detection'],
+                           'bases': base_counts,
+                           'N_rate': base_counts['N'] / base_num,
+                           'mean_quality': sum(_ * histogram[_] for _ in range(0, len(histogram))) /
+                                           max(sum(histogram), 1),
+                           'quality_histogram': histogram})
+
+        reads = {'reads': self.__read_num, 'reads_without_N': self.__read_num_without_N}
+
+        if self.__decoded_num is not None:
+            reads.update({'decoded_reads': self.__decoded_num})
+
+        return {'reads': reads, 'blob_qc': self.__blob_qc, 'cycles': cycles}
+
+    def write(self, f_prefix):
+        """
+        This method is used to write the summary into '<prefix>.json' and '<prefix>.html'.
+
+        :param f_prefix: The prefix of output files.
+        :return: The dictionary of summary.
+        """
+        summary = self.summary()
+
+        with open(f_prefix + '.json', 'wt') as OU:
+            dump(summary, OU, indent=4)
+
+        with open(f_prefix + '.html', 'wt') as OU:
+            OU.write(summary_html(summary))
+
+        return summary
+
+
+def __histogram_svg(f_histogram):
+    """
+    For drawing a histogram as a small inline SVG.
+
+    :param f_histogram: A list of counts.
+    :return: The SVG element.
+    """
+    top = max(max(f_histogram), 1)
+
+    bars = ''.join('<rect x="%d" y="%.1f" width="3" height="%.1f"/>' % (_ * 3, 24 - 24 * f_histogram[_] / top,
+                                                                         24 * f_histogram[_] / top)
+                   for _ in range(0, len(f_histogram)) if f_histogram[_] > 0)
+
+    return '<svg width="%d" height="24">%s</svg>' % (len(f_histogram) * 3, bars)
+
+
+def summary_html(f_summary):
+    """
+    This function is used to render a summary as a compact HTML page.
+
+    :param f_summary: The dictionary of summary.
+    :return: The HTML page.
+    """
+    def __cell(f_value):
+        if f_value is None:
+            return '<td></td>'
+
+        return '<td>%s</td>' % escape('%.3g' % f_value if isinstance(f_value, float) else str(f_value))
+
+    channels = sorted({_ for cycle in f_summary['cycles'] for _ in cycle['detection'].get('cut_offs', {})},
+                      key=lambda _: (BASES + '0').index(_) if _ in BASES + '0' else len(BASES))
+
+    header = ['Cycle', 'Matches', 'Inliers', 'Residual', 'Blobs', 'Bases'] + ['Cut-off ' + _ for _ in channels] + \
+             ['%' + _ for _ in BASES] + ['Mean quality', 'Quality']
+
+    rows = []
+
+    for cycle in f_summary['cycles']:
+        base_num = max(sum(cycle['bases'].values()), 1)
+
+        cells = [cycle['cycle'], cycle['registration'].get('matches'), cycle['registration'].get('inliers'),
+                 cycle['registration'].get('residual'), cycle['detection'].get('blobs'),
+                 cycle['detection'].get('bases')] + \
+                [cycle['detection'].get('cut_offs', {}).get(_) for _ in channels] + \
+                [100.0 * cycle['bases'][_] / base_num for _ in BASES] + [cycle['mean_quality']]
+
+        rows.append('<tr>' + ''.join(__cell(_) for _ in cells) + '<td>' +
+                    __histogram_svg(cycle['quality_histogram']) + '</td></tr>')
+
+    overall = dict(f_summary['reads'])
+    overall.update(f_summary['blob_qc'])
+
+    return '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Base calling summary</title><style>' \
+           'body{font-family:sans-serif;font-size:13px}table{border-collapse:collapse;margin-bottom:16px}' \
+           'td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}svg{fill:#4a7}</style></head><body>\n' \
+           '<h3>Reads</h3><table>' + \
+           ''.join('<tr><th>%s</th>%s</tr>' % (escape(_), __cell(overall[_])) for _ in overall) + \
+           '</table>\n<h3>Cycles</h3><table><tr>' + ''.join('<th>%s</th>' % escape(_) for _ in header) + '</tr>\n' + \
+           '\n'.join(rows) + '</table>\n</body></html>\n'
+
+
+if __name__ == '__main__':
+    if len(argv) == 3:
+        with open(argv[1], 'rt') as IN:
+            run_summary = load(IN)
+
+        with open(argv[2], 'wt') as HTML:
+            HTML.write(summary_html(run_summary))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <summary json> <output html>', file=stderr)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+This model is used to share the 3D matrix of cycles between processes, without pickling or copying the images.
+
+The images of all cycles and channels are kept in a block of shared memory, as a 4D matrix of cycle x channel x row x
+column. The block could be allocated before importing, so that each cycle is written into its slice as soon as it is
+registered, and the stack is never held in private memory as well. A worker receives only a descriptor of this block
+(its name, shape and data type), and maps the same memory as a read-only matrix, so that sending a cycle to a worker
+costs a few bytes instead of its images.
+
+The block belongs to the process which creates it, and is released at the end of a 'with' block, by 'release', or when
+the process exits. If the process is killed, the leaked block is removed by the resource tracker of 'multiprocessing'.
+"""
+
+
+from sys import stderr
+from multiprocessing.shared_memory import SharedMemory
+from weakref import finalize
+from numpy import (ndarray, dtype, prod)
+
+
+class SharedStack:
+    def __init__(self, f_cycle_stack=None):
+        """
+        This method will copy the images of cycles into a new block of shared memory, or leave the block to be
+        allocated by 'allocate' if no images are given.
+
+        :param f_cycle_stack: The 3D matrix of cycles from 'decode_data_Ke' or 'decode_data_Chen', of which all the
+                              images should be in the same shape and data type.
+        """
+        self.descriptor = None
+
+        self.__finalizer = None
+
+        if f_cycle_stack is None:
+            return
+
+        images = [img for cycle in f_cycle_stack for img in cycle]
+
+        if len(images) == 0 or any(_.shape != images[0].shape or _.dtype != images[0].dtype for _ in images):
+            print('THE IMAGES COULD NOT BE SHARED, SINCE THEY ARE NOT IN THE SAME SHAPE', file=stderr)
+            exit(1)
+
+        stack = self.allocate((len(f_cycle_stack), len(f_cycle_stack[0])) + images[0].shape, images[0].dtype)
+
+        for cycle_id, cycle in enumerate(f_cycle_stack):
+            for channel_id, img in enumerate(cycle):
+                stack[cycle_id, channel_id] = img
+
+        del stack
+
+    def allocate(self, f_shape, f_dtype):
+        """
+        This method is used to create the block of a 4D matrix, into which the images are written by the caller.
+
+        All the views of the matrix should be deleted before the block is released, otherwise it could not be closed.
+
+        :param f_shape: The shape of matrix, cycle x channel x row x column.
+        :param f_dtype: The data type of images.
+        :return: The writable 4D matrix in the block.
+        """
+        if self.__finalizer is not None:
+            print('THE BLOCK OF SHARED MEMORY IS ALREADY ALLOCATED', file=stderr)
+            exit(1)
+
+        shape = tuple(int(_) for _ in f_shape)
+
+        memory = SharedMemory(create=True, size=max(int(prod(shape)) * dtype(f_dtype).itemsize, 1))
+
+        self.descriptor = {'name': memory.name, 'shape': shape, 'dtype': dtype(f_dtype).str}
+
+        ##############################################################################
+        # No view of the block is kept here, otherwise it could not be closed, and   #
+        # the finalizer also releases it at exit if it is never released explicitly  #
+        ##############################################################################
+        self.__finalizer = finalize(self, SharedStack.__close, memory)
+        ##############################################################################
+
+        return ndarray(shape, dtype(f_dtype), buffer=memory.buf)
+
+    @staticmethod
+    def __close(f_memory):
+        """
+        For closing and removing a block of shared memory, which is called only once by the finalizer.
+
+        :param f_memory: The 'SharedMemory' object.
+        :return: NONE
+        """
+        f_memory.close()
+        f_memory.unlink()
+
+    def release(self):
+        """
+        This method is used to close and remove the block, and it does nothing if the block is released or never
+        allocated.
+
+        :return: NONE
+        """
+        if self.__finalizer is not None:
+            self.__finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+def attach_stack(f_descriptor):
+    """
+    This function is used to map a shared block by its descriptor, in any process.
+
+    The block should be closed by the returned 'SharedMemory' object after all the views of the matrix are deleted,
+    and it is never removed here.
+
+    :param f_descriptor: The descriptor of 'SharedStack'.
+    :return: A tuple of the 'SharedMemory' object and the read-only 4D matrix of cycle x channel x row x column.
+    """
+    memory = SharedMemory(f_descriptor['name'])
+
+    stack = ndarray(tuple(f_descriptor['shape']), dtype(f_descriptor['dtype']), buffer=memory.buf)
+    stack.flags.writeable = False
+
+    return memory, stack
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+This model is used to simulate the images of in situ sequencing in Ke's layout, with the ground truth of blobs.
+
+Each blob is assigned a barcode from a random codebook, and lights up in the channel of its base in each cycle (Y5,
+FAM, TXR and Y3 for A, T, C and G), as a Gaussian spot of a given size. The DAPI channel is composed of blurred
+ellipses like nuclei, which gives the texture for registration. Each cycle except the first is shifted and rotated
+randomly, and Gaussian noise is added to all the channels.
+
+    output directory
+    |---1                   (Y5.tif, FAM.tif, TXR.tif, Y3.tif and DAPI.tif of the 1st cycle)
+    |---2
+    |---(...)
+    |---barcode_info.txt    (the codebook, barcode and gene)
+    |---truth.txt           (the barcode, gene and coordinates of each blob in the 1st cycle)
+
+All the spots of a channel are stamped at once and blurred by a single Gaussian filter, so that even large images with
+dense blobs are generated in seconds.
+"""
+
+
+from sys import (argv, stderr)
+from os import makedirs
+from os.path import join
+from cv2 import (imwrite, ellipse, GaussianBlur, warpAffine, getRotationMatrix2D, BORDER_REFLECT)
+from numpy import (array, zeros, clip, add, around, uint8, float32)
+from numpy.random import default_rng
+
+
+CHANNELS = (('A', 'Y5.tif'), ('T', 'FAM.tif'), ('C', 'TXR.tif'), ('G', 'Y3.tif'))
+
+
+def simulate_images(f_output_dir, f_height, f_width, f_cycle_num=None, f_density=None, f_blob_size=None,
+                    f_noise=None, f_max_shift=None, f_max_rotation=None, f_gene_num=None, f_seed=None):
+    """
+    This function is used to generate a set of images of several cycles, with their ground truth.
+
+    :param f_output_dir: The directory of output, in which each cycle is a sub-directory named by its number.
+    :param f_height: The height of images.
+    :param f_width: The width of images.
+    :param f_cycle_num: The number of cycles, which is also the length of barcodes, 4 by default.
+    :param f_density: The number of blobs in each megapixel, 1000 by default.
+    :param f_blob_size: The standard deviation of Gaussian spots in pixels, 1.2 by default.
+    :param f_noise: The standard deviation of Gaussian noise in gray scale, 5 by default.
+    :param f_max_shift: The largest shift of cycles in pixels, 5 by default.
+    :param f_max_rotation: The largest rotation of cycles in degrees, 0.5 by default.
+    :param f_gene_num: The number of barcodes in codebook, 50 by default.
+    :param f_seed: The seed of random generator.
+    :return: A list of blobs, each of which is composed of barcode, gene, row and column.
+    """
+    cycle_num = 4 if f_cycle_num is None else int(f_cycle_num)
+    density = 1000 if f_density is None else float(f_density)
+    blob_size = 1.2 if f_blob_size is None else float(f_blob_size)
+    noise = 5 if f_noise is None else float(f_noise)
+    max_shift = 5 if f_max_shift is None else float(f_max_shift)
+    max_rotation = 0.5 if f_max_rotation is None else float(f_max_rotation)
+    gene_num = 50 if f_gene_num is None else int(f_gene_num)
+
+    rng = default_rng(f_seed)
+
+    ##########################################################################################
+    # Codewords are drawn without replacement from all the sequences of this length, so that #
+    # each gene has a unique barcode                                                         #
+    ##########################################################################################
+    gene_num = min(gene_num, 4 ** cycle_num)
+
+    codes = rng.choice(4 ** cycle_num, gene_num, replace=False)
+    codewords = [''.join('ATCG'[(code >> (2 * _)) & 3] for _ in range(cycle_num - 1, -1, -1)) for code in codes]
+    ##########################################################################################
+
+    ############################################################################
+    # Blobs are kept away from the border, where their surrounding is clipped  #
+    ############################################################################
+    margin = 10
+
+    blob_num = int(density * f_height * f_width / 1e6)
+
+    rows = rng.integers(margin, max(f_height - margin, margin + 1), blob_num)
+    cols = rng.integers(margin, max(f_width - margin, margin + 1), blob_num)
+    genes = rng.integers(0, gene_num, blob_num)
+    intensities = rng.uniform(80, 200, blob_num) * (2 * 3.141592653589793 * blob_size ** 2)
+    ############################################################################
+
+    ###################################################################
+    # The texture of DAPI is drawn once in the frame of the 1st cycle #
+    ###################################################################
+    dapi = zeros((f_height, f_width), dtype=uint8)
+
+    for _ in range(0, max(int(f_height * f_width / 3600), 1)):
+        ellipse(dapi, (int(rng.integers(0, f_width)), int(rng.integers(0, f_height))),
+                (int(rng.integers(8, 20)), int(rng.integers(6, 15))), float(rng.uniform(0, 180)), 0, 360,
+                int(rng.integers(60, 160)), -1)
+
+    dapi = GaussianBlur(dapi, (0, 0), 3)
+    ###################################################################
+
+    for cycle_id in range(0, cycle_num):
+        cycle_dir = join(f_output_dir, str(cycle_id + 1))
+        makedirs(cycle_dir, exist_ok=True)
+
+        #####################################################################
+        # The 1st cycle is the reference, and the others are moved randomly #
+        #####################################################################
+        if cycle_id == 0:
+            trans_mat = array([[1, 0, 0], [0, 1, 0]], dtype=float32)
+
+        else:
+            trans_mat = getRotationMatrix2D((f_width / 2, f_height / 2), rng.uniform(-max_rotation, max_rotation), 1)
+            trans_mat[:, 2] += rng.uniform(-max_shift, max_shift, 2)
+        #####################################################################
+
+        bases = array([codewords[_][cycle_id] for _ in genes], dtype=str)
+
+        for base, channel in CHANNELS:
+            signal = zeros((f_height, f_width), dtype=float32)
+
+            is_base = bases == base
+            add.at(signal, (rows[is_base], cols[is_base]), intensities[is_base])
+
+            signal = GaussianBlur(signal, (0, 0), blob_size) + 20
+
+            signal = warpAffine(signal, trans_mat, (f_width, f_height), borderMode=BORDER_REFLECT)
+            signal += rng.normal(0, noise, signal.shape).astype(float32)
+
+            imwrite(join(cycle_dir, channel), clip(around(signal), 0, 255).astype(uint8))
+
+        channel_0 = warpAffine(dapi.astype(float32), trans_mat, (f_width, f_height), borderMode=BORDER_REFLECT)
+        channel_0 += rng.normal(0, noise, channel_0.shape).astype(float32)
+
+        imwrite(join(cycle_dir, 'DAPI.tif'), clip(around(channel_0), 0, 255).astype(uint8))
+
+    truth = [(codewords[genes[_]], 'gene_%d' % genes[_], int(rows[_]), int(cols[_])) for _ in range(0, blob_num)]
+
+    with open(join(f_output_dir, 'barcode_info.txt'), 'wt') as OU:
+        for gene_id, codeword in enumerate(codewords):
+            print('%s\tgene_%d' % (codeword, gene_id), file=OU)
+
+    with open(join(f_output_dir, 'truth.txt'), 'wt') as OU:
+        print('#barcode\tgene\trow\tcol', file=OU)
+
+        for blob in truth:
+            print('%s\t%s\t%d\t%d' % blob, file=OU)
+
+    return truth
+
+
+def read_truth(f_truth_file):
+    """
+    This function is used to read the ground truth written by 'simulate_images'.
+
+    :param f_truth_file: The file of ground truth.
+    :return: A list of blobs, each of which is composed of barcode, gene, row and column.
+    """
+    with open(f_truth_file, 'rt') as IN:
+        return [(ln[0], ln[1], int(ln[2]), int(ln[3])) for ln in (_.split() for _ in IN if not _.startswith('#'))]
+
+
+if __name__ == '__main__':
+    if len(argv) >= 4:
+        options = [float(_) for _ in argv[4:]] + [None] * (8 - len(argv[4:]))
+
+        simulate_images(argv[1], int(argv[2]), int(argv[3]), options[0], options[1], options[2], options[3],
+                        options[4], options[5], options[6], None if options[7] is None else int(options[7]))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <output directory> <height> <width> [cycles] [blobs per megapixel] '
+              '[blob size] [noise] [max shift] [max rotation] [genes] [seed]', file=stderr)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+This model is used to store the result of base calling into a SQLite database with a spatial index, so that the reads
+in a region of the background image can be queried without scanning the whole result file.
+
+Each read is stored in the table 'reads' with its id, sequence, quality, coordinates and, if decoded, gene name and
+edit distance. The image is split into horizontal bands of 64 rows, and reads are indexed by their band and column.
+A bounding box is then queried as a few index range scans, one for each band it covers, which touches little more
+than the reads in the box itself. Compared with an R-tree, this index is built by a single sort after bulk insertion,
+which is several times faster for tens of millions of reads.
+"""
+
+
+from sys import (argv, stderr)
+from os import remove
+from os.path import exists
+from sqlite3 import connect
+
+
+BAND_SHIFT = 6  # 64 rows in each band
+
+
+def write_reads_into_database(f_reads, f_database):
+    """
+    This function is used to write reads into a SQLite database, and build the spatial index of their coordinates.
+
+    :param f_reads: An iterable of reads, each of which is composed of id, sequence, quality, row, column and
+                    optionally gene name and edit distance.
+    :param f_database: The path of database, an existing one will be overwritten.
+    :return: NONE
+    """
+    if exists(f_database):
+        remove(f_database)
+
+    db = connect(f_database)
+
+    ##########################################################################
+    # The database is written once, so that journal and sync can be disabled #
+    ##########################################################################
+    db.execute('PRAGMA journal_mode = OFF')
+    db.execute('PRAGMA synchronous = OFF')
+    ##########################################################################
+
+    db.execute('CREATE TABLE reads (id INTEGER PRIMARY KEY, read_id TEXT, seq TEXT, qul TEXT, '
+               'row INTEGER, col INTEGER, band INTEGER, gene TEXT, dist INTEGER)')
+
+    db.executemany('INSERT INTO reads (read_id, seq, qul, row, col, band, gene, dist) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                   ((read[0], read[1], read[2], int(read[3]), int(read[4]), int(read[3]) >> BAND_SHIFT,
+                     read[5] if len(read) > 5 else None,
+                     int(read[6]) if len(read) > 6 else None) for read in f_reads))
+
+    #################################################################################
+    # The index is built after all reads have been inserted, which is much faster   #
+    # than updating it read by read                                                 #
+    #################################################################################
+    db.execute('CREATE INDEX reads_band ON reads (band, col)')
+    #################################################################################
+
+    db.commit()
+    db.close()
+
+
+def query_region(f_database, f_min_row, f_max_row, f_min_col, f_max_col):
+    """
+    This function is used to query the reads in a bounding box of the background image.
+
+    :param f_database: The path of database.
+    :param f_min_row: The upper bound of box, inclusive.
+    :param f_max_row: The lower bound of box, inclusive.
+    :param f_min_col: The left bound of box, inclusive.
+    :param f_max_col: The right bound of box, inclusive.
+    :return: A list of reads, each of which is composed of id, sequence, quality, row, column, gene name and edit
+             distance.
+    """
+    db = connect(f_database)
+
+    bands = ', '.join(str(_) for _ in range(max(f_min_row, 0) >> BAND_SHIFT, (max(f_max_row, 0) >> BAND_SHIFT) + 1))
+
+    reads = db.execute('SELECT read_id, seq, qul, row, col, gene, dist FROM reads '
+                       'WHERE band IN (' + bands + ') AND col >= ? AND col <= ? AND row >= ? AND row <= ?',
+                       (f_min_col, f_max_col, f_min_row, f_max_row)).fetchall()
+
+    db.close()
+
+    return reads
+
+
+if __name__ == '__main__':
+    if len(argv) == 6:
+        for r in query_region(argv[1], int(argv[2]), int(argv[3]), int(argv[4]), int(argv[5])):
+            print('\t'.join(('%s\t%s\t%s\t%05d\t%05d' % r[:5],) + tuple(str(_) for _ in r[5:] if _ is not None)))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <database> <min row> <max row> <min col> <max col>', file=stderr)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+This model is used to store a large image, such as the stitched background of a whole slide, out of core.
+
+The image is split into square tiles, and stored as a multi-resolution pyramid in a directory. Each level of the
+pyramid is a memory-mapped array of tiles in the '.npy' format, of which each tile is contiguous on disk, and each
+level is downsampled by 2 from the previous one. An image is composed tile by tile, and a viewer or a region query
+only reads the tiles of the zoom level it needs. Thus neither writing nor reading the image requires it to fit in
+memory.
+
+    pyramid directory
+    |---pyramid.txt     (tile size, and the level, height and width of each level)
+    |---level_0.npy     (full resolution, in shape of (tile rows, tile cols, tile size, tile size))
+    |---level_1.npy     (downsampled by 2)
+    |---(...)
+"""
+
+
+from sys import (argv, stderr)
+from os import makedirs
+from os.path import join
+from cv2 import (resize, imwrite, INTER_AREA)
+from numpy import (zeros, uint8)
+from numpy.lib.format import open_memmap
+
+
+class TiledMosaic:
+    def __init__(self, f_path, f_shape=None, f_tile_size=None):
+        """
+        This method will create an empty mosaic if its shape is given, or open an existing one.
+
+        :param f_path: The directory of mosaic.
+        :param f_shape: The shape (height, width) of a new mosaic.
+        :param f_tile_size: The edge length of tiles, 512 by default.
+        """
+        self.path = f_path
+
+        if f_shape is not None:
+            self.tile_size = 512 if f_tile_size is None else f_tile_size
+            self.shapes = [(int(f_shape[0]), int(f_shape[1]))]
+
+            makedirs(self.path, exist_ok=True)
+
+            self.levels = [open_memmap(join(self.path, 'level_0.npy'), mode='w+', dtype=uint8,
+                                       shape=self.__tile_grid(self.shapes[0]) + (self.tile_size, self.tile_size))]
+
+            self.__write_info()
+
+        else:
+            with open(join(self.path, 'pyramid.txt'), 'rt') as IN:
+                self.tile_size = int(IN.readline().split()[1])
+                self.shapes = [(int(_.split()[1]), int(_.split()[2])) for _ in IN]
+
+            self.levels = [open_memmap(join(self.path, 'level_%d.npy' % _), mode='r') for _ in range(len(self.shapes))]
+
+    def __tile_grid(self, f_shape):
+        """
+        This method is used to calculate the number of tiles in rows and columns.
+
+        :param f_shape: The shape (height, width) of image.
+        :return: A tuple of the numbers of tile rows and tile columns.
+        """
+        return -(-f_shape[0] // self.tile_size), -(-f_shape[1] // self.tile_size)
+
+    def __write_info(self):
+        """
+        This method is used to record the tile size and the shape of each level.
+
+        :return: NONE
+        """
+        with open(join(self.path, 'pyramid.txt'), 'wt') as OU:
+            print('tile_size\t%d' % self.tile_size, file=OU)
+
+            for level_id, shape in enumerate(self.shapes):
+                print('%d\t%d\t%d' % (level_id, shape[0], shape[1]), file=OU)
+
+    def write_region(self, f_row, f_col, f_img):
+        """
+        This method is used to paste an image into the full resolution level, tile by tile.
+
+        :param f_row: The row of the upper-left corner of image in mosaic.
+        :param f_col: The column of the upper-left corner of image in mosaic.
+        :param f_img: The image to be pasted.
+        :return: NONE
+        """
+        t = self.tile_size
+
+        r0 = max(f_row, 0)
+        c0 = max(f_col, 0)
+        r1 = min(f_row + f_img.shape[0], self.shapes[0][0])
+        c1 = min(f_col + f_img.shape[1], self.shapes[0][1])
+
+        for tr in range(r0 // t, -(-r1 // t)):
+            for tc in range(c0 // t, -(-c1 // t)):
+                ar0 = max(r0, tr * t)
+                ar1 = min(r1, (tr + 1) * t)
+                ac0 = max(c0, tc * t)
+                ac1 = min(c1, (tc + 1) * t)
+
+                self.levels[0][tr, tc, (ar0 - tr * t):(ar1 - tr * t), (ac0 - tc * t):(ac1 - tc * t)] = \
+                    f_img[(ar0 - f_row):(ar1 - f_row), (ac0 - f_col):(ac1 - f_col)]
+
+    def build_pyramid(self):
+        """
+        This method is used to build the downsampled levels, until a level is composed of only one tile.
+
+        Each tile of a level is downsampled from 2x2 tiles of the previous level, so that only five tiles are held
+        in memory at once.
+
+        :return: NONE
+        """
+        t = self.tile_size
+
+        del self.levels[1:]
+        del self.shapes[1:]
+
+        while self.levels[-1].shape[0] > 1 or self.levels[-1].shape[1] > 1:
+            prev_level = self.levels[-1]
+            shape = (-(-self.shapes[-1][0] // 2), -(-self.shapes[-1][1] // 2))
+
+            level = open_memmap(join(self.path, 'level_%d.npy' % len(self.levels)), mode='w+', dtype=uint8,
+                                shape=self.__tile_grid(shape) + (t, t))
+
+            for tr in range(0, level.shape[0]):
+                for tc in range(0, level.shape[1]):
+                    block = zeros((2 * t, 2 * t), dtype=uint8)
+
+                    for i in range(0, 2):
+                        for j in range(0, 2):
+                            if 2 * tr + i < prev_level.shape[0] and 2 * tc + j < prev_level.shape[1]:
+                                block[(i * t):((i + 1) * t), (j * t):((j + 1) * t)] = \
+                                    prev_level[2 * tr + i, 2 * tc + j]
+
+                    level[tr, tc] = resize(block, (t, t), interpolation=INTER_AREA)
+
+            level.flush()
+
+            self.levels.append(level)
+            self.shapes.append(shape)
+
+        self.levels[0].flush()
+        self.__write_info()
+
+    def read_region(self, f_min_row, f_max_row, f_min_col, f_max_col, f_level=0):
+        """
+        This method is used to read a region of mosaic, by reading only the tiles it covers.
+
+        :param f_min_row: The upper bound of region in full resolution, inclusive.
+        :param f_max_row: The lower bound of region in full resolution, exclusive.
+        :param f_min_col: The left bound of region in full resolution, inclusive.
+        :param f_max_col: The right bound of region in full resolution, exclusive.
+        :param f_level: The level of pyramid, of which the image is downsampled by 2 ** level.
+        :return: The image of this region at this level.
+        """
+        t = self.tile_size
+        level = self.levels[f_level]
+
+        r0 = max(f_min_row >> f_level, 0)
+        c0 = max(f_min_col >> f_level, 0)
+        r1 = min(-(-f_max_row >> f_level), self.shapes[f_level][0])
+        c1 = min(-(-f_max_col >> f_level), self.shapes[f_level][1])
+
+        region = zeros((max(r1 - r0, 0), max(c1 - c0, 0)), dtype=uint8)
+
+        for tr in range(r0 // t, -(-r1 // t)):
+            for tc in range(c0 // t, -(-c1 // t)):
+                ar0 = max(r0, tr * t)
+                ar1 = min(r1, (tr + 1) * t)
+                ac0 = max(c0, tc * t)
+                ac1 = min(c1, (tc + 1) * t)
+
+                region[(ar0 - r0):(ar1 - r0), (ac0 - c0):(ac1 - c0)] = \
+                    level[tr, tc, (ar0 - tr * t):(ar1 - tr * t), (ac0 - tc * t):(ac1 - tc * t)]
+
+        return region
+
+
+if __name__ == '__main__':
+    if len(argv) == 8:
+        mosaic = TiledMosaic(argv[1])
+
+        imwrite(argv[7], mosaic.read_region(int(argv[3]), int(argv[4]), int(argv[5]), int(argv[6]), int(argv[2])))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <pyramid> <level> <min row> <max row> <min col> <max col> <output image>',
+              file=stderr)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+This model is used to find the tissue in a FOV from its signal channels, so that the empty glass around a section
+could be skipped by registration and detection.
+
+The signal channels are summed rather than DAPI is used, since the blobs lie all over the tissue, between nuclei as
+well, and the autofluorescence of tissue fills the gaps between them. The sum is downsampled (by 8 by default) and
+blurred, and Otsu's threshold is found between the glass and the tissue. Only half of it is taken, so that the dim
+parts of tissue are kept, and only the glass, which is far darker, is dropped. The gaps are closed and the small debris
+are removed by morphology, then the mask is dilated by a margin (64 pixels by default), so that the blobs around the
+edges of tissue are kept. A FOV full of tissue is covered entirely.
+
+The regions to process are the bounding boxes of the connected parts of mask, and the overlapping ones are merged into
+one. If no tissue is found, the whole image is taken as one region.
+"""
+
+
+from sys import (argv, stderr)
+from cv2 import (imread, imwrite, add, resize, GaussianBlur, threshold, morphologyEx, dilate, getStructuringElement,
+                 connectedComponentsWithStats,
+                 IMREAD_GRAYSCALE, INTER_AREA, INTER_NEAREST, THRESH_BINARY, THRESH_OTSU, MORPH_ELLIPSE, MORPH_CLOSE,
+                 MORPH_OPEN, CC_STAT_LEFT, CC_STAT_TOP, CC_STAT_WIDTH, CC_STAT_HEIGHT)
+from numpy import uint8
+
+
+MASK_SCALE = 8
+MASK_MARGIN = 64
+
+
+def tissue_mask(f_img, f_scale=None, f_margin=None):
+    """
+    This function is used to compute the mask of tissue from the signal channels.
+
+    :param f_img: The 8-bit sum of signal channels.
+    :param f_scale: The factor of downsampling, 8 by default.
+    :param f_margin: The margin in pixels by which the tissue is dilated, 64 by default.
+    :return: The mask of the same size as image, 255 for tissue and 0 for glass.
+    """
+    scale = MASK_SCALE if f_scale is None else max(int(f_scale), 1)
+    margin = MASK_MARGIN if f_margin is None else max(int(f_margin), 0)
+
+    small = resize(f_img, (max(f_img.shape[1] // scale, 1), max(f_img.shape[0] // scale, 1)),
+                   interpolation=INTER_AREA)
+    small = GaussianBlur(small, (5, 5), 0)
+
+    otsu, _ = threshold(small, 0, 255, THRESH_BINARY + THRESH_OTSU)
+    _, small_mask = threshold(small, otsu / 2, 255, THRESH_BINARY)
+
+    ################################################################################
+    # The closing joins the parts of tissue about 7 small pixels apart, and the    #
+    # opening removes the debris smaller than 3 small pixels                       #
+    ################################################################################
+    small_mask = morphologyEx(small_mask, MORPH_CLOSE, getStructuringElement(MORPH_ELLIPSE, (7, 7)))
+    small_mask = morphologyEx(small_mask, MORPH_OPEN, getStructuringElement(MORPH_ELLIPSE, (3, 3)))
+    ################################################################################
+
+    if margin > 0:
+        radius = -(-margin // scale)
+
+        small_mask = dilate(small_mask, getStructuringElement(MORPH_ELLIPSE, (radius * 2 + 1, radius * 2 + 1)))
+
+    return resize(small_mask, (f_img.shape[1], f_img.shape[0]), interpolation=INTER_NEAREST)
+
+
+def mask_regions(f_mask):
+    """
+    This function is used to get the regions covering a mask, which are the bounding boxes of its connected parts.
+
+    :param f_mask: The mask, in which the non-zero pixels are covered.
+    :return: A list of regions, each of which is (min row, max row, min column, max column), and the overlapping ones
+             are merged. The whole mask is one region if it is empty.
+    """
+    num, _, stats, _ = connectedComponentsWithStats((f_mask > 0).astype(uint8))
+
+    regions = [[stats[_, CC_STAT_TOP], stats[_, CC_STAT_TOP] + stats[_, CC_STAT_HEIGHT],
+                stats[_, CC_STAT_LEFT], stats[_, CC_STAT_LEFT] + stats[_, CC_STAT_WIDTH]] for _ in range(1, num)]
+
+    if len(regions) == 0:
+        return [(0, f_mask.shape[0], 0, f_mask.shape[1])]
+
+    ##################################################################
+    # The overlapping boxes are merged until none of them overlaps,  #
+    # so that no blob is detected twice                              #
+    ##################################################################
+    merged = True
+
+    while merged:
+        merged = False
+
+        for i in range(0, len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    regions[i] = [min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+
+                    merged = True
+                    break
+
+            if merged:
+                break
+    ##################################################################
+
+    return sorted(tuple(int(_) for _ in region) for region in regions)
+
+
+if __name__ == '__main__':
+    if len(argv) >= 3:
+        signal = None
+
+        for channel_file in argv[1:-1]:
+            channel = imread(channel_file, IMREAD_GRAYSCALE)
+
+            if channel is None:
+                print('THE IMAGE COULD NOT BE READ: ' + channel_file, file=stderr)
+                exit(1)
+
+            signal = channel if signal is None else add(signal, channel)
+
+        mask = tissue_mask(signal)
+
+        imwrite(argv[-1], mask)
+
+        for region in mask_regions(mask):
+            print('\t'.join(str(_) for _ in region))
+
+    else:
+        print('USAGE:  ' + argv[0] + ' <channel image> [<channel image> ...] <output mask>', file=stderr)
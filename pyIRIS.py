@@ -37,9 +37,31 @@ ChangeLog:  2019-01-15  r001    First development version
 
 
 from sys import (argv, stderr)
-from numpy import (array, uint8)
+from os.path import abspath
 
-from IRIS import (import_images, detect_signals, connect_barcodes, deal_with_result)
+
+def pop_option(f_argv, f_option, f_default=None):
+    """
+    For extracting an optional argument and its value from the command line.
+
+    :param f_argv: The arguments of command line, the extracted option will be removed from it.
+    :param f_option: The name of option, such as '--codebook'.
+    :param f_default: The value returned if this option is not given.
+    :return: The value of this option.
+    """
+    if f_option not in f_argv:
+        return f_default
+
+    idx = f_argv.index(f_option)
+
+    if idx + 1 >= len(f_argv):
+        print('Option ' + f_option + ' requires a value', file=stderr)
+        exit(1)
+
+    value = f_argv[idx + 1]
+    del f_argv[idx:idx + 2]
+
+    return value
 
 
 if __name__ == '__main__':
@@ -53,40 +75,151 @@ if __name__ == '__main__':
     Our software control the data importing by two options following the main command, of which, the '--ke' means to 
     process the data generated by in situ sequencing, and the '--chen' means processing MERFISH data, with its
     optimized parameters.
-    """
-    if len(argv) > 2 and ('--ke' in argv[1] or '--chen' in argv[1]):
-        cycle_stack = []
-        std_img = array([], dtype=uint8)
-        called_base_box_in_one_cycle = {}
 
-        barcode_cube_obj = connect_barcodes.BarcodeCube()
-
-        if argv[1] == '--ke':
-            cycle_stack, std_img = import_images.decode_data_Ke(argv[2:])
-
-            for cycle in cycle_stack:
-                called_base_box_in_one_cycle = detect_signals.detect_blobs_Ke(cycle)
-                barcode_cube_obj.collect_called_bases(called_base_box_in_one_cycle)
-
-            # barcode_cube_obj.filter_blobs_list(std_img)
-            barcode_cube_obj.filter_blobs_list2()
-
-        if argv[1] == '--chen':
-            cycle_stack, std_img = import_images.decode_data_Chen(argv[2:])
-
-            for cycle in cycle_stack:
-                called_base_box_in_one_cycle = detect_signals.detect_blobs_Chen(cycle)
-                barcode_cube_obj.collect_called_bases(called_base_box_in_one_cycle)
-
-            barcode_cube_obj.filter_blobs_list2()
-
-        #############################################################
-        # Start here, different types of data set are to be unified #
-        #############################################################
-        barcode_cube_obj.calling_adjust()
-        #############################################################
-
-        deal_with_result.write_reads_into_file(std_img, barcode_cube_obj.adjusted_bases_cube, len(cycle_stack))
+    If a barcode info file is given by '--codebook', the called barcodes are decoded into genes with correcting the
+    errors within the Hamming distance of '--max-distance' (1 by default), and with '--prune', the blobs which could
+    never be decoded are dropped after each cycle instead of being output. The reads are also written as FASTQ or
+    unaligned SAM compressed in BGZF, if '--fastq' or '--sam' is given. If '--db' is given, the reads are also
+    stored into a SQLite database with spatial index. If '--bin' is given, the reads are also counted into a gene x
+    spatial-bin matrix, with square (default) or hexagonal bins by '--bin-shape'.
+
+    The results are written into the directory of '--output' (the current one by default). The algorithm of key
+    points detection for registration could be chosen by '--registration' (ORB by default), and the search region
+    for connecting bases by '--search-region' (2, a 6x6 region, by default). The whole process is run by
+    'IRIS.pipeline.Pipeline', which could also be imported to run many FOVs in one process.
+
+    A channel could be a z-stack of multi-page TIFF, which is projected while being read, by the maximum of each pixel
+    or by the plane in best focus, chosen by '--projection' (max by default). Instead of the directories of cycles,
+    the images could also be given as stacks of multi-page TIFF (such as OME-TIFF), each of which holds the channels
+    of one or more cycles. If '--region' is given, only this region of images is read and processed. The channels of
+    the next cycles are read in background while a cycle is being registered, as many cycles as '--prefetch' (1 by
+    default, 0 for none) and the available memory allow. For a section which covers only a part of images, if
+    '--tissue-mask' is given, the tissue is found in the signal channels of the first cycle, and the empty glass out of
+    it is skipped by registration and detection.
+
+    If '--checkpoint' is given, the results of stages are saved into 'checkpoint' of the output directory, and a run
+    with '--resume' starts from the latest stage saved by the previous run of the same images and parameters. With
+    '--append', the cycles given are appended to the run saved in the output directory, and only these new cycles are
+    imported, registered and detected, before the bases of all the cycles are connected and output again.
+
+    The cycles are detected in parallel by the number of processes given by '--processes' (1 by default), which share
+    the images by shared memory. The per-blob loops of scoring and connection are run by Numba if it is installed, or
+    by NumPy, which could be chosen by '--kernels'.
+
+    If '--socket' is given, the job is sent to a daemon started by 'python3 -m IRIS.daemon --serve <socket>' and run
+    by its warm workers, instead of importing the libraries here. The models are imported only when they are used, so
+    that a job sent to daemon costs only milliseconds. Since the job is run by a worker in one process and out of
+    this process, '--processes', '--profile' and '--cprofile' could not be used with '--socket'.
+
+    If '--profile' is given, the wall time, CPU time, peak memory and key counts of each stage in each cycle are
+    written into a JSON report, and each top-level stage is also dumped by cProfile into the directory of
+    '--cprofile' if given.
+    """
+    codebook_file = pop_option(argv, '--codebook')
+    max_distance = pop_option(argv, '--max-distance')
+    database_file = pop_option(argv, '--db')
+    bin_size = pop_option(argv, '--bin')
+    bin_shape = pop_option(argv, '--bin-shape')
+    output_dir = pop_option(argv, '--output')
+    registration = pop_option(argv, '--registration')
+    search_region = pop_option(argv, '--search-region')
+    profile_file = pop_option(argv, '--profile')
+    cprofile_dir = pop_option(argv, '--cprofile')
+    socket_path = pop_option(argv, '--socket')
+    process_num = pop_option(argv, '--processes')
+    kernels = pop_option(argv, '--kernels')
+    projection = pop_option(argv, '--projection')
+    region = pop_option(argv, '--region')
+    prefetch = pop_option(argv, '--prefetch')
+
+    checkpoint = '--checkpoint' in argv
+    resume = '--resume' in argv
+    tissue = '--tissue-mask' in argv
+    prune = '--prune' in argv
+    append = '--append' in argv
+
+    output_formats = [_.lstrip('-') for _ in ('--fastq', '--sam') if _ in argv]
+
+    for flag in ('--checkpoint', '--resume', '--append', '--tissue-mask', '--prune', '--fastq', '--sam'):
+        if flag in argv:
+            del argv[argv.index(flag)]
+
+    if len(argv) > 2 and argv[1] in ('--ke', '--chen'):
+        if database_file is not None:
+            output_formats.append('db')
+
+        if bin_size is not None:
+            output_formats.append('matrix')
+
+        if socket_path is not None:
+            from json import dumps
+            from IRIS.daemon import submit
+
+            ###########################################################################
+            # The jobs of daemon are run by its workers, one process each, and their  #
+            # stages are not profiled in this process                                 #
+            ###########################################################################
+            for option, value in (('--processes', process_num), ('--profile', profile_file),
+                                  ('--cprofile', cprofile_dir)):
+                if value is not None:
+                    print('Option ' + option + ' could not be used with --socket', file=stderr)
+                    exit(1)
+            ###########################################################################
+
+            #######################################################################
+            # Paths are sent as absolute ones, since the daemon is not running in #
+            # the working directory of this job                                   #
+            #######################################################################
+            job = {'mode': argv[1], 'cycles': [abspath(_) for _ in argv[2:]],
+                   'output_dir': abspath('.' if output_dir is None else output_dir), 'formats': output_formats,
+                   'checkpoint': checkpoint, 'resume': resume, 'append': append, 'tissue_mask': tissue,
+                   'prune': prune}
+
+            for key, value in (('registration', registration), ('search_region', search_region),
+                               ('codebook', codebook_file), ('max_distance', max_distance),
+                               ('database', database_file), ('bin_size', bin_size), ('bin_shape', bin_shape),
+                               ('kernels', kernels), ('projection', projection), ('region', region),
+                               ('prefetch', prefetch)):
+                if value is not None:
+                    job.update({key: abspath(value) if key in ('codebook', 'database') else value})
+            #######################################################################
+
+            failed = False
+
+            for status in submit(socket_path, [job]):
+                print(dumps(status), file=stderr)
+
+                failed = failed or status['status'] == 'failed'
+
+            if failed:
+                exit(1)
+
+        else:
+            from IRIS.pipeline import (Pipeline, PipelineConfig)
+            from IRIS.profiler import PROFILER
+
+            if profile_file is not None:
+                PROFILER.enable(cprofile_dir)
+
+            pipeline = Pipeline(PipelineConfig(argv[1], registration, None, search_region, output_dir,
+                                               output_formats, codebook_file, max_distance, database_file, bin_size,
+                                               bin_shape, checkpoint, resume, process_num, kernels, projection,
+                                               region, prefetch, tissue, prune))
+
+            if append:
+                pipeline.append(argv[2:])
+
+            else:
+                pipeline.run(argv[2:])
+
+            if profile_file is not None:
+                PROFILER.write(profile_file)
 
     else:
-        print('Invalid image group\nUSAGE:  ' + argv[0] + ' <--ke|--chen> <image group>', file=stderr)
+        print('Invalid image group\nUSAGE:  ' + argv[0] + ' <--ke|--chen> <image group> '
+              '[--codebook <barcode info> [--max-distance <1|2>] [--prune]] [--db <database>] '
+              '[--bin <bin size> [--bin-shape <square|hex>]] [--fastq] [--sam] [--output <directory>] '
+              '[--registration <ORB|BRISK>] [--search-region <n>] [--projection <max|focus>] '
+              '[--region <min row>,<max row>,<min col>,<max col>] [--prefetch <n>] [--tissue-mask] [--checkpoint] '
+              '[--resume] [--append] [--processes <n>] [--kernels <numba|numpy>] '
+              '[--profile <report> [--cprofile <directory>]] [--socket <daemon socket>]', file=stderr)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the quality check of blobs against random positions.
+"""
+
+
+from json import load
+from numpy import (uint8, int64)
+from numpy.random import default_rng
+
+from IRIS.blob_qc import (blob_scores, blob_qc)
+
+
+def test_blob_scores_as_slices():
+    """
+    The scores are the means of the slices of blob detection, which are clipped by the borders of image, and wrap
+    around as Python slices do.
+    """
+    rng = default_rng(12)
+
+    img = rng.integers(0, 256, (60, 80)).astype(uint8)
+
+    rows = rng.integers(0, 60, 300).astype(int64)
+    cols = rng.integers(0, 80, 300).astype(int64)
+
+    core, score = blob_scores(img, rows, cols)
+
+    for i in range(0, rows.size):
+        r, c = int(rows[i]), int(cols[i])
+
+        expected_core = int(img[(r - 1):(r + 3), (c - 1):(c + 3)].sum()) / 16
+
+        assert core[i] == expected_core
+        assert score[i] == expected_core - int(img[(r - 4):(r + 6), (c - 4):(c + 6)].sum()) / 100
+
+
+def test_blob_qc(tmp_path):
+    """
+    The blobs drawn on a dark image are scored far above the random positions, and the reads with 'N' are skipped.
+    """
+    rng = default_rng(13)
+
+    img = rng.integers(0, 10, (200, 200)).astype(uint8)
+
+    reads = []
+
+    for row, col in rng.integers(5, 195, (150, 2)):
+        img[(row - 1):(row + 3), (col - 1):(col + 3)] = 200
+
+        reads.append(['r%05dc%05d' % (row, col), 'ACGT', 'IIII', '%05d' % row, '%05d' % col])
+
+    reads.append(['r00010c00010', 'ACNT', 'IIII', '00010', '00010'])
+
+    summary = blob_qc(img, reads, str(tmp_path / 'qc'), 1)
+
+    assert summary['blobs'] == 150
+    assert summary['signal_to_background'] > 5
+    assert summary['fraction_above_random_95'] > 0.9
+
+    with open(tmp_path / 'qc.json', 'rt') as IN:
+        assert load(IN) == summary
+
+    with open(tmp_path / 'qc.txt', 'rt') as IN:
+        kinds = [_.split()[1] for _ in IN]
+
+    assert kinds == ['dete', 'stoc'] * 150
+
+    assert blob_qc(img, reads, str(tmp_path / 'qc_again'), 1) == summary
+    assert blob_qc(img, [], str(tmp_path / 'qc_empty'), 1) == {'blobs': 0}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the connection of bases, against the original algorithms it replaces.
+"""
+
+
+from numpy.random import default_rng
+
+from IRIS.connect_barcodes import BarcodeCube
+
+
+def __filter_as_list(f_blobs):
+    """
+    For filtering the redundant blobs as the original 'filter_blobs_list2', which removes the neighbours of each blob
+    from the very list it visits.
+
+    :param f_blobs: The list of ids of blobs, in the order of collection.
+    :return: The set of ids of blobs kept.
+    """
+    new_coor = list(f_blobs)
+
+    for coor in new_coor:
+        if int(coor[1:6]) == 0 or int(coor[7:]) == 0:
+            continue
+
+        r = int(coor[1:6].lstrip('0'))
+        c = int(coor[7:].lstrip('0'))
+
+        for row in range(r - 1, r + 3):
+            for col in range(c - 1, c + 3):
+                if row == r and col == c:
+                    continue
+
+                elif 'r%05dc%05d' % (row, col) in new_coor:
+                    new_coor.remove('r%05dc%05d' % (row, col))
+
+    return set(new_coor)
+
+
+def test_filter_blobs_list2_as_list():
+    """
+    The blobs kept are the same as the ones kept by the list, for random blobs in several cycles, which are dense
+    enough to be neighbours of each other, and repeat across cycles.
+    """
+    rng = default_rng(0)
+
+    for trial in range(0, 30):
+        size = int(rng.integers(5, 40))
+
+        barcode_cube = BarcodeCube()
+        blobs = []
+
+        for cycle in range(0, int(rng.integers(1, 5))):
+            called = {'r%05dc%05d' % (row, col): None
+                      for row, col in rng.integers(0, size, (int(rng.integers(0, size * size // 2)), 2))}
+
+            barcode_cube.collect_called_bases(called)
+            blobs.extend(called.keys())
+
+        barcode_cube.filter_blobs_list2()
+
+        assert getattr(barcode_cube, '_BarcodeCube__all_blobs_list') == __filter_as_list(blobs)
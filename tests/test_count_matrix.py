@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the count matrix, on random reads split into chunks and runs.
+"""
+
+
+from numpy.random import default_rng
+
+from IRIS.count_matrix import CountMatrix
+
+
+def __random_reads(f_rng, f_num):
+    """
+    For drawing random decoded reads, some of which are not assigned.
+
+    :param f_rng: The random generator.
+    :param f_num: The number of reads.
+    :return: A list of reads, each of which is composed of id, sequence, quality, row, column, gene name and edit
+             distance.
+    """
+    genes = ['gene_%d' % _ for _ in range(0, 20)] + ['NA']
+
+    return [['r%05dc%05d' % (row, col), 'AAAA', 'IIII', row, col, genes[f_rng.integers(0, len(genes))], 0]
+            for row, col in zip(f_rng.integers(0, 2000, f_num), f_rng.integers(0, 3000, f_num))]
+
+
+def __counts(f_count_matrix):
+    """
+    For listing the counts of a matrix by the names of genes, which do not depend on the order of adding.
+
+    :param f_count_matrix: A 'CountMatrix' object.
+    :return: A dictionary of counts by gene name, row index and column index of bin.
+    """
+    gene_idx, bin_rows, bin_cols, counts = f_count_matrix.entries()
+
+    return {(f_count_matrix.genes[g], int(r), int(c)): int(n) for g, r, c, n in zip(gene_idx, bin_rows, bin_cols,
+                                                                                   counts)}
+
+
+def test_merge_equals_single_run():
+    """
+    The matrices of parts of reads, merged together, equal the matrix of all the reads counted at once.
+    """
+    reads = __random_reads(default_rng(3), 5000)
+
+    for bin_shape in ('square', 'hex'):
+        single = CountMatrix(50, bin_shape)
+        single.add_reads(reads)
+
+        merged = CountMatrix(50, bin_shape)
+
+        for part in (reads[:1000], reads[1000:3500], reads[3500:]):
+            count_matrix = CountMatrix(50, bin_shape)
+            count_matrix.add_reads(part)
+
+            merged.merge(count_matrix)
+
+        assert __counts(merged) == __counts(single)
+        assert sum(__counts(single).values()) == sum(1 for _ in reads if _[5] != 'NA')
+
+
+def test_write_and_read(tmp_path):
+    """
+    A matrix written and read back has the same counts and bins.
+    """
+    reads = __random_reads(default_rng(4), 2000)
+
+    for bin_shape, bin_size in (('square', 50), ('hex', 37.5), ('square', 0.1)):
+        count_matrix = CountMatrix(bin_size, bin_shape)
+        count_matrix.add_reads(reads)
+
+        count_matrix.write(str(tmp_path / bin_shape))
+
+        read_matrix = CountMatrix.read(str(tmp_path / bin_shape))
+
+        assert read_matrix.bin_shape == bin_shape
+        assert read_matrix.bin_size == bin_size
+        assert __counts(read_matrix) == __counts(count_matrix)
+
+
+def test_chunks_equal_single_chunk(tmp_path):
+    """
+    A result file streamed through in small chunks is counted as in one chunk, into unique entries.
+    """
+    reads = __random_reads(default_rng(5), 3000)
+
+    with open(tmp_path / 'basecalling_data.txt', 'wt') as OU:
+        print('#ID\tSEQ\tQUAL\tROW\tCOL\tGENE\tDIST', file=OU)
+
+        for read in reads:
+            print('\t'.join(str(_) for _ in read), file=OU)
+
+    single = CountMatrix(20)
+    single.add_reads(reads)
+
+    for chunk_size in (1, 7, 500):
+        chunked = CountMatrix(20)
+        chunked.add_file(str(tmp_path / 'basecalling_data.txt'), chunk_size)
+
+        assert __counts(chunked) == __counts(single)
+        assert len(__counts(chunked)) == chunked.entries()[0].size
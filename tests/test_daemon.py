@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the daemon of warm workers, which is run in its own process as it is served.
+"""
+
+
+from sys import executable
+from os import environ
+from os.path import (exists, dirname, abspath)
+from subprocess import (Popen, PIPE)
+from time import (sleep, time)
+
+from IRIS.simulate_images import simulate_images
+from IRIS.daemon import submit
+
+
+def test_jobs_of_daemon(tmp_path):
+    """
+    A job is queued, run and done with its reads, a failed job carries the message it printed to stderr, and the
+    daemon stops after it is shut down.
+    """
+    simulate_images(str(tmp_path / 'images'), 150, 150, f_cycle_num=3, f_density=800, f_seed=8)
+
+    socket_path = str(tmp_path / 'iris.sock')
+
+    repository = dirname(dirname(abspath(__file__)))
+
+    daemon = Popen([executable, '-m', 'IRIS.daemon', '--serve', socket_path, '--processes', '1'], cwd=repository,
+                   env=dict(environ, PYTHONPATH=repository), stderr=PIPE, text=True)
+
+    try:
+        start = time()
+
+        while not exists(socket_path) and time() - start < 60:
+            sleep(0.1)
+
+        jobs = [{'mode': 'ke', 'cycles': [str(tmp_path / 'images' / str(_)) for _ in range(1, 4)],
+                 'output_dir': str(tmp_path / 'result')},
+                {'mode': 'ke', 'cycles': [str(tmp_path / 'missing')], 'output_dir': str(tmp_path / 'missing_result')},
+                {'mode': 'unknown', 'cycles': [str(tmp_path / 'images' / '1')]}]
+
+        events = list(submit(socket_path, jobs))
+
+        assert [(_['job'], _['status']) for _ in events if _['status'] == 'queued'] == [(1, 'queued'), (2, 'queued'),
+                                                                                       (3, 'queued')]
+
+        done = [_ for _ in events if _['status'] in ('done', 'failed')]
+
+        assert [(_['job'], _['status']) for _ in done] == [(1, 'done'), (2, 'failed'), (3, 'failed')]
+
+        with open(tmp_path / 'result' / 'basecalling_data.txt', 'rt') as IN:
+            assert done[0]['reads'] == sum(1 for _ in IN if not _.startswith('#'))
+
+        assert done[1]['error'].startswith('THE IMAGE COULD NOT BE READ: ' + str(tmp_path / 'missing'))
+        assert done[2]['error'] == 'Only the data of Ke (ke) or Chen (chen) could be processed'
+
+        assert list(submit(socket_path, [{'command': 'shutdown'}])) == [{'status': 'shutdown'}]
+
+        assert daemon.wait(60) == 0
+        assert not exists(socket_path)
+        assert 'Only the data of Ke (ke) or Chen (chen) could be processed' in daemon.stderr.read()
+
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
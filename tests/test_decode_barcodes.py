@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+This model is used to test decoding barcodes against a codebook, on random codewords far apart from each other.
+"""
+
+
+from numpy.random import default_rng
+
+from IRIS.decode_barcodes import Codebook
+
+
+def __codewords(f_rng, f_length, f_num, f_min_distance):
+    """
+    For drawing random codewords, each pair of which is at least a Hamming distance apart.
+
+    :param f_rng: The random generator.
+    :param f_length: The length of codewords.
+    :param f_num: The number of codewords.
+    :param f_min_distance: The smallest Hamming distance between codewords.
+    :return: A list of codewords.
+    """
+    codewords = []
+
+    while len(codewords) < f_num:
+        codeword = ''.join(f_rng.choice(list('ATCG'), f_length))
+
+        if all(sum(a != b for a, b in zip(codeword, _)) >= f_min_distance for _ in codewords):
+            codewords.append(codeword)
+
+    return codewords
+
+
+def __mutate(f_rng, f_codeword, f_num):
+    """
+    For changing a number of bases of a codeword into other bases.
+
+    :param f_rng: The random generator.
+    :param f_codeword: The codeword.
+    :param f_num: The number of bases changed.
+    :return: The barcode mutated.
+    """
+    barcode = list(f_codeword)
+
+    for i in f_rng.choice(len(barcode), f_num, replace=False):
+        barcode[i] = f_rng.choice([_ for _ in 'ATCG' if _ != barcode[i]])
+
+    return ''.join(barcode)
+
+
+def __write_codebook(f_path, f_codewords):
+    """
+    For writing a codebook, in which the gene of each codeword is 'gene_<index>'.
+
+    :param f_path: The path of codebook.
+    :param f_codewords: A list of codewords.
+    :return: The path of codebook.
+    """
+    with open(f_path, 'wt') as OU:
+        for i, codeword in enumerate(f_codewords):
+            print('%s\tgene_%d' % (codeword, i), file=OU)
+
+    return str(f_path)
+
+
+def test_decode_within_distance(tmp_path):
+    """
+    The barcodes with low-quality errors up to the largest distance are decoded into their genes, with the number of
+    errors as the edit distance.
+    """
+    rng = default_rng(1)
+
+    for max_distance in (0, 1, 2):
+        codewords = __codewords(rng, 10, 30, 2 * max_distance + 2)
+        codebook = Codebook(__write_codebook(tmp_path / 'codebook.txt', codewords), 10, max_distance)
+
+        seqs = []
+        expected = []
+
+        for i, codeword in enumerate(codewords):
+            for distance in range(0, max_distance + 1):
+                seqs.append(__mutate(rng, codeword, distance))
+                expected.append(('gene_%d' % i, distance))
+
+        genes, distances = codebook.decode(seqs, ['#' * 10] * len(seqs))
+
+        assert list(zip(genes, distances)) == expected
+
+
+def test_decode_beyond_distance(tmp_path):
+    """
+    The barcodes with more errors than the largest distance, or with an error of high quality, are not assigned.
+    """
+    rng = default_rng(2)
+
+    codewords = __codewords(rng, 10, 30, 4)
+    codebook = Codebook(__write_codebook(tmp_path / 'codebook.txt', codewords), 10, 1)
+
+    far_seqs = [__mutate(rng, _, 2) for _ in codewords]
+    genes, distances = codebook.decode(far_seqs, ['#' * 10] * len(far_seqs))
+
+    assert all(_ == 'NA' for _ in genes)
+    assert all(_ == -1 for _ in distances)
+
+    ##########################################################
+    # A mismatched base of quality 40 ('I') is not corrected #
+    ##########################################################
+    near_seqs = [__mutate(rng, _, 1) for _ in codewords]
+    genes, distances = codebook.decode(near_seqs, ['I' * 10] * len(near_seqs))
+
+    assert all(_ == 'NA' for _ in genes)
+
+    genes, distances = codebook.decode(codewords, ['I' * 10] * len(codewords))
+
+    assert list(genes) == ['gene_%d' % _ for _ in range(0, len(codewords))]
+    assert all(_ == 0 for _ in distances)
+    ##########################################################
+
+
+def test_match_prefixes(tmp_path):
+    """
+    A partial barcode is matched only if it is within the largest distance from the prefix of any codeword, with 'N'
+    taken as a mismatch.
+    """
+    rng = default_rng(3)
+
+    codewords = __codewords(rng, 8, 20, 3)
+
+    for max_distance in (1, 2):
+        codebook = Codebook(__write_codebook(tmp_path / 'codebook.txt', codewords), 8, max_distance)
+
+        for length in range(1, 9):
+            seqs = [__mutate(rng, _[:length], min(int(rng.integers(0, 4)), length)) for _ in codewords] + \
+                   [''.join(rng.choice(list('ATCGN'), length)) for _ in range(0, 100)]
+
+            expected = [min(sum(a != b or a == 'N' for a, b in zip(seq, _)) for _ in codewords) <= max_distance
+                        for seq in seqs]
+
+            assert codebook.match_prefixes(seqs).tolist() == expected
+            assert length <= max_distance + 1 or False in expected
+
+    assert codebook.match_prefixes([]).tolist() == []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the export of reads in BGZF, which should be readable by any gzip reader.
+"""
+
+
+from gzip import (decompress, open as open_gzip)
+from struct import unpack_from
+from numpy.random import default_rng
+
+from IRIS.export_reads import (BgzfWriter, BGZF_BLOCK_SIZE, BGZF_EOF, write_reads_into_fastq, write_reads_into_sam)
+
+
+def __blocks(f_data):
+    """
+    For splitting BGZF data into blocks, by the size recorded in the extra field of each block.
+
+    :param f_data: The compressed data.
+    :return: A list of blocks.
+    """
+    blocks = []
+    offset = 0
+
+    while offset < len(f_data):
+        assert f_data[offset:(offset + 4)] == b'\x1f\x8b\x08\x04'
+        assert f_data[(offset + 12):(offset + 14)] == b'BC'
+
+        block_size = unpack_from('<H', f_data, offset + 16)[0] + 1
+
+        blocks.append(f_data[offset:(offset + block_size)])
+        offset += block_size
+
+    return blocks
+
+
+def test_bgzf_readable_by_gzip(tmp_path):
+    """
+    The data written in BGZF are read back by gzip, block by block, and end with the EOF block.
+    """
+    rng = default_rng(5)
+
+    data = bytes(rng.integers(65, 69, BGZF_BLOCK_SIZE * 3 + 1234, dtype='u1'))
+
+    for threads in (1, 3):
+        with BgzfWriter(str(tmp_path / 'data.gz'), threads) as OU:
+            for i in range(0, len(data), 10000):
+                OU.write(data[i:(i + 10000)])
+
+        with open(tmp_path / 'data.gz', 'rb') as IN:
+            compressed = IN.read()
+
+        assert decompress(compressed) == data
+        assert compressed.endswith(BGZF_EOF)
+
+        blocks = __blocks(compressed)
+
+        assert blocks[-1] == BGZF_EOF
+        assert [len(decompress(_)) for _ in blocks] == [BGZF_BLOCK_SIZE] * 3 + [1234, 0]
+
+
+def test_empty_bgzf(tmp_path):
+    """
+    An empty file holds the EOF block only.
+    """
+    BgzfWriter(str(tmp_path / 'empty.gz')).close()
+
+    with open(tmp_path / 'empty.gz', 'rb') as IN:
+        assert IN.read() == BGZF_EOF
+
+
+def test_reads_in_fastq_and_sam(tmp_path):
+    """
+    The reads are exported with their coordinates and genes as tags.
+    """
+    reads = [['r00387c00616', 'AAGC', '+,I0', 387, 616, 'gene_1', 0],
+             ['r00001c00002', 'NTCG', '!III', 1, 2, 'NA', -1]]
+
+    write_reads_into_fastq(reads, str(tmp_path / 'reads.fastq.gz'))
+    write_reads_into_sam(reads, str(tmp_path / 'reads.sam.gz'))
+
+    with open_gzip(tmp_path / 'reads.fastq.gz', 'rt') as IN:
+        fastq = IN.read().split('\n')
+
+    assert fastq[0].split('\t')[:3] == ['@r00387c00616', 'XR:i:387', 'XC:i:616']
+    assert fastq[1:4] == ['AAGC', '+', '+,I0']
+    assert 'XG:Z:gene_1' in fastq[0].split('\t')
+
+    with open_gzip(tmp_path / 'reads.sam.gz', 'rt') as IN:
+        sam = [_.split('\t') for _ in IN.read().split('\n') if _ != '' and not _.startswith('@')]
+
+    assert [_[0] for _ in sam] == ['r00387c00616', 'r00001c00002']
+    assert [_[9] for _ in sam] == ['AAGC', 'NTCG']
+    assert [_[10] for _ in sam] == ['+,I0', '!III']
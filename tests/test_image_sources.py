@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+This model is used to test reading the regions of TIFF images lazily, against the whole images read by OpenCV, and
+projecting the focal planes of z-stacks, and the cycles read ahead.
+"""
+
+
+from cv2 import (imread, imwrite, imwritemulti, imreadmulti, GaussianBlur, IMREAD_GRAYSCALE, IMWRITE_TIFF_COMPRESSION)
+from numpy import (arange, full, maximum, uint8, uint16, array_equal)
+from numpy.random import default_rng
+
+from IRIS.image_sources import (project_planes, read_channel, TiffPages, CycleStacks, open_cycles, CyclePrefetcher)
+
+
+REGIONS = (None, (0, 1, 0, 1), (13, 77, 5, 120), (90, 300, 100, 400), (0, 143, 0, 211), (140, 143, 200, 211))
+
+
+def __random_image(f_rng, f_dtype):
+    """
+    For drawing a random image, a gradient with noise, so that it is compressed a little.
+
+    :param f_rng: The random generator.
+    :param f_dtype: The data type of pixels, uint8 or uint16.
+    :return: The image matrix of 143x211.
+    """
+    top = 255 if f_dtype == uint8 else 65535
+
+    gradient = arange(0, 211) * (top / 2 / 211)
+
+    return (gradient + f_rng.integers(0, top // 4, (143, 211))).astype(f_dtype)
+
+
+def test_read_region_equals_imread(tmp_path):
+    """
+    A region read from a page is the same as the region cropped from the whole image read by OpenCV, for 8 and 16 bits
+    with and without compression.
+    """
+    rng = default_rng(6)
+
+    for dtype in (uint8, uint16):
+        for compression in (1, 5, 8, 32946):
+            image_file = str(tmp_path / ('%s.%d.tif' % (dtype.__name__, compression)))
+
+            imwrite(image_file, __random_image(rng, dtype), (IMWRITE_TIFF_COMPRESSION, compression))
+
+            whole = imread(image_file, IMREAD_GRAYSCALE)
+            pages = TiffPages(image_file)
+
+            assert pages.page_num == 1
+
+            for region in REGIONS:
+                expected = whole if region is None else whole[region[0]:region[1], region[2]:region[3]]
+
+                assert (pages.read(0, region) == expected).all()
+                assert pages.read(0, region).shape == expected.shape
+
+
+def test_read_pages(tmp_path):
+    """
+    Each page of a multi-page TIFF is read as OpenCV reads it.
+    """
+    rng = default_rng(8)
+
+    images = [__random_image(rng, uint8) for _ in range(0, 3)]
+
+    imwritemulti(str(tmp_path / 'stack.tif'), images)
+
+    _, planes = imreadmulti(str(tmp_path / 'stack.tif'), flags=IMREAD_GRAYSCALE)
+    pages = TiffPages(str(tmp_path / 'stack.tif'))
+
+    assert pages.page_num == 3
+
+    for page_id in range(0, 3):
+        assert (pages.read(page_id) == planes[page_id]).all()
+        assert (pages.read(page_id, (20, 100, 30, 90)) == planes[page_id][20:100, 30:90]).all()
+
+
+def test_project_planes(tmp_path):
+    """
+    The max projection keeps the maximum of each pixel, and the focus projection keeps the sharpest plane, for the
+    planes given and the ones read from a multi-page TIFF.
+    """
+    rng = default_rng(4)
+
+    sharp = rng.integers(0, 256, (60, 80)).astype(uint8)
+    planes = [GaussianBlur(sharp, (9, 9), 3), sharp, GaussianBlur(sharp, (5, 5), 1)]
+
+    projected = project_planes(_.copy() for _ in planes)
+
+    assert array_equal(projected, maximum(maximum(planes[0], planes[1]), planes[2]))
+
+    assert array_equal(project_planes(iter(planes), 'focus'), sharp)
+    assert project_planes(iter([])) is None
+
+    imwritemulti(str(tmp_path / 'stack.tif'), planes)
+    imwrite(str(tmp_path / 'plane.tif'), sharp)
+
+    assert array_equal(read_channel(str(tmp_path / 'stack.tif')), projected)
+    assert array_equal(read_channel(str(tmp_path / 'stack.tif'), 'focus'), sharp)
+    assert array_equal(read_channel(str(tmp_path / 'plane.tif'), 'focus'),
+                       imread(str(tmp_path / 'plane.tif'), IMREAD_GRAYSCALE))
+
+
+def test_cycle_stacks(tmp_path):
+    """
+    The pages of stacks without any description are taken as the channels of cycles one by one, across the stacks.
+    """
+    rng = default_rng(10)
+
+    channels = ('Y5.tif', 'FAM.tif', 'TXR.tif', 'Y3.tif')
+    images = [[__random_image(rng, uint8) for _ in channels] for _ in range(0, 3)]
+
+    imwritemulti(str(tmp_path / 'cycles_1_2.tif'), images[0] + images[1])
+    imwritemulti(str(tmp_path / 'cycle_3.tif'), images[2])
+
+    stacks = open_cycles([str(tmp_path / 'cycles_1_2.tif'), str(tmp_path / 'cycle_3.tif')], channels,
+                         (20, 100, 30, 90))
+
+    assert isinstance(stacks, CycleStacks) and stacks.cycle_num == 3
+    assert [stacks.file_num(_) for _ in range(0, 5)] == [0, 1, 1, 2, 2]
+
+    for cycle_id in range(0, 3):
+        for channel_id, channel in enumerate(channels):
+            assert array_equal(stacks.read(cycle_id, channel), images[cycle_id][channel_id][20:100, 30:90])
+
+
+class __CycleSource:
+    def __init__(self, f_cycle_num):
+        """
+        This method will initialize a source of cycles, whose channels are 100 bytes each.
+
+        :param f_cycle_num: The number of cycles.
+        """
+        self.cycle_num = f_cycle_num
+
+    def read(self, f_cycle_id, f_channel, f_projection=None):
+        """
+        This method is used to read a channel, whose pixels are the index of cycle.
+        """
+        return full((10, 10), f_cycle_id, dtype=uint8)
+
+
+def __read_cycles(f_depth, f_memory, f_cycle_ids, f_requested):
+    """
+    For reading cycles by a prefetcher, and collecting the ones read ahead.
+
+    :param f_depth: The number of cycles read ahead.
+    :param f_memory: The bytes of memory for the cycles read ahead.
+    :param f_cycle_ids: The indices of cycles in the order to read.
+    :param f_requested: The indices of cycles requested.
+    :return: The sorted indices of cycles read ahead but not requested yet.
+    """
+    with CyclePrefetcher(__CycleSource(6), ['Y5.tif', 'FAM.tif'], f_depth=f_depth, f_memory=f_memory,
+                         f_cycle_ids=f_cycle_ids) as prefetcher:
+        for cycle_id in f_requested:
+            channels = prefetcher.read(cycle_id)
+
+            assert sorted(channels) == ['FAM.tif', 'Y5.tif'] and (channels['Y5.tif'] == cycle_id).all()
+
+        return sorted(getattr(prefetcher, '_CyclePrefetcher__cycles'))
+
+
+def test_cycle_prefetcher():
+    """
+    The cycles are read ahead in the order given, up to the depth, and no more than the memory holds.
+    """
+    assert __read_cycles(2, None, None, []) == [0]
+    assert __read_cycles(2, None, None, [0]) == [1, 2]
+    assert __read_cycles(2, None, None, [0, 1, 2]) == [3, 4]
+    assert __read_cycles(2, None, None, [4, 5]) == [0]
+    assert __read_cycles(3, 450, None, [0]) == [1, 2]
+    assert __read_cycles(3, 100, None, [0]) == []
+    assert __read_cycles(1, None, [4, 2, 5], [4]) == [2]
+    assert __read_cycles(0, None, None, [3, 1]) == []
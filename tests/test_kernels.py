@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the kernels of NumPy (and Numba if it is installed) against the loop kernels run in Python.
+"""
+
+
+from numpy import (asarray, argsort, where, maximum, array_equal, uint8, int64, float64)
+from numpy.random import default_rng
+import pytest
+
+from IRIS.kernels import (set_backend, box_sums, box_sums_loop, blob_scores, search_min_error, search_min_error_loop)
+
+
+def __blobs(f_rng, f_num, f_height, f_width):
+    """
+    For drawing blobs around and across the borders of images.
+
+    :param f_rng: The random generator.
+    :param f_num: The number of blobs.
+    :param f_height: The height of images.
+    :param f_width: The width of images.
+    :return: A tuple of rows and columns of blobs.
+    """
+    return f_rng.integers(-6, f_height + 6, f_num).astype(int64), f_rng.integers(-6, f_width + 6, f_num).astype(int64)
+
+
+def __search_loop(f_base_rows, f_base_cols, f_error_rates, f_ref_rows, f_ref_cols, f_search_region):
+    """
+    For searching the bases by the loop kernel run in Python, on the keys sorted as 'search_min_error' does.
+
+    :return: A tuple of the index of chosen base of each reference blob, and its adjusted error rate.
+    """
+    stride = int(f_base_cols.max()) + 1
+
+    keys = f_base_rows * stride + f_base_cols
+    order = argsort(keys, kind='stable')
+
+    chosen, min_error_rates = search_min_error_loop(keys[order], f_error_rates[order], f_ref_rows, f_ref_cols,
+                                                    f_search_region, stride, 2.0)
+
+    return where(chosen >= 0, order[maximum(chosen, 0)], -1), min_error_rates
+
+
+@pytest.mark.parametrize('f_backend', ['numpy', 'numba'])
+def test_kernels(f_backend):
+    """
+    The box sums, the base scores and the bases searched are the same as the loops bit for bit.
+    """
+    if f_backend == 'numba':
+        pytest.importorskip('numba')
+
+    set_backend(f_backend)
+
+    rng = default_rng(21)
+
+    try:
+        images = rng.integers(0, 256, (4, 40, 60)).astype(uint8)
+        rows, cols = __blobs(rng, 500, 40, 60)
+
+        for (offset, size), sums in zip([(-1, 4), (-4, 10), (0, 1)], box_sums(images, rows, cols,
+                                                                              [(-1, 4), (-4, 10), (0, 1)])):
+            assert array_equal(sums, box_sums_loop(images, rows, cols, offset, size))
+
+        core_sums = box_sums_loop(images, rows, cols, -1, 4)
+        surround_sums = box_sums_loop(images, rows, cols, -4, 10)
+
+        assert array_equal(blob_scores(list(images), rows, cols, (-1, 4), (-4, 10)),
+                           core_sums / 16 - surround_sums / 100)
+
+        ##############################################################################
+        # The bases are drawn densely, so that a region has several candidates, and  #
+        # a few of them share the coordinates of others                              #
+        ##############################################################################
+        base_rows = rng.integers(0, 30, 300).astype(int64)
+        base_cols = rng.integers(0, 30, 300).astype(int64)
+        error_rates = rng.choice(asarray([0.01, 0.05, 0.2, 0.5, 0.9]), 300).astype(float64)
+        ref_rows, ref_cols = __blobs(rng, 200, 30, 30)
+        ##############################################################################
+
+        for search_region in (0, 1, 2):
+            chosen, min_error_rates = search_min_error(base_rows, base_cols, error_rates, ref_rows, ref_cols,
+                                                       search_region, 7)
+            expected_chosen, expected_error_rates = __search_loop(base_rows, base_cols, error_rates, ref_rows,
+                                                                  ref_cols, search_region)
+
+            assert (chosen >= 0).sum() > 0
+            assert array_equal(chosen, expected_chosen) and array_equal(min_error_rates, expected_error_rates)
+
+        chosen, min_error_rates = search_min_error([], [], [], ref_rows, ref_cols, 2)
+
+        assert (chosen == -1).all() and (min_error_rates == 1).all()
+
+    finally:
+        set_backend()
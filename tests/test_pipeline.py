@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the pipeline on the images simulated by 'IRIS.simulate_images', so that no private data is
+needed.
+"""
+
+
+from sys import executable
+from json import load
+from subprocess import run
+from os import (listdir, remove)
+from os.path import (join, dirname, abspath)
+import pytest
+
+from IRIS.simulate_images import simulate_images
+from IRIS.pipeline import (Pipeline, PipelineConfig)
+
+
+def __run_summary(f_output_dir):
+    """
+    For reading the statistics of cycles written by a run.
+
+    :param f_output_dir: The directory of output.
+    :return: A list of the statistics of each cycle.
+    """
+    with open(join(f_output_dir, 'basecalling_summary.json'), 'rt') as IN:
+        return load(IN)['cycles']
+
+
+def test_config():
+    """
+    The parameters are converted into their types, and the invalid ones stop the run.
+    """
+    config = PipelineConfig('--KE', 'brisk', f_search_region='3', f_formats=['FASTQ'], f_region='10,20,30,40',
+                            f_resume=True)
+
+    assert (config.mode, config.registration, config.search_region, config.formats, config.region) == \
+        ('ke', 'BRISK', 3, ['fastq'], (10, 20, 30, 40))
+    assert config.checkpoint and config.prefetch == 1 and config.processes == 1
+
+    for kwargs in ({'f_mode': 'merfish'}, {'f_registration': 'SIFT'}, {'f_formats': ['bam']},
+                   {'f_formats': ['matrix']}, {'f_region': '20,10,30,40'}, {'f_processes': 0},
+                   {'f_prune': True}, {'f_mode': 'chen', 'f_tissue_mask': True}):
+        with pytest.raises(SystemExit):
+            PipelineConfig(**kwargs)
+
+
+def test_hooks_and_command_line(tmp_path):
+    """
+    The hooks are called in the order of stages with the FOV, and could replace the results, while the reads written
+    are the same as the ones written by the command line.
+    """
+    simulate_images(str(tmp_path / 'images'), 200, 200, f_cycle_num=3, f_density=800, f_seed=5)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 4)]
+
+    calls = []
+
+    def __hook(f_stage):
+        def __record(f_fov, f_result):
+            calls.append((f_stage, f_fov['cycles'], f_fov['output_dir']))
+
+            return f_result[:5] if f_stage == 'output' else None
+
+        return __record
+
+    pipeline = Pipeline(PipelineConfig('ke'))
+
+    for stage in ('output', 'connection', 'detection', 'import'):
+        pipeline.add_hook(stage, __hook(stage))
+
+    with pytest.raises(SystemExit):
+        pipeline.add_hook('stitching', __hook('stitching'))
+
+    reads = pipeline.run(cycles, str(tmp_path / 'pipeline'))
+
+    assert calls == [(_, cycles, str(tmp_path / 'pipeline')) for _ in ('import', 'detection', 'connection', 'output')]
+    assert len(reads) == 5
+
+    result = run([executable, join(dirname(dirname(abspath(__file__))), 'pyIRIS.py'), '--ke'] + cycles +
+                 ['--output', str(tmp_path / 'command_line')], capture_output=True, text=True)
+
+    assert result.returncode == 0
+
+    with open(tmp_path / 'pipeline' / 'basecalling_data.txt', 'rt') as IN:
+        pipeline_lines = IN.readlines()
+
+    with open(tmp_path / 'command_line' / 'basecalling_data.txt', 'rt') as IN:
+        command_line_lines = IN.readlines()
+
+    ##################################################################
+    # The reads are written in the order of a set, which is hashed   #
+    # differently in each process                                    #
+    ##################################################################
+    assert len(pipeline_lines) > 5 and sorted(pipeline_lines) == sorted(command_line_lines)
+    ##################################################################
+
+
+def test_resume_from_checkpoints(tmp_path):
+    """
+    A resumed run gives the same reads, and skips the stages (and their hooks) loaded from checkpoints.
+    """
+    simulate_images(str(tmp_path / 'images'), 200, 200, f_cycle_num=4, f_density=800, f_seed=11)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 5)]
+
+    stages = []
+
+    pipeline = Pipeline(PipelineConfig('ke', f_checkpoint=True))
+
+    for stage in ('import', 'detection', 'connection', 'output'):
+        pipeline.add_hook(stage, lambda f_fov, f_result, f_stage=stage: stages.append(f_stage))
+
+    reads = pipeline.run(cycles, str(tmp_path / 'run'))
+
+    assert stages == ['import', 'detection', 'connection', 'output']
+    assert sorted(listdir(tmp_path / 'run' / 'checkpoint')) == \
+        ['connection.pkl'] + ['detection.cycle_%d.pkl' % _ for _ in range(1, 5)] + \
+        ['filtering.pkl', 'manifest.json', 'registration.pkl']
+
+    del stages[:]
+
+    assert sorted(pipeline.run(cycles, str(tmp_path / 'run'), True)) == sorted(reads)
+    assert stages == ['output']
+
+    ##################################################################
+    # Without the barcode cube, the run is resumed from detection    #
+    ##################################################################
+    remove(tmp_path / 'run' / 'checkpoint' / 'connection.pkl')
+    remove(tmp_path / 'run' / 'checkpoint' / 'filtering.pkl')
+
+    del stages[:]
+
+    assert sorted(pipeline.run(cycles, str(tmp_path / 'run'), True)) == sorted(reads)
+    assert stages == ['connection', 'output']
+    ##################################################################
+
+    ##################################################################
+    # The checkpoints of other parameters are discarded              #
+    ##################################################################
+    del stages[:]
+
+    pipeline = Pipeline(PipelineConfig('ke', f_search_region='3', f_resume=True))
+
+    for stage in ('import', 'detection', 'connection', 'output'):
+        pipeline.add_hook(stage, lambda f_fov, f_result, f_stage=stage: stages.append(f_stage))
+
+    pipeline.run(cycles, str(tmp_path / 'run'))
+
+    assert stages == ['import', 'detection', 'connection', 'output']
+    ##################################################################
+
+
+def test_prune_keeps_decoded_reads(tmp_path):
+    """
+    The blobs pruned by the prefixes of codewords are never decoded, thus the decoded reads are the same as the ones
+    of a run without pruning.
+    """
+    simulate_images(str(tmp_path / 'images'), 200, 200, f_cycle_num=6, f_density=800, f_gene_num=20, f_seed=13)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 7)]
+    codebook = str(tmp_path / 'images' / 'barcode_info.txt')
+
+    reads = Pipeline(PipelineConfig('ke', f_codebook=codebook)).run(cycles, str(tmp_path / 'full'))
+    pruned_reads = Pipeline(PipelineConfig('ke', f_codebook=codebook, f_prune=True)).run(cycles,
+                                                                                         str(tmp_path / 'pruned'))
+
+    decoded_reads = sorted(_ for _ in reads if _[5] != 'NA')
+
+    assert len(decoded_reads) > 0 and len(pruned_reads) < len(reads)
+    assert sorted(_ for _ in pruned_reads if _[5] != 'NA') == decoded_reads
+
+
+def test_append_equals_full_run(tmp_path):
+    """
+    The cycles appended to a run with checkpoints give the same reads and statistics as all the cycles run at once.
+    """
+    simulate_images(str(tmp_path / 'images'), 300, 300, f_cycle_num=5, f_density=800, f_seed=7)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 6)]
+
+    pipeline = Pipeline(PipelineConfig('ke', f_checkpoint=True))
+
+    full_reads = pipeline.run(cycles, str(tmp_path / 'full'))
+
+    pipeline.run(cycles[:3], str(tmp_path / 'append'))
+    appended_reads = pipeline.append(cycles[3:], str(tmp_path / 'append'))
+
+    assert len(full_reads) > 0
+    assert sorted(appended_reads) == sorted(full_reads)
+
+    with open(join(tmp_path / 'full', 'basecalling_data.txt'), 'rt') as IN:
+        full_lines = sorted(IN)
+
+    with open(join(tmp_path / 'append', 'basecalling_data.txt'), 'rt') as IN:
+        appended_lines = sorted(IN)
+
+    assert appended_lines == full_lines
+
+    full_cycles = __run_summary(str(tmp_path / 'full'))
+    appended_cycles = __run_summary(str(tmp_path / 'append'))
+
+    assert appended_cycles == full_cycles
+    assert all(_['registration'] and _['detection'] for _ in appended_cycles)
+
+
+def test_resume_keeps_statistics(tmp_path):
+    """
+    A run resumed from the checkpoints of all its stages gives the same reads, and keeps the statistics of cycles.
+    """
+    simulate_images(str(tmp_path / 'images'), 200, 200, f_cycle_num=4, f_density=800, f_seed=11)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 5)]
+
+    pipeline = Pipeline(PipelineConfig('ke', f_checkpoint=True))
+
+    reads = pipeline.run(cycles, str(tmp_path / 'run'))
+    run_cycles = __run_summary(str(tmp_path / 'run'))
+
+    resumed_reads = pipeline.run(cycles, str(tmp_path / 'run'), True)
+
+    assert sorted(resumed_reads) == sorted(reads)
+    assert __run_summary(str(tmp_path / 'run')) == run_cycles
+    assert all(_['registration'] and _['detection'] for _ in run_cycles)
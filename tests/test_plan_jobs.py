@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the planner of jobs, on the headers of images written by OpenCV and a BigTIFF built by hand.
+"""
+
+
+from os import makedirs
+from os.path import join
+from struct import pack
+from numpy import (zeros, uint8, uint16)
+from cv2 import (imwrite, imwritemulti, IMWRITE_TIFF_COMPRESSION)
+
+from IRIS.plan_jobs import (read_tiff_header, collect_fovs, summarize_fovs, estimate_stages, recommend)
+
+
+def test_read_tiff_header(tmp_path):
+    """
+    The dimensions, bit depth, compression and pages are parsed from classic TIFF and BigTIFF.
+    """
+    imwrite(str(tmp_path / '8.tif'), zeros((30, 50), dtype=uint8), [IMWRITE_TIFF_COMPRESSION, 1])
+    imwrite(str(tmp_path / '16.tif'), zeros((300, 70), dtype=uint16), [IMWRITE_TIFF_COMPRESSION, 5])
+    imwritemulti(str(tmp_path / 'pages.tif'), [zeros((20, 10), dtype=uint8)] * 3)
+
+    ###########################################################################
+    # A BigTIFF of one page, whose width is a SHORT, and height is a LONG     #
+    ###########################################################################
+    with open(tmp_path / 'big.tif', 'wb') as OU:
+        OU.write(b'II' + pack('<HHHQ', 43, 8, 0, 16))
+        OU.write(pack('<Q', 3))
+        OU.write(pack('<HHQHHI', 256, 3, 1, 300, 0, 0))
+        OU.write(pack('<HHQI4x', 257, 4, 1, 70000))
+        OU.write(pack('<HHQHHI', 258, 3, 1, 16, 0, 0))
+        OU.write(pack('<Q', 0))
+    ###########################################################################
+
+    header = read_tiff_header(str(tmp_path / '8.tif'))
+
+    assert (header['width'], header['height'], header['bits'], header['samples'], header['compression'],
+            header['pages']) == (50, 30, 8, 1, 'none', 1)
+
+    header = read_tiff_header(str(tmp_path / '16.tif'))
+
+    assert (header['width'], header['height'], header['bits'], header['compression']) == (70, 300, 16, 'lzw')
+
+    assert read_tiff_header(str(tmp_path / 'pages.tif'))['pages'] == 3
+
+    header = read_tiff_header(str(tmp_path / 'big.tif'))
+
+    assert (header['width'], header['height'], header['bits'], header['pages']) == (300, 70000, 16, 1)
+
+
+def test_plan(tmp_path):
+    """
+    The cycles are grouped into FOVs, the time of connection is linear in blobs, and the plan fits the budget.
+    """
+    for fov in ('fov_1', 'fov_2'):
+        for cycle in ('1', '2', '10'):
+            makedirs(tmp_path / fov / cycle)
+
+            imwrite(str(tmp_path / fov / cycle / 'STORM.tif'), zeros((400, 600), dtype=uint8))
+
+    fovs = collect_fovs('--chen', [str(tmp_path / 'fov_1'), str(tmp_path / 'fov_2' / '1'),
+                                   str(tmp_path / 'fov_2' / '2')])
+
+    assert fovs == [[join(str(tmp_path / 'fov_1'), _) for _ in ('1', '2', '10')],
+                    [str(tmp_path / 'fov_2' / '1'), str(tmp_path / 'fov_2' / '2')]]
+
+    summary = summarize_fovs('--chen', fovs, {join(cycle, 'STORM.tif'): read_tiff_header(join(cycle, 'STORM.tif'))
+                                              for fov in fovs for cycle in fov})
+
+    assert (summary['height'], summary['width'], summary['cycles'], summary['fovs']) == (400, 600, 3, 2)
+
+    stages = dict((_[0], _[1:]) for _ in estimate_stages('--chen', summary, 1000))
+    dense_stages = dict((_[0], _[1:]) for _ in estimate_stages('--chen', summary, 2000))
+
+    assert abs(dense_stages['connect'][1] - stages['connect'][1] * 2) < 1e-9
+
+    plan = recommend('--chen', summary, 2 ** 30, 4, 1000)
+
+    assert plan['peak_memory'] <= 2 ** 30 and plan['workers'] <= 4
+    assert recommend('--chen', summary, 2 ** 20, 4, 1000) is None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the records of stages by the profiler.
+"""
+
+
+from os import listdir
+from json import load
+from time import sleep
+from numpy import ones
+
+from IRIS.profiler import Profiler
+
+
+def test_nested_stages(tmp_path):
+    """
+    The nested stages belong to the cycle of their parent, their times and memory are within the parent, and the
+    cProfile dumps are only written for top-level stages.
+    """
+    profiler = Profiler()
+
+    profiler.begin('ignored')
+    profiler.count('ignored', 1)
+    profiler.end()
+
+    assert profiler.records == []
+
+    profiler.enable(str(tmp_path / 'cprofile'))
+
+    with profiler.stage('detection', 2):
+        profiler.count('blobs', 10)
+
+        with profiler.stage('tophat'):
+            sleep(0.05)
+
+            buffer = ones(50 * 2 ** 20, dtype='uint8')
+
+            del buffer
+
+        profiler.begin('scoring', 3)
+        profiler.end()
+
+    profiler.begin('output')
+    profiler.end()
+
+    detection, tophat, scoring, output = profiler.records
+
+    assert [(_['stage'], _['cycle'], _['parent']) for _ in profiler.records] == \
+        [('detection', 2, None), ('tophat', 2, 'detection'), ('scoring', 3, 'detection'), ('output', None, None)]
+
+    assert detection['counts'] == {'blobs': 10} and tophat['counts'] == {}
+    assert detection['wall_time'] >= tophat['wall_time'] + scoring['wall_time'] and tophat['wall_time'] >= 0.05
+    assert detection['peak_rss'] >= tophat['peak_rss'] >= 50 * 2 ** 20
+
+    assert sorted(listdir(tmp_path / 'cprofile')) == ['003.detection.cycle_2.prof', '004.output.prof']
+
+    profiler.write(str(tmp_path / 'profile.json'))
+
+    with open(tmp_path / 'profile.json', 'rt') as IN:
+        report = load(IN)
+
+    assert [_['stage'] for _ in report['stages']] == ['detection', 'tophat', 'scoring', 'output']
+    assert abs(report['total']['wall_time'] - detection['wall_time'] - output['wall_time']) < 1e-9
+    assert report['total']['peak_rss'] == detection['peak_rss']
+
+
+def test_merge_records():
+    """
+    The records of another process are added only if the profiler is enabled.
+    """
+    worker = Profiler()
+    worker.enable()
+
+    with worker.stage('detection', 1):
+        pass
+
+    profiler = Profiler()
+    profiler.merge(worker.records)
+
+    assert profiler.records == []
+
+    profiler.enable()
+    profiler.merge(worker.records)
+
+    assert profiler.records == worker.records
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the rendering of reads over the background, against stamping the reads one by one.
+"""
+
+
+from numpy import (array, uint8, array_equal)
+from numpy.random import default_rng
+from cv2 import (imwrite, cvtColor, COLOR_GRAY2BGR)
+
+from IRIS.render_reads import (load_reads, read_colors, render_reads, BASE_COLOR)
+from IRIS.tiled_mosaic import TiledMosaic
+
+
+def __stamp(f_img, f_rows, f_cols, f_colors, f_radius):
+    """
+    For stamping the reads one by one, pixel by pixel, in the order of reads.
+
+    :param f_img: The color image, which is stamped in place.
+    :param f_rows: Row coordinates of reads in the image.
+    :param f_cols: Column coordinates of reads in the image.
+    :param f_colors: A matrix of BGR colors of reads.
+    :param f_radius: The radius of discs.
+    :return: The stamped image.
+    """
+    for row, col, color in zip(f_rows, f_cols, f_colors):
+        for dr in range(-f_radius, f_radius + 1):
+            for dc in range(-f_radius, f_radius + 1):
+                if dr ** 2 + dc ** 2 <= f_radius ** 2 and 0 <= row + dr < f_img.shape[0] and \
+                        0 <= col + dc < f_img.shape[1]:
+                    f_img[row + dr, col + dc] = color
+
+    return f_img
+
+
+def test_load_reads(tmp_path):
+    """
+    The reads are loaded by columns, and filtered by 'N' bases and by the mean quality.
+    """
+    with open(tmp_path / 'basecalling_data.txt', 'wt') as OU:
+        print('#ID\tSEQ\tQUAL\tROW\tCOL', file=OU)
+        print('r00001c00002\tACGT\tIIII\t00001\t00002', file=OU)
+        print('r00003c00004\tACNT\tIIII\t00003\t00004', file=OU)
+        print('r00005c00006\tTTTT\t####\t00005\t00006', file=OU)
+
+    assert load_reads(str(tmp_path / 'basecalling_data.txt')) == \
+        [['r00001c00002', 'r00003c00004', 'r00005c00006'], ['ACGT', 'ACNT', 'TTTT'], ['IIII', 'IIII', '####'],
+         ['00001', '00003', '00005'], ['00002', '00004', '00006']]
+    assert load_reads(str(tmp_path / 'basecalling_data.txt'), True, 20) == \
+        [['r00001c00002'], ['ACGT'], ['IIII'], ['00001'], ['00002']]
+
+    assert [_.tolist() for _ in read_colors(['ACGT', 'TC'], f_color_by='base', f_cycle=3)] == \
+        [list(BASE_COLOR['G']), list(BASE_COLOR['N'])]
+    assert read_colors(['AAAA', 'CCCC', 'AAAA'], ['gene_1', 'gene_2', 'gene_1'], 'gene')[[0, 2]].tolist() == \
+        [read_colors(['TTTT'], ['gene_1'], 'gene')[0].tolist()] * 2
+
+
+def test_render_reads(tmp_path):
+    """
+    The reads stamped at once are the same as the ones stamped one by one, over an image or a pyramid, in a region and
+    across the borders of image.
+    """
+    rng = default_rng(14)
+
+    background = rng.integers(0, 256, (150, 220)).astype(uint8)
+
+    imwrite(str(tmp_path / 'background.tif'), background)
+
+    mosaic = TiledMosaic(str(tmp_path / 'pyramid'), background.shape, 64)
+    mosaic.write_region(0, 0, background)
+    mosaic.build_pyramid()
+
+    rows = rng.integers(-3, 153, 400)
+    cols = rng.integers(-3, 223, 400)
+    colors = rng.integers(0, 256, (400, 3)).astype(uint8)
+
+    for radius in (0, 1, 3):
+        expected = __stamp(cvtColor(background, COLOR_GRAY2BGR), rows, cols, colors, radius)
+
+        assert array_equal(render_reads(str(tmp_path / 'background.tif'), rows, cols, colors, f_radius=radius),
+                           expected)
+        assert array_equal(render_reads(str(tmp_path / 'pyramid'), rows, cols, colors, f_radius=radius), expected)
+
+        region = __stamp(cvtColor(background[40:100, 50:200], COLOR_GRAY2BGR), rows - 40, cols - 50, colors, radius)
+
+        assert array_equal(render_reads(str(tmp_path / 'pyramid'), rows, cols, colors, (40, 100, 50, 200),
+                                        f_radius=radius), region)
+
+    overview = render_reads(str(tmp_path / 'pyramid'), array([0, 149]), array([0, 219]), colors[0:2], f_level=1,
+                            f_radius=0)
+
+    assert overview.shape == (75, 110, 3)
+    assert overview[0, 0].tolist() == colors[0].tolist() and overview[74, 109].tolist() == colors[1].tolist()
+
+    assert array_equal(render_reads(str(tmp_path / 'background.tif'), [], [], []), cvtColor(background, COLOR_GRAY2BGR))
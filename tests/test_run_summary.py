@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the summary of run, against the bases and qualities counted read by read.
+"""
+
+
+from json import load
+from numpy.random import default_rng
+
+from IRIS.run_summary import (RunSummary, BASES, MAX_QUALITY)
+
+
+def test_summary_of_reads(tmp_path):
+    """
+    The bases and qualities counted chunk by chunk are the same as the ones counted read by read, including the reads
+    shorter than the cycles.
+    """
+    rng = default_rng(3)
+
+    reads = []
+
+    for read_id in range(0, 300):
+        length = int(rng.choice([4, 4, 4, 2]))
+
+        reads.append(['r%05dc%05d' % (read_id, read_id), ''.join(rng.choice(list(BASES), length)),
+                      ''.join(chr(33 + _) for _ in rng.integers(0, 45, length)), read_id, read_id,
+                      'gene_1' if read_id % 3 else 'NA', 0])
+
+    run_summary = RunSummary(4)
+    run_summary.add_registration({0: {'matches': 10}, 2: {'matches': 8}})
+    run_summary.add_detection(1, {'blobs': 100})
+    run_summary.add_blob_qc({'dete_blobs': 5})
+
+    for start in range(0, len(reads), 70):
+        run_summary.add_reads(reads[start:(start + 70)])
+
+    summary = run_summary.write(str(tmp_path / 'basecalling_summary'))
+
+    assert summary['reads'] == {'reads': 300, 'reads_without_N': sum(1 for _ in reads if 'N' not in _[1]),
+                                'decoded_reads': sum(1 for _ in reads if _[5] != 'NA')}
+    assert summary['blob_qc'] == {'dete_blobs': 5}
+
+    assert summary['cycles'][0]['registration'] == {'matches': 10} and summary['cycles'][1]['registration'] == {}
+    assert summary['cycles'][1]['detection'] == {'blobs': 100}
+
+    for cycle_id, cycle in enumerate(summary['cycles']):
+        bases = [_[1][cycle_id] for _ in reads if len(_[1]) > cycle_id]
+        qualities = [min(ord(_[2][cycle_id]) - 33, MAX_QUALITY) for _ in reads if len(_[2]) > cycle_id]
+
+        assert cycle['bases'] == {_: bases.count(_) for _ in BASES}
+        assert cycle['N_rate'] == bases.count('N') / len(bases)
+        assert cycle['quality_histogram'] == [qualities.count(_) for _ in range(0, MAX_QUALITY + 1)]
+        assert abs(cycle['mean_quality'] - sum(qualities) / len(qualities)) < 1e-9
+
+    with open(tmp_path / 'basecalling_summary.json', 'rt') as IN:
+        assert load(IN) == summary
+
+    with open(tmp_path / 'basecalling_summary.html', 'rt') as IN:
+        assert '<html' in IN.read()
+
+    ##################################################################
+    # Without genes, the decoded reads are not counted               #
+    ##################################################################
+    run_summary = RunSummary(4)
+    run_summary.add_reads([_[:5] for _ in reads])
+
+    assert 'decoded_reads' not in run_summary.summary()['reads']
+    ##################################################################
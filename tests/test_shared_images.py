@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the images shared between processes, and the cycles detected in parallel against the ones
+detected one by one.
+"""
+
+
+from numpy import (arange, uint8, array_equal)
+import pytest
+
+from IRIS.shared_images import (SharedStack, attach_stack)
+from IRIS.simulate_images import simulate_images
+from IRIS.pipeline import (Pipeline, PipelineConfig)
+
+
+def test_shared_stack():
+    """
+    The images copied into a block are mapped read-only by their descriptor, and the block is removed once released.
+    """
+    cycle_stack = [[arange(0, 12, dtype=uint8).reshape(3, 4) + 12 * (cycle * 2 + channel) for channel in range(0, 2)]
+                   for cycle in range(0, 3)]
+
+    with SharedStack(cycle_stack) as shared_stack:
+        descriptor = shared_stack.descriptor
+
+        assert descriptor['shape'] == (3, 2, 3, 4)
+
+        memory, stack = attach_stack(descriptor)
+
+        assert all(array_equal(stack[cycle, channel], cycle_stack[cycle][channel]) for cycle in range(0, 3)
+                   for channel in range(0, 2))
+
+        with pytest.raises(ValueError):
+            stack[0, 0, 0, 0] = 0
+
+        del stack
+        memory.close()
+
+    with pytest.raises(FileNotFoundError):
+        attach_stack(descriptor)
+
+    ##################################################################
+    # The images of different shapes could not be shared             #
+    ##################################################################
+    with pytest.raises(SystemExit):
+        SharedStack([[cycle_stack[0][0], cycle_stack[0][0][:2]]])
+    ##################################################################
+
+
+def test_parallel_detection(tmp_path):
+    """
+    The cycles detected by workers from shared memory give the same reads as the ones detected in the main process.
+    """
+    simulate_images(str(tmp_path / 'images'), 200, 200, f_cycle_num=4, f_density=800, f_seed=9)
+
+    cycles = [str(tmp_path / 'images' / str(_)) for _ in range(1, 5)]
+
+    serial_reads = Pipeline(PipelineConfig('ke')).run(cycles, str(tmp_path / 'serial'))
+    parallel_reads = Pipeline(PipelineConfig('ke', f_processes=2)).run(cycles, str(tmp_path / 'parallel'))
+
+    assert len(serial_reads) > 0 and sorted(parallel_reads) == sorted(serial_reads)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the simulator of images and the matching of reads to its ground truth by the benchmark.
+"""
+
+
+from importlib.util import (spec_from_file_location, module_from_spec)
+from os.path import (join, dirname, abspath)
+from cv2 import (imread, IMREAD_GRAYSCALE)
+
+from IRIS.simulate_images import (simulate_images, read_truth, CHANNELS)
+
+
+def __benchmark():
+    """
+    For importing 'tool.benchmark.py', whose name is not a module name.
+
+    :return: The module.
+    """
+    spec = spec_from_file_location('benchmark', join(dirname(dirname(abspath(__file__))), 'tool.benchmark.py'))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def test_simulated_images_and_truth(tmp_path):
+    """
+    The images of each cycle are written in the shape given, the ground truth is written as returned, and the blobs
+    light up in the channel of their bases in the first cycle, which is not moved.
+    """
+    truth = simulate_images(str(tmp_path), 120, 160, f_cycle_num=3, f_density=2000, f_noise=0, f_seed=1)
+
+    assert len(truth) == int(2000 * 120 * 160 / 1e6)
+    assert read_truth(str(tmp_path / 'truth.txt')) == truth
+
+    with open(tmp_path / 'barcode_info.txt', 'rt') as IN:
+        codebook = dict(_.split() for _ in IN)
+
+    assert all(codebook[barcode] == gene and len(barcode) == 3 for barcode, gene, _, _ in truth)
+    assert all(10 <= row < 110 and 10 <= col < 150 for _, _, row, col in truth)
+
+    for cycle in ('1', '2', '3'):
+        for _, channel in CHANNELS + (('', 'DAPI.tif'),):
+            assert imread(join(str(tmp_path), cycle, channel), IMREAD_GRAYSCALE).shape == (120, 160)
+
+    channels = {base: imread(join(str(tmp_path), '1', channel), IMREAD_GRAYSCALE) for base, channel in CHANNELS}
+
+    lit = sum(1 for barcode, _, row, col in truth if channels[barcode[0]][row, col] ==
+              max(channels[_][row, col] for _ in 'ATCG'))
+
+    assert lit >= 0.9 * len(truth)
+
+
+def test_same_seed_same_images(tmp_path):
+    """
+    The same seed gives the same images and truth.
+    """
+    truth_1 = simulate_images(str(tmp_path / '1'), 64, 64, f_cycle_num=2, f_seed=3)
+    truth_2 = simulate_images(str(tmp_path / '2'), 64, 64, f_cycle_num=2, f_seed=3)
+
+    assert truth_1 == truth_2
+
+    for channel in ('Y5.tif', 'DAPI.tif'):
+        assert (imread(str(tmp_path / '1' / '2' / channel)) == imread(str(tmp_path / '2' / '2' / channel))).all()
+
+
+def test_match_truth():
+    """
+    The reads are matched one to one to the true blobs within the radius, and the barcodes are compared.
+    """
+    benchmark = __benchmark()
+
+    truth = [('AAGC', 'gene_0', 20, 30), ('TTCG', 'gene_1', 50, 50), ('CCAT', 'gene_2', 80, 10)]
+
+    ######################################################################
+    # Read ids and coordinates start from 1, while the truth from 0. The #
+    # second read is a duplicate of the first, and the last one is far   #
+    ######################################################################
+    reads = [['r00021c00031', 'AAGC', 'IIII', '00021', '00031'],
+             ['r00022c00031', 'AAGC', 'IIII', '00022', '00031'],
+             ['r00051c00052', 'TTCA', 'IIII', '00051', '00052'],
+             ['r00010c00100', 'CCAT', 'IIII', '00010', '00100']]
+    ######################################################################
+
+    accuracy = benchmark.match_truth(reads, truth)
+
+    assert accuracy == {'blob_recall': 2 / 3, 'blob_precision': 2 / 4, 'barcode_recall': 1 / 3,
+                        'barcode_precision': 1 / 4}
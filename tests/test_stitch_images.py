@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the stitching of FOVs on simulated tiles cut from one image of known offsets.
+"""
+
+
+from sys import modules
+from importlib.util import (spec_from_file_location, module_from_spec)
+from os import mkdir
+from os.path import (join, dirname, abspath)
+from numpy import (uint8, float32, corrcoef)
+from numpy.random import default_rng
+from cv2 import (imwrite, GaussianBlur)
+import cv2
+import pytest
+
+
+def __stitch_images():
+    """
+    For importing 'tool.stitch_images.py', whose name is not a module name.
+
+    :return: The module.
+    """
+    if not hasattr(cv2, 'createStitcherScans'):
+        pytest.skip('tool.stitch_images.py needs createStitcherScans of OpenCV')
+
+    spec = spec_from_file_location('stitch_images', join(dirname(dirname(abspath(__file__))), 'tool.stitch_images.py'))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    modules.update({'stitch_images': module})
+
+    return module
+
+
+def __slide(f_height, f_width, f_seed):
+    """
+    For drawing a slide of blurred noise, whose texture could be correlated at any place.
+
+    :param f_height: The height of slide.
+    :param f_width: The width of slide.
+    :param f_seed: The seed of noise.
+    :return: The 8-bit image of slide.
+    """
+    noise = float32(default_rng(f_seed).random((f_height, f_width)))
+
+    slide = GaussianBlur(noise, (0, 0), 3) + GaussianBlur(noise, (0, 0), 12) * 2
+
+    return uint8((slide - slide.min()) / (slide.max() - slide.min()) * 255)
+
+
+def __cut_tiles(f_dir, f_slide, f_grid, f_size, f_overlap, f_seed):
+    """
+    For cutting the tiles of a grid out of a slide, each moved by a random error of stage from the grid.
+
+    :param f_dir: The directory, into which each tile is written as the background of a FOV.
+    :param f_slide: The image of slide.
+    :param f_grid: The grid (rows, cols).
+    :param f_size: The edge length of tiles.
+    :param f_overlap: The overlapping fraction between adjacent tiles.
+    :param f_seed: The seed of errors.
+    :return: A tuple of the directories of FOVs in row-major order and their true offsets (row, col).
+    """
+    rng = default_rng(f_seed)
+
+    step = f_size - int(f_size * f_overlap)
+
+    img_dirs = []
+    offsets = []
+
+    for gr in range(0, f_grid[0]):
+        for gc in range(0, f_grid[1]):
+            row, col = (int(_) for _ in (gr * step + 8, gc * step + 8) + rng.integers(-6, 7, 2))
+
+            img_dir = join(f_dir, 'fov_%d_%d' % (gr, gc))
+            mkdir(img_dir)
+
+            imwrite(join(img_dir, 'background.tif'), f_slide[row:(row + f_size), col:(col + f_size)])
+
+            img_dirs.append(img_dir)
+            offsets.append((row, col))
+
+    return img_dirs, offsets
+
+
+def test_grid_offsets(tmp_path):
+    """
+    The tiles are placed at their true offsets, relative to the top-most and left-most ones, and the stitched image is
+    the slide.
+    """
+    stitch_images = __stitch_images()
+
+    slide = __slide(560, 760, 2)
+
+    img_dirs, offsets = __cut_tiles(str(tmp_path), slide, (3, 4), 200, 0.2, 3)
+
+    read_num = []
+    read_image = stitch_images.imread
+
+    def __imread(*f_args):
+        read_num.append(f_args[0])
+
+        return read_image(*f_args)
+
+    stitch_images.imread = __imread
+
+    stitched_img, placed = stitch_images.grid_stitcher(img_dirs, 3, 4, 0.2)
+
+    ##################################################################
+    # Besides the first one read for reference, each FOV is read     #
+    # once for registration, and once for composing the mosaic       #
+    ##################################################################
+    assert len(read_num) == 1 + 12 * 2
+    ##################################################################
+
+    min_row = min(_[0] for _ in offsets)
+    min_col = min(_[1] for _ in offsets)
+
+    for (row, col), (placed_row, placed_col) in zip(offsets, placed):
+        assert abs(placed_row - (row - min_row)) <= 1 and abs(placed_col - (col - min_col)) <= 1
+
+    ##################################################################
+    # The last tile is pasted over the others, and its brightness is #
+    # scaled to the first one                                        #
+    ##################################################################
+    row, col = offsets[-1]
+
+    assert corrcoef(stitched_img[placed[-1][0]:(placed[-1][0] + 200), placed[-1][1]:(placed[-1][1] + 200)].ravel(),
+                    slide[row:(row + 200), col:(col + 200)].ravel())[0, 1] > 0.99
+    ##################################################################
+
+
+def test_trans_coor(tmp_path):
+    """
+    The reads of FOVs are moved by their offsets, the ones of no read are kept, and a pool of workers gives the same
+    reads as one process.
+    """
+    stitch_images = __stitch_images()
+
+    img_dirs = []
+
+    for fov_id, reads in enumerate([['r00003c00004\tACGT\tIIII\t00003\t00004\tgene_0',
+                                     'r00090c00010\tTTTT\tIII#\t00090\t00010\tN/A'],
+                                    [],
+                                    ['r00000c00099\tGGCA\t####\t00000\t00099']]):
+        img_dir = str(tmp_path / ('fov_%d' % fov_id))
+        mkdir(img_dir)
+
+        imwrite(join(img_dir, 'background.tif'), __slide(100, 120, fov_id))
+
+        with open(join(img_dir, 'basecalling_data.txt'), 'wt') as OU:
+            print('#ID\tSEQ\tQUAL\tROW\tCOL', file=OU)
+
+            for read in reads:
+                print(read, file=OU)
+
+        img_dirs.append(img_dir)
+
+    offsets = [(0, 0), (0, 110), (95, 5)]
+
+    adj_reads, footprints = stitch_images.trans_coor(None, img_dirs, offsets=offsets, processes=1)
+
+    assert adj_reads == [('r00003c00004', 'ACGT\tIIII\t00003\t00004\tgene_0', 0),
+                         ('r00090c00010', 'TTTT\tIII#\t00090\t00010\tN/A', 0),
+                         ('r00095c00104', 'GGCA\t####\t00095\t00104', 2)]
+    assert footprints == [(0, 100, 0, 120), (0, 100, 110, 230), (95, 195, 5, 125)]
+
+    assert stitch_images.trans_coor(None, img_dirs, offsets=offsets, processes=2) == (adj_reads, footprints)
+
+
+def test_overlap_filtering(tmp_path):
+    """
+    The duplicates in the overlapping zone are merged into the read of the highest quality, the closest pairs first,
+    and no two reads of the same FOV are merged, even if they are linked through a read of the other FOV.
+    """
+    stitch_images = __stitch_images()
+
+    footprints = [(0, 100, 0, 100), (0, 100, 90, 190)]
+
+    def __read(f_seq, f_qul, f_row, f_col, f_fov):
+        return 'r%05dc%05d' % (f_row, f_col), '%s\t%s\t%05d\t%05d' % (f_seq, f_qul, f_row, f_col), f_fov
+
+    adj_reads = [__read('ACGT', 'IIII', 50, 93, 0),
+                 __read('ACGT', '####', 50, 96, 0),
+                 __read('ACGT', '####', 50, 94, 1),
+                 __read('ACGT', 'IIII', 50, 97, 1),
+                 __read('ACGT', 'IIII', 20, 95, 0),
+                 __read('ACGA', '####', 20, 96, 1),
+                 __read('ACGT', 'IIII', 20, 50, 0),
+                 __read('ACGT', 'IIII', 20, 150, 1)]
+
+    filtered = stitch_images.overlap_filtering(adj_reads, footprints)
+
+    assert sorted(filtered) == ['r00020c00050', 'r00020c00095', 'r00020c00096', 'r00020c00150', 'r00050c00093',
+                                'r00050c00097']
+
+    filtered = stitch_images.overlap_filtering(adj_reads, footprints, max_mismatch=1)
+
+    assert sorted(filtered) == ['r00020c00050', 'r00020c00095', 'r00020c00150', 'r00050c00093', 'r00050c00097']
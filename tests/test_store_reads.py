@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the reads queried by region from the database, against a scan of all reads.
+"""
+
+
+from numpy.random import default_rng
+
+from IRIS.store_reads import (write_reads_into_database, query_region)
+
+
+def __random_reads(f_rng, f_num):
+    """
+    For generating random reads, some of which are decoded.
+
+    :param f_rng: The random generator.
+    :param f_num: The number of reads.
+    :return: A list of reads, each of which is composed of id, sequence, quality, row, column and optionally gene name
+             and edit distance, as strings as they are read from the result file.
+    """
+    reads = []
+
+    for row, col in f_rng.integers(0, 1000, (f_num, 2)):
+        read = ['r%05dc%05d' % (row, col), ''.join(f_rng.choice(list('ATCGN'), 6)),
+                ''.join(f_rng.choice(list('#+5?I'), 6)), '%05d' % row, '%05d' % col]
+
+        if f_rng.random() < 0.5:
+            read += ['gene_%d' % f_rng.integers(0, 10), '%d' % f_rng.integers(0, 2)]
+
+        reads.append(read)
+
+    return reads
+
+
+def test_query_region(tmp_path):
+    """
+    The reads in a box, whose bounds are inclusive, are the ones found by scanning all reads, across the bands of rows,
+    and beyond the edges of image. A database written again is overwritten.
+    """
+    rng = default_rng(6)
+
+    database = str(tmp_path / 'reads.db')
+
+    write_reads_into_database(__random_reads(rng, 100), database)
+
+    reads = __random_reads(rng, 5000)
+
+    write_reads_into_database(iter(reads), database)
+
+    boxes = [(0, 999, 0, 999), (63, 64, 100, 400), (-50, 10, 990, 2000), (500, 500, 0, 999), (300, 200, 0, 999)]
+
+    for _ in range(0, 20):
+        boxes.append(tuple(int(_) for _ in sorted(rng.integers(0, 1000, 2))) +
+                     tuple(int(_) for _ in sorted(rng.integers(0, 1000, 2))))
+
+    for min_row, max_row, min_col, max_col in boxes:
+        expected = sorted(((_[0], _[1], _[2], int(_[3]), int(_[4]), _[5] if len(_) > 5 else None,
+                            int(_[6]) if len(_) > 6 else None) for _ in reads
+                           if min_row <= int(_[3]) <= max_row and min_col <= int(_[4]) <= max_col), key=repr)
+
+        assert sorted(query_region(database, min_row, max_row, min_col, max_col), key=repr) == expected
+
+    assert len(query_region(database, 0, 999, 0, 999)) == 5000
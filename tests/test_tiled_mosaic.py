@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the tiled pyramid of a mosaic composed out of core.
+"""
+
+
+from numpy import (zeros, uint8, array_equal)
+from numpy.random import default_rng
+from cv2 import (resize, INTER_AREA)
+
+from IRIS.tiled_mosaic import TiledMosaic
+
+
+def test_write_and_read_regions(tmp_path):
+    """
+    A mosaic composed of overlapping images, which cross the tiles and the edges, is read back by any region, at full
+    resolution and downsampled, after it is opened again from the disk.
+    """
+    rng = default_rng(4)
+
+    img = zeros((300, 700), dtype=uint8)
+
+    mosaic = TiledMosaic(str(tmp_path / 'pyramid'), img.shape, 128)
+
+    for row, col, height, width in [(0, 0, 200, 300), (150, 250, 200, 500), (-20, 600, 100, 150), (100, 100, 50, 50)]:
+        patch = rng.integers(0, 256, (height, width)).astype(uint8)
+
+        mosaic.write_region(row, col, patch)
+
+        img[max(row, 0):(row + height), max(col, 0):(col + width)] = \
+            patch[max(-row, 0):(300 - row), max(-col, 0):(700 - col)]
+
+    mosaic.build_pyramid()
+
+    mosaic = TiledMosaic(str(tmp_path / 'pyramid'))
+
+    assert mosaic.shapes == [(300, 700), (150, 350), (75, 175), (38, 88)]
+
+    assert array_equal(mosaic.read_region(0, 300, 0, 700), img)
+    assert array_equal(mosaic.read_region(-10, 130, 127, 129), img[0:130, 127:129])
+    assert array_equal(mosaic.read_region(290, 400, 690, 800), img[290:300, 690:700])
+
+    assert array_equal(mosaic.read_region(0, 300, 0, 700, 1), resize(img, (350, 150), interpolation=INTER_AREA))
+    assert array_equal(mosaic.read_region(0, 300, 0, 700, 2)[0:64, 0:64],
+                       resize(resize(img, (350, 150), interpolation=INTER_AREA), (175, 75),
+                              interpolation=INTER_AREA)[0:64, 0:64])
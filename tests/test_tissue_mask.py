@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+This model is used to test the mask of tissue, the regions covering it, and the filtering restricted to them.
+"""
+
+
+from sys import executable
+from subprocess import run
+from os.path import (join, dirname, abspath)
+from numpy import (zeros, uint8, array_equal)
+from numpy.random import default_rng
+from cv2 import (imread, imwrite, circle, getStructuringElement, morphologyEx, IMREAD_GRAYSCALE, MORPH_ELLIPSE,
+                 MORPH_TOPHAT)
+
+from IRIS import detect_signals
+from IRIS.tissue_mask import (tissue_mask, mask_regions)
+
+
+def __section():
+    """
+    For drawing a round section of tissue on the dark glass, whose autofluorescence is dim against the bright blobs.
+
+    :return: The image of a signal channel.
+    """
+    rng = default_rng(5)
+
+    img = rng.integers(0, 6, (400, 400)).astype(uint8)
+    circle(img, (150, 200), 80, 60, -1)
+
+    for row, col in rng.integers(80, 220, (100, 2)):
+        circle(img, (int(col), int(row)), 2, 200, -1)
+
+    return img
+
+
+def test_tissue_mask():
+    """
+    The section is covered with its margin, and the glass far from it is not.
+    """
+    mask = tissue_mask(__section(), f_margin=16)
+
+    assert mask.shape == (400, 400)
+    assert (mask[140:260, 90:210] == 255).all()
+    assert (mask[:, 260:] == 0).all()
+    assert (mask[330:, :] == 0).all()
+
+    min_row, max_row, min_col, max_col = mask_regions(mask)[0]
+
+    assert len(mask_regions(mask)) == 1
+    assert min_row < 120 - 16 < 280 + 16 < max_row < 330 and min_col < 70 - 16 < 230 + 16 < max_col < 260
+    assert mask_regions(zeros((30, 40), dtype=uint8)) == [(0, 30, 0, 40)]
+
+
+def test_mask_regions_merged():
+    """
+    The overlapping boxes of parts are merged, and the apart ones are not.
+    """
+    mask = zeros((100, 100), dtype=uint8)
+    mask[10:30, 10:20] = 255
+    mask[25:40, 15:35] = 0
+    mask[20:40, 18:40] = 255
+    mask[70:80, 70:90] = 255
+
+    assert mask_regions(mask) == [(10, 40, 10, 40), (70, 80, 70, 90)]
+
+
+def test_command_line(tmp_path):
+    """
+    The mask is written to the last argument, after all the channels, none of which is overwritten.
+    """
+    section = __section()
+
+    channels = [str(tmp_path / ('%d.tif' % _)) for _ in range(0, 2)]
+
+    for channel in channels:
+        imwrite(channel, section // 2)
+
+    output = str(tmp_path / 'mask.tif')
+
+    result = run([executable, join(dirname(dirname(abspath(__file__))), 'IRIS', 'tissue_mask.py')] + channels +
+                 [output], capture_output=True, text=True)
+
+    assert result.returncode == 0
+
+    for channel in channels:
+        assert array_equal(imread(channel, IMREAD_GRAYSCALE), section // 2)
+
+    mask = imread(output, IMREAD_GRAYSCALE)
+
+    assert array_equal(mask, tissue_mask(section // 2 * 2))
+    assert [tuple(int(_) for _ in line.split('\t')) for line in result.stdout.split('\n') if line] == \
+        mask_regions(mask)
+
+
+def test_filter_regions_as_whole():
+    """
+    The tophat filtered in the padded regions is the same as the one filtered in the whole image, inside the regions.
+    """
+    img = default_rng(9).integers(0, 256, (300, 300)).astype(uint8)
+
+    kernel = getStructuringElement(MORPH_ELLIPSE, (15, 15))
+
+    def __tophat(f_img):
+        return morphologyEx(f_img, MORPH_TOPHAT, kernel, iterations=3)
+
+    regions = [(60, 140, 50, 170), (200, 290, 180, 300)]
+
+    whole = __tophat(img)
+    filtered = getattr(detect_signals, '__filter_regions')(__tophat, img, regions, 2 * 3 * 7)
+
+    for min_row, max_row, min_col, max_col in regions:
+        assert array_equal(filtered[min_row:max_row, min_col:max_col], whole[min_row:max_row, min_col:max_col])
+
+    filtered[60:140, 50:170] = 0
+    filtered[200:290, 180:300] = 0
+
+    assert not filtered.any()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+This tool is used to benchmark the stages of base calling on simulated images, across a sweep of image sizes and blob
+densities.
+
+For each combination, a set of images is simulated with its ground truth, and the stages (importing and registering,
+detecting and calling, connecting and writing) are run one by one in a fresh process, of which the wall time, CPU time
+and peak memory of each stage are recorded. The called reads are matched to the nearest true blobs within 3 pixels,
+to report the recall and precision of blobs, and of barcodes which are also called correctly.
+
+The per-blob kernels of scoring and connection could be run by each backend ('numpy' and 'numba') on the same images,
+whose times are reported besides the stages, after the kernels are compiled. The time of pooling the called bases of
+blobs (pool2base), which is a part of detection, is reported besides them as well.
+
+The result is printed as a table, which gives a baseline to compare optimizations against.
+"""
+
+
+from sys import (argv, stderr)
+from os import (chdir, getcwd)
+from os.path import join
+from time import (time, process_time)
+from tempfile import mkdtemp
+from shutil import rmtree
+from multiprocessing import Pool
+from numpy import (array, argsort, int64)
+from scipy.spatial import cKDTree
+
+from IRIS import (import_images, detect_signals, connect_barcodes, deal_with_result)
+from IRIS.simulate_images import simulate_images
+from IRIS.profiler import (PROFILER, reset_peak_memory, peak_memory)
+from IRIS.kernels import (set_backend, backend, warm_up)
+
+
+STAGES = ('import', 'detect', 'connect', 'output')
+KERNEL_STAGES = (('scoring', 'scoring'), ('pool2base', 'pool2base'), ('calling_adjust', 'adjust'))
+
+
+def match_truth(f_reads, f_truth, f_radius=None):
+    """
+    This function is used to match the called reads to the true blobs, one to one, by their distance.
+
+    :param f_reads: A list of reads, each of which is composed of id, sequence, quality, row and column.
+    :param f_truth: A list of blobs, each of which is composed of barcode, gene, row and column.
+    :param f_radius: The largest distance of a match, 3 by default.
+    :return: A dictionary of recall and precision of blobs and barcodes.
+    """
+    radius = 3 if f_radius is None else f_radius
+
+    if len(f_reads) == 0 or len(f_truth) == 0:
+        return {'blob_recall': 0.0, 'blob_precision': 0.0, 'barcode_recall': 0.0, 'barcode_precision': 0.0}
+
+    read_coor = array([[int(_[3]) - 1, int(_[4]) - 1] for _ in f_reads], dtype=int64)  # Read ids start from 1
+    truth_coor = array([[_[2], _[3]] for _ in f_truth], dtype=int64)
+
+    distances, nearest = cKDTree(truth_coor).query(read_coor, distance_upper_bound=radius)
+
+    ###################################################################################
+    # Reads are matched from the nearest one, and each true blob is matched only once #
+    ###################################################################################
+    matched_truth = set()
+    correct = 0
+
+    for read_idx in argsort(distances, kind='stable'):
+        if distances[read_idx] > radius:
+            break
+
+        if nearest[read_idx] in matched_truth:
+            continue
+
+        matched_truth.add(nearest[read_idx])
+
+        if f_reads[read_idx][1] == f_truth[nearest[read_idx]][0]:
+            correct += 1
+    ###################################################################################
+
+    return {'blob_recall': len(matched_truth) / len(f_truth), 'blob_precision': len(matched_truth) / len(f_reads),
+            'barcode_recall': correct / len(f_truth), 'barcode_precision': correct / len(f_reads)}
+
+
+def run_stages(task):
+    """
+    This function is used to run the stages of base calling on a set of simulated images, in the directory of images.
+
+    :param task: A tuple of the directory of images, the number of cycles, the ground truth and the backend of
+                 kernels.
+    :return: A dictionary of the wall time, CPU time and peak memory of each stage, the wall time of kernels, the
+             number of reads and the accuracy.
+    """
+    img_dir, cycle_num, truth, kernels = task
+
+    set_backend(kernels)
+    warm_up()
+
+    PROFILER.enable()
+
+    work_dir = getcwd()
+    chdir(img_dir)
+
+    report = {}
+
+    def __stage(f_name, f_func, *f_args):
+        reset_peak_memory()
+
+        wall = time()
+        cpu = process_time()
+
+        result = f_func(*f_args)
+
+        report.update({f_name + '_time': time() - wall, f_name + '_cpu': process_time() - cpu,
+                       f_name + '_memory': peak_memory()})
+
+        return result
+
+    cycle_stack, std_img = __stage('import', import_images.decode_data_Ke,
+                                   [join(img_dir, str(_ + 1)) for _ in range(0, cycle_num)])
+
+    called_cycles = __stage('detect', lambda: [detect_signals.detect_blobs_Ke(_) for _ in cycle_stack])
+
+    def __connect():
+        barcode_cube = connect_barcodes.BarcodeCube()
+
+        for called_cycle in called_cycles:
+            barcode_cube.collect_called_bases(called_cycle)
+
+        barcode_cube.filter_blobs_list2()
+        barcode_cube.calling_adjust()
+
+        return barcode_cube
+
+    barcode_cube_obj = __stage('connect', __connect)
+
+    reads = __stage('output', deal_with_result.write_reads_into_file, std_img, barcode_cube_obj.adjusted_bases_cube,
+                    cycle_num)
+
+    for stage, name in KERNEL_STAGES:
+        report.update({name + '_time': sum(_['wall_time'] for _ in PROFILER.records if _['stage'] == stage)})
+
+    report.update({'reads': len(reads)})
+    report.update(match_truth([_ for _ in reads if 'N' not in _[1]], truth))
+
+    chdir(work_dir)
+
+    return report
+
+
+def benchmark(f_sizes, f_densities, f_cycle_num=None, f_seed=None, f_keep_dir=None, f_kernels=None):
+    """
+    This function is used to run the benchmark across the sweep, and print a table.
+
+    :param f_sizes: A list of edge lengths of square images.
+    :param f_densities: A list of blob densities, in blobs per megapixel.
+    :param f_cycle_num: The number of cycles, 4 by default.
+    :param f_seed: The seed of simulation.
+    :param f_keep_dir: The directory to keep the simulated images and results, which are removed by default.
+    :param f_kernels: A list of backends of kernels to run each combination by, the default one only by default.
+    :return: A list of reports.
+    """
+    cycle_num = 4 if f_cycle_num is None else int(f_cycle_num)
+    kernels_list = [backend()] if f_kernels is None else f_kernels
+
+    reports = []
+
+    print('\t'.join(['#size', 'density', 'kernels', 'blobs', 'reads'] +
+                    ['%s_%s' % (stage, _) for stage in STAGES for _ in ('time', 'cpu', 'memory')] +
+                    ['%s_time' % _[1] for _ in KERNEL_STAGES] +
+                    ['blob_recall', 'blob_precision', 'barcode_recall', 'barcode_precision']))
+
+    for size in f_sizes:
+        for density in f_densities:
+            img_dir = mkdtemp(prefix='iris_benchmark_') if f_keep_dir is None else \
+                join(f_keep_dir, '%d_%d' % (size, density))
+
+            truth = simulate_images(img_dir, size, size, cycle_num, density, f_seed=f_seed)
+
+            for kernels in kernels_list:
+                ############################################################################
+                # Each combination is run in a fresh process, so that its peak memory is   #
+                # not affected by the previous ones                                        #
+                ############################################################################
+                with Pool(1) as pool:
+                    report = pool.map(run_stages, [(img_dir, cycle_num, truth, kernels)])[0]
+                ############################################################################
+
+                report.update({'size': size, 'density': density, 'kernels': kernels, 'blobs': len(truth)})
+                reports.append(report)
+
+                print('\t'.join(['%d' % size, '%g' % density, kernels, '%d' % len(truth), '%d' % report['reads']] +
+                                ['%.2f\t%.2f\t%.1f' % (report[stage + '_time'], report[stage + '_cpu'],
+                                                       report[stage + '_memory'] / 2 ** 20) for stage in STAGES] +
+                                ['%.3f' % report[_[1] + '_time'] for _ in KERNEL_STAGES] +
+                                ['%.4f' % report[_] for _ in ('blob_recall', 'blob_precision',
+                                                              'barcode_recall', 'barcode_precision')]), flush=True)
+
+            if f_keep_dir is None:
+                rmtree(img_dir)
+
+    return reports
+
+
+if __name__ == '__main__':
+    image_sizes = [256, 512, 1024]
+    blob_densities = [250, 500, 1000]
+    cycles = None
+    seed = 0
+    keep_dir = None
+    kernels_backends = None
+
+    if '--sizes' in argv:
+        image_sizes = [int(_) for _ in argv[argv.index('--sizes') + 1].split(',')]
+        del argv[argv.index('--sizes'):argv.index('--sizes') + 2]
+
+    if '--densities' in argv:
+        blob_densities = [float(_) for _ in argv[argv.index('--densities') + 1].split(',')]
+        del argv[argv.index('--densities'):argv.index('--densities') + 2]
+
+    if '--cycles' in argv:
+        cycles = int(argv[argv.index('--cycles') + 1])
+        del argv[argv.index('--cycles'):argv.index('--cycles') + 2]
+
+    if '--seed' in argv:
+        seed = int(argv[argv.index('--seed') + 1])
+        del argv[argv.index('--seed'):argv.index('--seed') + 2]
+
+    if '--keep' in argv:
+        keep_dir = argv[argv.index('--keep') + 1]
+        del argv[argv.index('--keep'):argv.index('--keep') + 2]
+
+    if '--kernels' in argv:
+        kernels_backends = argv[argv.index('--kernels') + 1].split(',')
+        del argv[argv.index('--kernels'):argv.index('--kernels') + 2]
+
+    if len(argv) == 1:
+        benchmark(image_sizes, blob_densities, cycles, seed, keep_dir, kernels_backends)
+
+    else:
+        print('USAGE:  ' + argv[0] + ' [--sizes 256,512,1024] [--densities 250,500,1000] [--cycles <N>] '
+              '[--seed <N>] [--keep <directory>] [--kernels numpy,numba]', file=stderr)
@@ -3,11 +3,18 @@
 
 
 from sys import (argv, exit, stderr)
+from multiprocessing import Pool
 from cv2 import (imread, createStitcherScans, cvtColor, imwrite, convertScaleAbs,
-                 IMREAD_GRAYSCALE, COLOR_BGR2GRAY, COLOR_GRAY2BGR)
-from numpy import (array, zeros, dot, mean, uint8, uint16, bool_, fft, abs, max)
+                 phaseCorrelate, createHanningWindow, getOptimalDFTSize,
+                 IMREAD_GRAYSCALE, COLOR_BGR2GRAY, COLOR_GRAY2BGR, CV_32F)
+from numpy import (array, zeros, dot, mean, around, where, uint8, bool_, float32, float64, int64, fft, abs, max, min)
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import lsqr
 
 from IRIS.register_images import register_cycles
+from IRIS.store_reads import write_reads_into_database
+from IRIS.count_matrix import CountMatrix
+from IRIS.tiled_mosaic import TiledMosaic
 
 
 def lpf(f_img):
@@ -52,82 +59,486 @@ def background_stitcher(img_dirs):
         exit(1)
 
 
-def trans_coor(bg, img_dirs):
-    """"""
-    adj_barcode_info = {}
+def pair_offset(img_a, img_b, off_r, off_c):
+    """
+    Measure the offset of image B relative to image A by phase correlation of their overlapping region.
 
-    for img_dir in img_dirs:
-        # mat = register_cycles(bg, imread(img_dir + '/background.tif', IMREAD_GRAYSCALE), 'BRISK')
-        mat = register_cycles(bg, imread(img_dir + '/debug.cycle_1.reg.tif', IMREAD_GRAYSCALE), 'BRISK')
+    :param img_a: Image A.
+    :param img_b: Image B.
+    :param off_r: The expected row offset of B relative to A.
+    :param off_c: The expected column offset of B relative to A.
+    :return: A tuple of the measured row offset, column offset and the response of correlation.
+    """
+    r0 = max((0, off_r))
+    r1 = min((img_a.shape[0], off_r + img_b.shape[0]))
+    c0 = max((0, off_c))
+    c1 = min((img_a.shape[1], off_c + img_b.shape[1]))
 
-        with open(img_dir + '/basecalling_data.txt', 'rt') as IN:
-            for ln in IN:
-                ln = ln.split()
+    if r1 - r0 < 8 or c1 - c0 < 8:
+        return off_r, off_c, 0.0
 
-                seq = ln[1]
-                qul = ln[2]
+    ###################################################################################################
+    # Phase correlation of OpenCV is biased by a half pixel on strips padded into an odd DFT size, so #
+    # strips are cropped into an even size which is optimal for DFT                                   #
+    ###################################################################################################
+    while (r1 - r0) % 2 == 1 or getOptimalDFTSize(r1 - r0) != r1 - r0:
+        r1 -= 1
 
-                row = int(ln[3].lstrip())
-                col = int(ln[4].lstrip())
+    while (c1 - c0) % 2 == 1 or getOptimalDFTSize(c1 - c0) != c1 - c0:
+        c1 -= 1
+    ###################################################################################################
 
-                col_row_tensor = array([col, row, 1], dtype=uint16)
-                adj_col, adj_row = dot(mat, col_row_tensor)
+    strip_a = float32(img_a[r0:r1, c0:c1])
+    strip_b = float32(img_b[(r0 - off_r):(r1 - off_r), (c0 - off_c):(c1 - off_c)])
 
-                if adj_row < 0 or adj_col < 0:
-                    continue
+    (dc, dr), response = phaseCorrelate(strip_a, strip_b, createHanningWindow((c1 - c0, r1 - r0), CV_32F))
 
-                adj_read_id = 'r%05d' % adj_row + 'c%05d' % adj_col
+    return off_r - dr, off_c - dc, response
 
-                adj_barcode_info.update({adj_read_id: '%s\t%s\t%05d\t%05d' % (seq, qul, adj_row, adj_col)})
 
-    return adj_barcode_info
+def grid_stitcher(img_dirs, grid_rows, grid_cols, overlap, pyramid=None):
+    """
+    Stitch the backgrounds of FOVs which are acquired in a known stage grid.
 
+    The FOVs are given in row-major order. Only the adjacent FOVs are registered, by phase correlation of their
+    overlapping strips, then the placement of all FOVs is solved by a global least-squares fitting of these pairwise
+    offsets, weighted by the confidence of correlation. Thus the time grows linearly with the number of FOVs.
 
-def overlap_filtering(adj_barcode_info):
+    FOVs are read when they are needed, and only two rows of the grid are held in memory. If a pyramid directory is
+    given, the stitched image is composed FOV by FOV into a tiled pyramid on disk instead of in memory.
 
-    filtered_barcode_info = {}
+    :param img_dirs: The directories of FOVs, in row-major order of the grid.
+    :param grid_rows: The number of rows of the grid.
+    :param grid_cols: The number of columns of the grid.
+    :param overlap: The overlapping fraction between adjacent FOVs.
+    :param pyramid: The directory of tiled pyramid to be written.
+    :return: A tuple of the stitched image (or the 'TiledMosaic' object) and the offsets (row, col) of each FOV in it.
+    """
+    if len(img_dirs) != grid_rows * grid_cols:
+        print('The number of FOVs does not match the grid', file=stderr)
+        exit(1)
+
+    ref_img = imread(img_dirs[0] + '/background.tif', IMREAD_GRAYSCALE)
+    ref_mean = mean(ref_img)
+
+    h, w = ref_img.shape
+
+    def __load(f_img_id):
+        img = imread(img_dirs[f_img_id] + '/background.tif', IMREAD_GRAYSCALE)
+
+        if img.shape[0] < h or img.shape[1] < w:
+            print('FOVs in the grid should be in the same size', file=stderr)
+            exit(1)
+
+        return convertScaleAbs(img[:h, :w] * ref_mean / mean(img[:h, :w]))
+
+    imgs = {}
+
+    ##########################################################################################################
+    # Each pair of adjacent FOVs gives an equation of their relative offset. The offset is measured in the   #
+    # overlapping strip expected by the grid, and measured again in the strip overlapped by this offset, for #
+    # a strip partially overlapped biases the sub-pixel estimation towards the expected one. A pair of poor  #
+    # correlation, e.g. in empty glass, is kept with a small weight, so that its FOVs are placed as the grid #
+    # expected                                                                                               #
+    ##########################################################################################################
+    pairs = []
+
+    for gr in range(0, grid_rows):
+        for _ in [_ for _ in imgs if _ < gr * grid_cols]:
+            del imgs[_]
+
+        for _ in range(gr * grid_cols, min(((gr + 2) * grid_cols, len(img_dirs)))):
+            if _ not in imgs:
+                imgs.update({_: __load(_)})
+
+        for gc in range(0, grid_cols):
+            i = gr * grid_cols + gc
+
+            neighbours = []
 
-    retained_keys_list = set([_ for _ in sorted(adj_barcode_info.keys())])
+            if gc + 1 < grid_cols:
+                neighbours.append((i + 1, 0, w - int(w * overlap)))
 
-    for adj_cor_id in adj_barcode_info:
+            if gr + 1 < grid_rows:
+                neighbours.append((i + grid_cols, h - int(h * overlap), 0))
+
+            for j, exp_r, exp_c in neighbours:
+                off_r, off_c, response = pair_offset(imgs[i], imgs[j], exp_r, exp_c)
+                off_r, off_c, response = pair_offset(imgs[i], imgs[j], int(around(off_r)), int(around(off_c)))
+
+                pairs.append((i, j, off_r, off_c, max((response, 0.01))))
+    ##########################################################################################################
+
+    ##############################################################################
+    # Solve the placement of FOVs by sparse weighted least squares, of which the #
+    # first FOV is anchored at the origin                                        #
+    ##############################################################################
+    imgs.clear()
+
+    n = len(img_dirs)
+    m = len(pairs)
+
+    eq_rows = [_ for _ in range(0, m) for __ in range(0, 2)] + [m]
+    eq_cols = [_ for pair in pairs for _ in pair[0:2]] + [0]
+    eq_vals = [_ for pair in pairs for _ in (-pair[4], pair[4])] + [1.0]
+
+    design = coo_matrix((eq_vals, (eq_rows, eq_cols)), shape=(m + 1, n)).tocsr()
+
+    pos_r = lsqr(design, array([_[2] * _[4] for _ in pairs] + [0.0], dtype=float64))[0]
+    pos_c = lsqr(design, array([_[3] * _[4] for _ in pairs] + [0.0], dtype=float64))[0]
+
+    offsets = [(int(_[0]), int(_[1])) for _ in zip(around(pos_r - min(pos_r)).astype(int64),
+                                                  around(pos_c - min(pos_c)).astype(int64))]
+    ##############################################################################
+
+    mosaic_shape = (max([_[0] for _ in offsets]) + h, max([_[1] for _ in offsets]) + w)
+
+    if pyramid is not None:
+        stitched_img = TiledMosaic(pyramid, mosaic_shape)
+
+        for i in range(0, n):
+            stitched_img.write_region(offsets[i][0], offsets[i][1], __load(i))
+
+        stitched_img.build_pyramid()
+
+    else:
+        stitched_img = zeros(mosaic_shape, dtype=uint8)
 
-        seq, qul, row, col = adj_barcode_info[adj_cor_id].split()
+        for i in range(0, n):
+            stitched_img[offsets[i][0]:(offsets[i][0] + h), offsets[i][1]:(offsets[i][1] + w)] = __load(i)
 
-        row = int(row)
-        col = int(col)
+    return stitched_img, offsets
 
-        for r in range(row - 1, row + 3):
-            for c in range(col - 1, col + 3):
 
-                if r != row and c != col:
+mosaic = array([], dtype=uint8)
 
-                    read_id = 'r%05dc%05d' % (r, c)
 
-                    if read_id in retained_keys_list and \
-                            seq == adj_barcode_info[read_id].split()[0] and \
-                            qul == adj_barcode_info[read_id].split()[1]:
-                        retained_keys_list.remove(read_id)
+def init_mosaic(bg):
+    """
+    Share the stitched image with a worker, which is passed only once when the worker starts.
 
-        if adj_cor_id in retained_keys_list and adj_cor_id not in filtered_barcode_info:
-            filtered_barcode_info.update({adj_cor_id: adj_barcode_info[adj_cor_id]})
+    :param bg: The stitched image.
+    :return: NONE
+    """
+    global mosaic
+    mosaic = bg
+
+
+def trans_fov(task):
+    """
+    Transform the coordinates of reads in a FOV into the stitched image.
+
+    If the offset of FOV is known, the transformation is a translation. Otherwise, the FOV is registered against the
+    stitched image, within the region it is expected in if the grid is known. All the reads are loaded at once and
+    transformed by a single matrix multiplication.
+
+    :param task: A tuple of the FOV directory, its offset (row, col) in the stitched image or None, and its position
+                 in the grid (row, col, overlap) or None.
+    :return: A tuple of a list of reads, each of which is composed of the adjusted read id and the read info, and
+             the footprint (min row, max row, min col, max col) of this FOV in the stitched image.
+    """
+    img_dir, offset, grid_pos = task
+
+    if offset is not None:
+        fov_img = imread(img_dir + '/background.tif', IMREAD_GRAYSCALE)
+
+        mat = array([[1, 0, offset[1]], [0, 1, offset[0]]], dtype=float64)
+
+    else:
+        fov_img = imread(img_dir + '/debug.cycle_1.reg.tif', IMREAD_GRAYSCALE)
+
+        r0, r1, c0, c1 = 0, mosaic.shape[0], 0, mosaic.shape[1]
+
+        ###########################################################################################
+        # Restrict the registration into the expected region of this FOV, with a margin of twice  #
+        # the overlapping strip for the error of stage                                            #
+        ###########################################################################################
+        if grid_pos is not None:
+            h, w = fov_img.shape
+            margin_r = 2 * int(h * grid_pos[2]) + 1
+            margin_c = 2 * int(w * grid_pos[2]) + 1
+
+            exp_r = int(grid_pos[0] * h * (1 - grid_pos[2]))
+            exp_c = int(grid_pos[1] * w * (1 - grid_pos[2]))
+
+            r0 = max((0, exp_r - margin_r))
+            r1 = min((mosaic.shape[0], exp_r + h + margin_r))
+            c0 = max((0, exp_c - margin_c))
+            c1 = min((mosaic.shape[1], exp_c + w + margin_c))
+        ###########################################################################################
+
+        mat = float64(register_cycles(mosaic[r0:r1, c0:c1], fov_img, 'BRISK'))
+        mat[0, 2] += c0
+        mat[1, 2] += r0
+
+    corners = dot(array([[0, 0, 1], [fov_img.shape[1], 0, 1], [0, fov_img.shape[0], 1],
+                         [fov_img.shape[1], fov_img.shape[0], 1]], dtype=float64), mat.T)
+    footprint = (min(corners[:, 1]), max(corners[:, 1]), min(corners[:, 0]), max(corners[:, 0]))
+
+    with open(img_dir + '/basecalling_data.txt', 'rt') as IN:
+        reads = [ln.split() for ln in IN if not ln.startswith('#') and len(ln.split()) > 4]
+
+    if len(reads) == 0:
+        return [], footprint
+
+    col_row_tensor = array([[_[4], _[3], 1] for _ in reads], dtype=float64)
+    adj_col_row = dot(col_row_tensor, mat.T)
+
+    adj_reads = []
+
+    for i in where((adj_col_row[:, 0] >= 0) & (adj_col_row[:, 1] >= 0))[0]:
+        adj_col = int(adj_col_row[i, 0])
+        adj_row = int(adj_col_row[i, 1])
+
+        adj_reads.append(('r%05dc%05d' % (adj_row, adj_col),
+                          '%s\t%s\t%05d\t%05d' % (reads[i][1], reads[i][2], adj_row, adj_col) +
+                          ''.join('\t' + _ for _ in reads[i][5:])))
+
+    return adj_reads, footprint
+
+
+def trans_coor(bg, img_dirs, offsets=None, grid=None, overlap=None, processes=None):
+    """
+    Transform the coordinates of reads in all FOVs into the stitched image, by a pool of workers.
+
+    :param bg: The stitched image.
+    :param img_dirs: The directories of FOVs, in row-major order of the grid if the grid is given.
+    :param offsets: The offsets (row, col) of FOVs in the stitched image, if known.
+    :param grid: The grid (rows, cols) of FOVs, if known.
+    :param overlap: The overlapping fraction between adjacent FOVs in the grid.
+    :param processes: The number of workers, all the CPUs by default.
+    :return: A tuple of a list of reads, each of which is composed of the adjusted read id, the read info and the
+             index of its FOV, and a list of footprints of FOVs.
+    """
+    tasks = []
+
+    for img_id, img_dir in enumerate(img_dirs):
+        tasks.append((img_dir,
+                      offsets[img_id] if offsets is not None else None,
+                      (img_id // grid[1], img_id % grid[1], overlap) if grid is not None else None))
+
+    if len(tasks) == 1 or processes == 1:
+        init_mosaic(bg)
+
+        fov_results = [trans_fov(_) for _ in tasks]
+
+    else:
+        with Pool(processes, initializer=init_mosaic, initargs=(bg,)) as pool:
+            fov_results = pool.map(trans_fov, tasks, chunksize=1)
+
+    adj_reads = [(read[0], read[1], fov_id) for fov_id, result in enumerate(fov_results) for read in result[0]]
+    footprints = [_[1] for _ in fov_results]
+
+    return adj_reads, footprints
+
+
+def overlap_filtering(adj_reads, footprints, radius=None, max_mismatch=None):
+    """
+    Remove the duplicated reads which are called in the overlapping zones of adjacent FOVs.
+
+    Only the reads falling in the footprint of any other FOV are considered. They are hashed into a grid of cells, so
+    that each read is compared only with the reads in its neighbouring cells. Two reads from different FOVs are
+    duplicates if their coordinates are within the radius and their sequences are within the Hamming distance. The
+    closest pairs of duplicates are linked first, and a pair is not linked if its groups share a FOV, so that no two
+    reads of the same FOV are merged. Each group of duplicates is merged into the read of the highest total quality.
+
+    :param adj_reads: A list of reads, each of which is composed of the adjusted read id, the read info and the index
+                      of its FOV.
+    :param footprints: The footprints (min row, max row, min col, max col) of FOVs in the stitched image.
+    :param radius: The largest distance in row or column between duplicates, 2 by default.
+    :param max_mismatch: The largest Hamming distance between duplicates, 0 by default.
+    :return: A dictionary of filtered reads, with the adjusted read id as key.
+    """
+    radius = 2 if radius is None else radius
+    max_mismatch = 0 if max_mismatch is None else max_mismatch
+
+    ##############################################################################
+    # Find out the reads in the overlapping zones, by checking each FOV against  #
+    # only the FOVs whose footprints intersect its own                           #
+    ##############################################################################
+    neighbour_fovs = [[j for j in range(0, len(footprints)) if j != i and
+                       footprints[j][0] < footprints[i][1] and footprints[i][0] < footprints[j][1] and
+                       footprints[j][2] < footprints[i][3] and footprints[i][2] < footprints[j][3]]
+                      for i in range(0, len(footprints))]
+
+    in_overlap = []
+
+    for adj_read in adj_reads:
+        row, col = (int(_) for _ in adj_read[1].split('\t')[2:4])
+
+        in_overlap.append(any(footprints[j][0] <= row <= footprints[j][1] and
+                              footprints[j][2] <= col <= footprints[j][3] for j in neighbour_fovs[adj_read[2]]))
+    ##############################################################################
+
+    ###############################################################################################
+    # Hash the reads in overlapping zones into cells, and link the duplicates by a union-find set #
+    # from the closest pairs, whose groups are kept with their FOVs                               #
+    ###############################################################################################
+    cell = radius + 1
+
+    parsed = {}
+    cells = {}
+
+    for i in range(0, len(adj_reads)):
+        if in_overlap[i]:
+            seq, qul, row, col = adj_reads[i][1].split('\t')[0:4]
+
+            parsed.update({i: (seq, sum(ord(_) - 33 for _ in qul), int(row), int(col), adj_reads[i][2])})
+            cells.setdefault((int(row) // cell, int(col) // cell), []).append(i)
+
+    pairs = []
+
+    for i in parsed:
+        seq, _, row, col, fov = parsed[i]
+
+        for cr in range(row // cell - 1, row // cell + 2):
+            for cc in range(col // cell - 1, col // cell + 2):
+                for j in cells.get((cr, cc), ()):
+                    if j <= i or parsed[j][4] == fov or len(parsed[j][0]) != len(seq):
+                        continue
+
+                    if abs(parsed[j][2] - row) > radius or abs(parsed[j][3] - col) > radius:
+                        continue
+
+                    mismatch = sum(a != b for a, b in zip(seq, parsed[j][0]))
+
+                    if mismatch > max_mismatch:
+                        continue
+
+                    pairs.append(((parsed[j][2] - row) ** 2 + (parsed[j][3] - col) ** 2, mismatch, i, j))
+
+    parent = {_: _ for _ in parsed}
+    group_fovs = {_: {parsed[_][4]} for _ in parsed}
+
+    def __find(f_i):
+        while parent[f_i] != f_i:
+            parent[f_i] = parent[parent[f_i]]
+            f_i = parent[f_i]
+
+        return f_i
+
+    for _, _, i, j in sorted(pairs):
+        root_i = __find(i)
+        root_j = __find(j)
+
+        if root_i == root_j or len(group_fovs[root_i] & group_fovs[root_j]) > 0:
+            continue
+
+        parent[root_j] = root_i
+        group_fovs[root_i] |= group_fovs.pop(root_j)
+    ###############################################################################################
+
+    best = {}
+
+    for i in parsed:
+        root = __find(i)
+
+        if root not in best or parsed[i][1] > parsed[best[root]][1]:
+            best.update({root: i})
+
+    retained = set(best.values())
+
+    filtered_barcode_info = {}
+
+    for i in range(0, len(adj_reads)):
+        if not in_overlap[i] or i in retained:
+            filtered_barcode_info.update({adj_reads[i][0]: adj_reads[i][1]})
 
     return filtered_barcode_info
 
 
+def pop_option(f_argv, f_option, f_default=None):
+    """
+    For extracting an optional argument and its value from the command line.
+
+    :param f_argv: The arguments of command line, the extracted option will be removed from it.
+    :param f_option: The name of option, such as '--db'.
+    :param f_default: The value returned if this option is not given.
+    :return: The value of this option.
+    """
+    if f_option not in f_argv:
+        return f_default
+
+    idx = f_argv.index(f_option)
+
+    if idx + 1 >= len(f_argv):
+        print('Option ' + f_option + ' requires a value', file=stderr)
+        exit(1)
+
+    value = f_argv[idx + 1]
+    del f_argv[idx:idx + 2]
+
+    return value
+
+
 if __name__ == '__main__':
     stitched_image = array([], dtype=uint8)
     barcode_info = {}
 
+    database = pop_option(argv, '--db')
+
+    bin_size = pop_option(argv, '--bin')
+    bin_shape = pop_option(argv, '--bin-shape')
+
+    grid = pop_option(argv, '--grid')
+    grid = None if grid is None else [int(_) for _ in grid.split('x')]
+
+    grid_overlap = float(pop_option(argv, '--overlap', 0.1))
+
+    dedup_radius = pop_option(argv, '--dedup-radius')
+    dedup_radius = None if dedup_radius is None else int(dedup_radius)
+
+    dedup_mismatch = pop_option(argv, '--dedup-mismatch')
+    dedup_mismatch = None if dedup_mismatch is None else int(dedup_mismatch)
+
+    pyramid = pop_option(argv, '--pyramid')
+
+    processes = pop_option(argv, '--processes')
+    processes = None if processes is None else int(processes)
+
     if argv[1] == '--bg':
         stitched_image = imread(argv[2], IMREAD_GRAYSCALE)
-        barcode_info = overlap_filtering(trans_coor(stitched_image, argv[3:]))
+        barcode_info = overlap_filtering(*trans_coor(stitched_image, argv[3:], grid=grid, overlap=grid_overlap,
+                                                     processes=processes),
+                                         radius=dedup_radius, max_mismatch=dedup_mismatch)
+
+    elif grid is not None:
+        stitched_image, tile_offsets = grid_stitcher(argv[1:], grid[0], grid[1], grid_overlap, pyramid)
+        barcode_info = overlap_filtering(*trans_coor(None, argv[1:], offsets=tile_offsets, processes=processes),
+                                         radius=dedup_radius, max_mismatch=dedup_mismatch)
+
+        with open('all_tile_offsets.txt', 'wt') as OU:
+            for tile_id in range(0, len(tile_offsets)):
+                print('%s\t%05d\t%05d' % (argv[1 + tile_id], tile_offsets[tile_id][0], tile_offsets[tile_id][1]),
+                      file=OU)
 
     else:
         stitched_image = background_stitcher(argv[1:])
-        barcode_info = overlap_filtering(trans_coor(stitched_image, argv[1:]))
-
-    imwrite('all_background.tif', stitched_image)
+        barcode_info = overlap_filtering(*trans_coor(stitched_image, argv[1:], processes=processes),
+                                         radius=dedup_radius, max_mismatch=dedup_mismatch)
+
+    if pyramid is None:
+        imwrite('all_background.tif', stitched_image)
+
+    elif not isinstance(stitched_image, TiledMosaic):
+        ##################################################################
+        # Only the grid is composed into a pyramid FOV by FOV, the image #
+        # stitched in memory is written into it at once                  #
+        ##################################################################
+        stitched_mosaic = TiledMosaic(pyramid, stitched_image.shape)
+        stitched_mosaic.write_region(0, 0, stitched_image)
+        stitched_mosaic.build_pyramid()
+        ##################################################################
 
     with open('all_basecalling_data.txt', 'wt') as OU:
         for b_info in barcode_info:
             print('\t'.join((b_info, barcode_info[b_info])), file=OU)
+
+    if database is not None:
+        write_reads_into_database(((b_info,) + tuple(barcode_info[b_info].split('\t')) for b_info in barcode_info),
+                                  database)
+
+    if bin_size is not None:
+        all_count_matrix = CountMatrix(bin_size, bin_shape)
+        all_count_matrix.add_reads([(b_info,) + tuple(barcode_info[b_info].split('\t')) for b_info in barcode_info])
+        all_count_matrix.write('all_basecalling_matrix')